@@ -1,5 +1,8 @@
-from fastapi import Depends, HTTPException
+import secrets
+from typing import Optional
+from fastapi import Depends, Header, HTTPException, Query, WebSocket, WebSocketException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from app.core.config import settings
 from app.core.security import verify_token
 
 security = HTTPBearer()
@@ -8,3 +11,23 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     """Verify JWT token and return user_id"""
     user_id = verify_token(credentials)
     return user_id
+
+async def verify_admin_key(x_admin_key: Optional[str] = Header(default=None)):
+    """Admin endpoints need the ADMIN_API_KEY; without one configured, they don't exist"""
+    if not settings.ADMIN_API_KEY:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if x_admin_key is None or not secrets.compare_digest(x_admin_key.encode(), settings.ADMIN_API_KEY.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin key")
+
+async def verify_websocket_token(websocket: WebSocket, token: Optional[str] = Query(default=None)) -> dict:
+    """
+    verify_token for WebSockets. Browsers can't set headers on WebSocket requests, so the token can
+    also be passed as the `token` query parameter. Failures close the connection (policy violation).
+    """
+    scheme, _, credentials = websocket.headers.get("authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and credentials:
+        token = credentials
+    try:
+        return await verify_token(websocket, HTTPAuthorizationCredentials(scheme="Bearer", credentials=token) if token else None)
+    except HTTPException as e:
+        raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason=e.detail)
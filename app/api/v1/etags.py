@@ -0,0 +1,53 @@
+"""
+ETags and conditional GETs (`If-None-Match` -> 304) for stored results, so clients that poll for
+the same result only download it when it changed.
+
+An ETag is a hash of whatever determines the response body, e.g. a content hash or the version
+of a stored row, so it's known without building (or even loading) the body. The ETags are weak:
+CompressionMiddleware sends the same body with different content codings (gzip, zstd, br or none),
+and these are equivalent representations, not byte-for-byte identical ones.
+"""
+import hashlib
+from typing import Callable
+
+from fastapi import Request, Response
+
+from app.core.serialization import dumps
+
+# Clients may keep the response, but have to check it's still current before reusing it
+CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(*parts) -> str:
+    """A weak ETag from the parts that determine a response (anything `dumps` can serialize)"""
+    return 'W/"' + hashlib.sha256(dumps(parts)).hexdigest()[:32] + '"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Whether the request's If-None-Match includes the ETag (weak comparison, as RFC 9110 asks)"""
+    header = request.headers.get("If-None-Match")
+    if header is None:
+        return False
+    if header.strip() == "*":
+        return True
+    opaque_tag = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque_tag for tag in header.split(","))
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+
+
+def with_etag(response: Response, etag: str) -> Response:
+    response.headers.update({"ETag": etag, "Cache-Control": CACHE_CONTROL})
+    return response
+
+
+def conditional_response(request: Request, etag: str, build: Callable[[], Response]) -> Response:
+    """
+    304 Not Modified if the client has the current version, otherwise the built response with its
+    ETag. (Responses that are built asynchronously use etag_matches, not_modified & with_etag.)
+    """
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    return with_etag(build(), etag)
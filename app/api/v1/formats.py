@@ -0,0 +1,392 @@
+"""
+Response formats for /rank_ideas, selected through the `Accept` header.
+
+JSON is the default. For data science clients, the numeric results are also available as
+- Apache Arrow IPC stream / Parquet: one row per ranked idea, the coordinates and (if requested)
+  the pairwise similarities as fixed-size list columns
+- NumPy .npy (the pairwise similarity matrix) or .npz (all result arrays)
+- MessagePack / CBOR: the same structure as the JSON response, in a binary encoding
+- NDJSON: one JSON record per line (ranked ideas, then graph nodes and edges, ...), streamed while
+  it is generated, so memory stays flat however large the graph is
+
+Request bodies can likewise be sent as MessagePack or CBOR instead of JSON (see `parse_request_body`).
+"""
+import io
+import json
+from typing import Any, AsyncIterator, Iterator, List, Optional, Type, TypeVar
+
+import numpy as np
+from fastapi import HTTPException, Request, Response
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, TypeAdapter, ValidationError
+
+from app.core.serialization import FastJSONResponse, dumps
+from app.services.similarity import iter_sparse_edges
+from app.services.types import AnalysisResult
+from .models.request import AdvancedFeatures
+
+JSON = "application/json"
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+PARQUET = "application/vnd.apache.parquet"
+NPY = "application/x-npy"
+NPZ = "application/x-npz"
+MSGPACK = "application/msgpack"
+CBOR = "application/cbor"
+NDJSON = "application/x-ndjson"
+
+SUPPORTED_MEDIA_TYPES = [JSON, ARROW_STREAM, PARQUET, NPY, NPZ, MSGPACK, CBOR, NDJSON]
+ARROW_MEDIA_TYPES = {ARROW_STREAM, PARQUET}
+# Media types that can also be used for request bodies
+REQUEST_MEDIA_TYPES = [JSON, MSGPACK, CBOR]
+
+# Unregistered names some msgpack clients still send
+MEDIA_TYPE_ALIASES = {
+    "application/x-msgpack": MSGPACK,
+    "application/vnd.msgpack": MSGPACK,
+    "application/jsonl": NDJSON,
+    "application/x-jsonlines": NDJSON,
+}
+
+# Python package needed to encode / decode each optional media type
+OPTIONAL_PACKAGES = {
+    ARROW_STREAM: "pyarrow",
+    PARQUET: "pyarrow",
+    MSGPACK: "msgpack",
+    CBOR: "cbor2",
+}
+
+# NDJSON records are written in batches of this many lines; each batch waits for the previous
+# one to be sent, so a slow client slows down generation instead of filling up memory
+NDJSON_BATCH_LINES = 1000
+# Similarity rows per tile when streaming edges: a tile's candidate edges are the bulk of the memory
+NDJSON_TILE_ROWS = 64
+
+# For the OpenAPI docs of endpoints using render_response
+OPENAPI_RESPONSES = {200: {"content": {media_type: {} for media_type in SUPPORTED_MEDIA_TYPES if media_type != JSON}}}
+
+Model = TypeVar("Model", bound=BaseModel)
+
+
+def _parse_accept(accept: str) -> List[str]:
+    """Media types from an Accept header, highest quality first (ties keep header order)"""
+    ranges = []
+    for position, part in enumerate(accept.split(",")):
+        media_type, *params = [item.strip() for item in part.split(";")]
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if media_type and quality > 0:
+            media_type = media_type.lower()
+            ranges.append((-quality, position, MEDIA_TYPE_ALIASES.get(media_type, media_type)))
+    return [media_type for _, _, media_type in sorted(ranges)]
+
+
+def negotiate_response_format(request: Request) -> str:
+    """
+    Picks the response media type for a request. Falls back to JSON for missing, wildcard or
+    unknown Accept headers; raises 406 if a format is requested whose package isn't installed.
+
+    Call this before doing any work, so unsupported requests fail fast.
+    """
+    for media_type in _parse_accept(request.headers.get("accept", "")):
+        if media_type in ("*/*", "application/*"):
+            return JSON
+        if media_type not in SUPPORTED_MEDIA_TYPES:
+            continue
+        if not _is_available(media_type):
+            raise HTTPException(
+                status_code=406,
+                detail=f"{media_type} responses are not available on this server. Please use {JSON}."
+            )
+        return media_type
+    return JSON
+
+
+def _is_available(media_type: str) -> bool:
+    package = OPTIONAL_PACKAGES.get(media_type)
+    if package is None:
+        return True
+    try:
+        __import__(package)
+    except ImportError:
+        return False
+    return True
+
+
+def request_media_type(request: Request) -> str:
+    """The media type of a request body, without parameters. Missing or unknown types count as JSON."""
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    content_type = MEDIA_TYPE_ALIASES.get(content_type, content_type)
+    return content_type if content_type in REQUEST_MEDIA_TYPES else JSON
+
+
+async def parse_request_body(request: Request, model: Type[Model] | Any) -> Model | Any:
+    """
+    Validates a JSON, MessagePack or CBOR request body (by Content-Type) into `model`, a pydantic
+    model or anything with a TypeAdapter's validate_json / validate_python (see validation.py).
+
+    Binary bodies are decoded into Python objects and validated directly, JSON bodies are parsed
+    and validated in one pass by pydantic. Validation errors are raised like FastAPI's own body
+    validation (422); binary bodies without the decoder installed get 415.
+    """
+    media_type = request_media_type(request)
+    if not _is_available(media_type):
+        raise HTTPException(
+            status_code=415,
+            detail=f"{media_type} request bodies are not supported by this server. Please send {JSON}."
+        )
+
+    if isinstance(model, type) and issubclass(model, BaseModel):
+        validate_json, validate_python = model.model_validate_json, model.model_validate
+    else:
+        validate_json, validate_python = model.validate_json, model.validate_python
+
+    body = await request.body()
+    try:
+        if media_type == JSON:
+            return validate_json(body)
+        return validate_python(_decode(media_type, body))
+    except ValidationError as error:
+        raise RequestValidationError(
+            [{**e, "loc": ("body", *e["loc"])} for e in error.errors(include_url=False)],
+            body=body
+        )
+    except ValueError as error:
+        # Malformed MessagePack / CBOR
+        raise RequestValidationError(
+            [{"type": "value_error", "loc": ("body",), "msg": f"Invalid {media_type} body: {error}", "input": None}],
+            body=body
+        )
+
+
+def _decode(media_type: str, body: bytes) -> Any:
+    if media_type == MSGPACK:
+        import msgpack
+        return msgpack.unpackb(body, raw=False)
+    import cbor2
+    try:
+        return cbor2.loads(body)
+    except cbor2.CBORDecodeError as error:
+        raise ValueError(str(error)) from error
+
+
+def request_body_openapi(model: Type[BaseModel] | Any) -> dict:
+    """
+    `openapi_extra` documenting a request body that is read with parse_request_body instead of a
+    body parameter (a model or any other type, e.g. a list of models). The schema is inlined,
+    since its $defs aren't part of the components.
+    """
+    schema = TypeAdapter(model).json_schema()
+    definitions = schema.pop("$defs", {})
+
+    def inline(node):
+        if isinstance(node, dict):
+            if "$ref" in node:
+                return inline(definitions[node["$ref"].rsplit("/", 1)[-1]])
+            return {key: inline(value) for key, value in node.items()}
+        if isinstance(node, list):
+            return [inline(item) for item in node]
+        return node
+
+    schema = inline(schema)
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {media_type: {"schema": schema} for media_type in REQUEST_MEDIA_TYPES},
+        }
+    }
+
+
+def render_response(
+    media_type: str, 
+    response: dict, 
+    analysis: AnalysisResult, 
+    features: Optional[AdvancedFeatures] = None
+) -> Response:
+    """
+    Renders an assembled /rank_ideas response in the negotiated format. For NDJSON, the graph and
+    the dense pairwise matrix are generated from the analysis while streaming (see ndjson_records),
+    so they shouldn't be built beforehand.
+    """
+    if media_type == NDJSON:
+        return StreamingResponse(ndjson_batches(response, analysis, features), media_type=NDJSON)
+    if media_type == ARROW_STREAM:
+        return Response(content=to_arrow_stream(response, analysis), media_type=ARROW_STREAM)
+    if media_type == PARQUET:
+        return Response(
+            content=to_parquet(response, analysis),
+            media_type=PARQUET,
+            headers={"Content-Disposition": 'attachment; filename="ranked_ideas.parquet"'}
+        )
+    if media_type == NPY:
+        return Response(content=to_npy(analysis), media_type=NPY)
+    if media_type == NPZ:
+        return Response(content=to_npz(response, analysis), media_type=NPZ)
+    if media_type == MSGPACK:
+        return Response(content=to_msgpack(response), media_type=MSGPACK)
+    if media_type == CBOR:
+        return Response(content=to_cbor(response), media_type=CBOR)
+    return FastJSONResponse(content=response)
+
+
+def to_arrow_table(response: dict, analysis: AnalysisResult, include_matrix: Optional[bool] = None):
+    """
+    Ranked ideas as an Arrow table. Numeric columns wrap the analysis' numpy buffers without
+    copying. Row i of `pairwise_similarity` holds idea i's similarity to every idea (ranked order)
+    and, in the last position, to the centroid. The centroid's coordinates and the cluster names
+    are stored in the schema metadata.
+    """
+    import pyarrow as pa
+
+    n = len(analysis)
+    ranked_ideas = response["ranked_ideas"]
+    if include_matrix is None:
+        include_matrix = response.get("pairwise_similarity_matrix") is not None
+
+    columns = {
+        "rank": pa.array(np.arange(n, dtype=np.int32)),
+        "id": pa.array([str(idea.id) for idea in ranked_ideas], type=pa.string()),
+        "author_id": pa.array([idea.author_id for idea in ranked_ideas], type=pa.string()),
+        "idea": pa.array([idea.idea for idea in ranked_ideas], type=pa.string()),
+        "similarity_score": pa.array(np.ascontiguousarray(analysis.similarity[:n])),
+        "cluster_id": pa.array(analysis.cluster_labels.astype(np.int32)),
+        "coordinates": pa.FixedSizeListArray.from_arrays(pa.array(analysis.coords[:n].ravel()), 2),
+    }
+    if include_matrix:
+        matrix = analysis.pairwise_similarity
+        columns["pairwise_similarity"] = pa.FixedSizeListArray.from_arrays(
+            pa.array(matrix[:n].ravel()), matrix.shape[1]
+        )
+
+    metadata = {
+        "centroid_coordinates": json.dumps(analysis.coords[n].tolist()),
+    }
+    if response.get("cluster_names"):
+        metadata["cluster_names"] = json.dumps([dict(name) for name in response["cluster_names"]])
+    return pa.table(columns).replace_schema_metadata(metadata)
+
+
+def to_arrow_stream(response: dict, analysis: AnalysisResult) -> bytes:
+    import pyarrow as pa
+
+    table = to_arrow_table(response, analysis)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def to_parquet(response: dict, analysis: AnalysisResult) -> bytes:
+    import pyarrow.parquet as pq
+
+    buffer = io.BytesIO()
+    pq.write_table(to_arrow_table(response, analysis), buffer)
+    return buffer.getvalue()
+
+
+def to_npy(analysis: AnalysisResult) -> bytes:
+    """The (n+1) x (n+1) pairwise similarity matrix: ideas in ranked order, centroid last"""
+    buffer = io.BytesIO()
+    np.save(buffer, analysis.pairwise_similarity, allow_pickle=False)
+    return buffer.getvalue()
+
+
+def to_npz(response: dict, analysis: AnalysisResult) -> bytes:
+    """All result arrays, in ranked order (arrays with n+1 rows have the centroid last)"""
+    n = len(analysis)
+    arrays = {
+        "id": np.array([str(idea.id) for idea in response["ranked_ideas"]]),
+        "input_index": analysis.order,
+        "similarity_score": analysis.similarity[:n],
+        "cluster_id": analysis.cluster_labels,
+        "coordinates": analysis.coords,
+    }
+    if response.get("pairwise_similarity_matrix") is not None:
+        arrays["pairwise_similarity"] = analysis.pairwise_similarity
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def _to_builtin(obj: Any) -> Any:
+    """Fallback for the binary encoders: models become dicts, numpy values Python ones"""
+    if isinstance(obj, BaseModel):
+        return dict(obj)
+    if isinstance(obj, (np.ndarray, np.generic)):
+        # One C-level pass; the nested lists are what the encoders need anyway
+        return obj.tolist()
+    raise TypeError(f"Type is not serializable: {type(obj).__name__}")
+
+
+def to_msgpack(response: Any) -> bytes:
+    """The response with the same structure as its JSON, as MessagePack"""
+    import msgpack
+    return msgpack.packb(response, default=_to_builtin, use_bin_type=True)
+
+
+def to_cbor(response: Any) -> bytes:
+    """The response with the same structure as its JSON, as CBOR"""
+    import cbor2
+    return cbor2.dumps(response, default=lambda encoder, obj: encoder.encode(_to_builtin(obj)))
+
+
+async def ndjson_batches(response: dict, analysis: AnalysisResult, features: Optional[AdvancedFeatures]) -> AsyncIterator[bytes]:
+    batch = []
+    for record in ndjson_records(response, analysis, features):
+        batch.append(dumps(record) + b"\n")
+        if len(batch) >= NDJSON_BATCH_LINES:
+            yield b"".join(batch)
+            batch = []
+    if batch:
+        yield b"".join(batch)
+
+
+def ndjson_records(response: dict, analysis: AnalysisResult, features: Optional[AdvancedFeatures]) -> Iterator[dict]:
+    """
+    The NDJSON records of a response, each with a "type", in this order:
+    ranked_idea, node & edge (relationship graph), cluster_name, and the pairwise similarity
+    matrix as one pairwise_similarity_row per row (dense JSON) or a pairwise_similarity_matrix
+    record (other formats / encodings).
+
+    Edges and matrix rows are computed one tile at a time, and nothing is kept after it's yielded.
+    """
+    ranked_ideas = response["ranked_ideas"]
+    for idea in ranked_ideas:
+        yield {"type": "ranked_idea", **dict(idea)}
+
+    if features and features.relationship_graph:
+        n = len(ranked_ideas)
+        ids = [idea.id for idea in ranked_ideas] + ["Centroid"]
+        for node_id, (x, y) in zip(ids, analysis.coords[:n + 1].tolist()):
+            yield {"type": "node", "id": node_id, "coordinates": {"x": x, "y": y}}
+
+        edges = iter_sparse_edges(
+            analysis.similarity_tiles(NDJSON_TILE_ROWS), 
+            n, 
+            top_k=features.relationship_graph_top_k, 
+            min_similarity=features.relationship_graph_min_similarity
+        )
+        for sources, targets, weights in edges:
+            # A tile can hold millions of edges; only convert a slice at a time to Python values
+            for start in range(0, len(sources), NDJSON_BATCH_LINES):
+                end = start + NDJSON_BATCH_LINES
+                for i, j, similarity in zip(sources[start:end].tolist(), targets[start:end].tolist(), weights[start:end].tolist()):
+                    yield {"type": "edge", "from_id": ids[i], "to_id": ids[j], "similarity": similarity}
+        for idea in ranked_ideas:
+            yield {"type": "edge", "from_id": idea.id, "to_id": "Centroid", "similarity": idea.similarity_score}
+
+    for name in response.get("cluster_names") or []:
+        yield {"type": "cluster_name", **dict(name)}
+
+    matrix = response.get("pairwise_similarity_matrix")
+    if isinstance(matrix, BaseModel):
+        yield {"type": "pairwise_similarity_matrix", **dict(matrix)}
+    elif features and features.pairwise_similarity_matrix:
+        for start, tile in analysis.pairwise_similarity_tiles(NDJSON_TILE_ROWS):
+            for offset, row in enumerate(tile):
+                yield {"type": "pairwise_similarity_row", "index": start + offset, "values": row}
@@ -0,0 +1,66 @@
+"""
+`Idempotency-Key` handling for endpoints that charge credits (see app/services/idempotency.py).
+"""
+import hashlib
+from typing import Awaitable, Callable
+
+from fastapi import HTTPException, Request, Response
+
+from app.core.config import settings
+from app.core.serialization import dumps
+from app.services.idempotency import IdempotencyStore, StoredResponse
+
+IDEMPOTENCY_KEY = "Idempotency-Key"
+# Set on responses that are replays of a stored response
+IDEMPOTENT_REPLAYED = "Idempotent-Replayed"
+
+idempotency_store = IdempotencyStore(
+    settings.IDEMPOTENCY_DATABASE,
+    ttl=settings.IDEMPOTENCY_TTL,
+    lock_timeout=settings.IDEMPOTENCY_LOCK_TIMEOUT,
+)
+
+
+def request_fingerprint(*parts) -> str:
+    """Identifies a request by what determines its response, e.g. the parsed body & response format"""
+    return hashlib.sha256(dumps(parts)).hexdigest()
+
+
+async def idempotent(
+    request: Request,
+    user_id: str,
+    fingerprint: Callable[[], str],
+    handle: Callable[[], Awaitable[Response]],
+) -> Response:
+    """
+    Runs `handle` unless the request's Idempotency-Key was used before, in which case the stored
+    response is returned. Only successful responses are stored; after a failure, the key can be
+    retried. Without the header, this just runs `handle` (and `fingerprint` isn't computed).
+
+    Raises:
+        HTTPException(400): If the key is empty or too long
+        HTTPException(409): If a request with the key is still in progress
+        HTTPException(422): If the key was used for a different request
+    """
+    key = request.headers.get(IDEMPOTENCY_KEY)
+    if key is None:
+        return await handle()
+
+    # Trial mode users get a new id with every request; their keys can only be global
+    owner = "*" if settings.is_in_trial_mode else user_id
+    stored = await idempotency_store.begin(owner, key, fingerprint())
+    if stored is not None:
+        return Response(content=stored.body, status_code=stored.status_code, headers={**stored.headers, IDEMPOTENT_REPLAYED: "true"})
+
+    try:
+        response = await handle()
+    except BaseException:
+        await idempotency_store.release(owner, key)
+        raise
+
+    if 200 <= response.status_code < 300:
+        headers = {name: value for name, value in response.headers.items() if name != "content-length"}
+        await idempotency_store.complete(owner, key, StoredResponse(response.status_code, headers, response.body))
+    else:
+        await idempotency_store.release(owner, key)
+    return response
@@ -0,0 +1,403 @@
+"""
+Reading /rank_ideas request bodies into an `IdeaBatch`.
+
+JSON bodies are parsed incrementally while they arrive: each element of the `ideas` array is
+validated as soon as it's complete, empty ideas are dropped and the ideas and their bytes are
+counted on the fly. Reading stops as soon as MAX_IDEAS or MAX_IDEA_BYTES is exceeded, instead
+of after the whole body has been received, parsed and validated.
+
+MessagePack / CBOR bodies (and JSON that isn't shaped like an IdeaRequest) are decoded as a whole
+and go through the same filtering and limits afterwards.
+"""
+import codecs
+import json
+import re
+from typing import Any, Dict, Iterable, List, Optional
+
+from fastapi import HTTPException, Request
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+
+from . import validation
+from .formats import JSON, parse_request_body, request_media_type
+from .models.request import AdvancedFeatures, IdeaInputData, IdeaRequestData
+
+MAX_IDEAS = 10_000
+MAX_IDEA_BYTES = 10_000_000
+
+TOO_MANY_IDEAS = f"Please provide less than {MAX_IDEAS} items to analyze"
+TOO_MANY_BYTES = f"Please provide less than {MAX_IDEA_BYTES // 1_000_000}MB of data to analyze"
+
+# /rank_ideas/batch: idea sets per request. Each set has the limits of a single request, and
+# all sets together stay within MAX_IDEA_BYTES
+MAX_BATCH_REQUESTS = 100
+TOO_MANY_REQUESTS = f"Please provide at most {MAX_BATCH_REQUESTS} idea sets per batch"
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r"[ \t\n\r]*")
+
+# Ideas are validated in batches of this size (so the limits are checked every this many ideas)
+VALIDATION_BATCH = 500
+
+
+class IdeaBatch:
+    """
+    The ideas of a request that are worth analyzing, as parallel lists.
+
+    Only non-empty ideas are included: `texts` are their texts, `ids` and `author_ids` their ids
+    as sent (None if missing) and `total_bytes` the UTF-8 size of the texts. If a limit was
+    exceeded, `limit_error` holds the message for the client and the batch is incomplete.
+    """
+    __slots__ = ("texts", "ids", "author_ids", "total_bytes", "advanced_features", "limit_error")
+
+    def __init__(
+        self,
+        texts: List[str],
+        ids: List[Optional[int | str]],
+        author_ids: List[Optional[int | str]],
+        total_bytes: int,
+        advanced_features: Optional[AdvancedFeatures] = None,
+        limit_error: Optional[str] = None,
+    ):
+        self.texts = texts
+        self.ids = ids
+        self.author_ids = author_ids
+        self.total_bytes = total_bytes
+        self.advanced_features = advanced_features
+        self.limit_error = limit_error
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def __repr__(self) -> str:
+        return (
+            f"IdeaBatch({len(self)} ideas, {self.total_bytes} bytes, "
+            f"advanced_features={self.advanced_features!r}, limit_error={self.limit_error!r})"
+        )
+
+
+class _IdeaCollector:
+    """Filters and counts validated ideas, and tracks the limits"""
+    def __init__(self):
+        self.texts: List[str] = []
+        self.ids: List[Optional[int | str]] = []
+        self.author_ids: List[Optional[int | str]] = []
+        self.total_bytes = 0
+        self.limit_error: Optional[str] = None
+
+    def add(self, ideas: Iterable[IdeaInputData]) -> bool:
+        """Adds the non-empty ideas; False once a limit is exceeded"""
+        texts, ids, author_ids = self.texts, self.ids, self.author_ids
+        for idea in ideas:
+            text = idea["idea"]
+            if not text.strip():
+                continue
+            texts.append(text)
+            ids.append(idea.get("id"))
+            author_ids.append(idea.get("author_id"))
+            self.total_bytes += len(text.encode("utf-8"))
+            if len(texts) > MAX_IDEAS:
+                self.limit_error = TOO_MANY_IDEAS
+            elif self.total_bytes > MAX_IDEA_BYTES:
+                self.limit_error = TOO_MANY_BYTES
+            if self.limit_error is not None:
+                return False
+        return True
+
+    def batch(self, advanced_features: Optional[AdvancedFeatures] = None) -> IdeaBatch:
+        return IdeaBatch(self.texts, self.ids, self.author_ids, self.total_bytes, advanced_features, self.limit_error)
+
+
+def batch_from_data(data: IdeaRequestData) -> IdeaBatch:
+    """IdeaBatch of already validated request data"""
+    collector = _IdeaCollector()
+    collector.add(data["ideas"])
+    return collector.batch(data.get("advanced_features"))
+
+
+def batch_to_data(batch: IdeaBatch) -> dict:
+    """The request data of a batch (its non-empty ideas); batch_from_data turns it back into a batch"""
+    return {
+        "ideas": [
+            {"id": id, "author_id": author_id, "idea": text}
+            for text, id, author_id in zip(batch.texts, batch.ids, batch.author_ids)
+        ],
+        "advanced_features": batch.advanced_features,
+    }
+
+
+async def read_idea_batch(request: Request) -> IdeaBatch:
+    """
+    Reads an IdeaRequest body (JSON, MessagePack or CBOR) into an IdeaBatch.
+
+    Validation errors are raised as RequestValidationError (422), exactly like FastAPI's body
+    validation with the IdeaRequest model. An exceeded limit doesn't raise: the batch is returned
+    early, with `limit_error` set (so invalid ideas after that point aren't reported).
+    """
+    if request_media_type(request) != JSON:
+        return batch_from_data(await parse_request_body(request, validation.IDEA_REQUEST))
+    return await _IdeaStreamParser().parse(request)
+
+
+async def read_idea_batches(request: Request) -> List[IdeaBatch]:
+    """
+    Reads a /rank_ideas/batch body, a list of IdeaRequests (JSON, MessagePack or CBOR), into one
+    IdeaBatch per set. The body is decoded as a whole; a set over the limits gets its `limit_error`
+    like a single request, too many sets or bytes in total are rejected with 400.
+    """
+    data = await parse_request_body(request, validation.IDEA_REQUESTS)
+    if len(data) > MAX_BATCH_REQUESTS:
+        raise HTTPException(status_code=400, detail=TOO_MANY_REQUESTS)
+    batches = [batch_from_data(item) for item in data]
+    if sum(batch.total_bytes for batch in batches) > MAX_IDEA_BYTES:
+        raise HTTPException(status_code=400, detail=TOO_MANY_BYTES)
+    return batches
+
+
+class _Incomplete(Exception):
+    """The buffer ends before the current value does"""
+
+
+class _NotAnIdeaRequest(Exception):
+    """The body doesn't have the shape of an IdeaRequest; validate it as a whole instead"""
+
+
+class _IdeaStreamParser:
+    """
+    Incremental parser for `{"ideas": [...], "advanced_features": {...}}` (keys in any order).
+
+    Decoded text is appended to a buffer; the parser consumes complete tokens and values from
+    `position` and, if a value isn't complete yet, waits for the next chunk. A value that still
+    can't be parsed is only retried once the buffer has grown by half, so a long value arriving
+    in many small chunks isn't re-scanned over and over.
+    """
+    def __init__(self):
+        self.buffer = ""
+        self.position = 0
+        self.committed = 0  # position after the last complete step
+        self.consumed = 0  # characters dropped from the front of the buffer
+        self.eof = False
+        self.retry_at = 0
+        self.collector = _IdeaCollector()
+        self.errors: List[Dict[str, Any]] = []
+        self.fields: Dict[str, Any] = {}
+        self.pending: List[Any] = []  # parsed, not yet validated ideas
+        self.index = 0  # index of the next idea to validate
+        self.state = "start"
+
+    async def parse(self, request: Request) -> IdeaBatch:
+        utf8 = codecs.getincrementaldecoder("utf-8")()
+        chunks = request.stream()
+        received = []
+        try:
+            try:
+                async for chunk in chunks:
+                    if received is not None:
+                        received.append(chunk)
+                    self.buffer += utf8.decode(chunk)
+                    if len(self.buffer) >= self.retry_at and self._advance():
+                        return self._finish()
+                    if "ideas" in self.fields:
+                        # Past the point where the body could turn out not to be an IdeaRequest
+                        received = None
+                self.buffer += utf8.decode(b"", final=True)
+            except UnicodeDecodeError:
+                self._invalid_json(len(self.buffer), "Invalid UTF-8")
+
+            self.eof = True
+            if not self._advance():
+                self._invalid_json(len(self.buffer), "Unexpected end of data")
+        except _NotAnIdeaRequest:
+            # Validate the complete body as usual, for the usual errors
+            async for chunk in chunks:
+                received.append(chunk)
+            return self._validate_whole(b"".join(received))
+        return self._finish()
+
+    def _advance(self) -> bool:
+        """Consumes as much of the buffer as possible; True once the body is complete (or a limit was hit)"""
+        while self.collector.limit_error is None:
+            if self.state == "done":
+                self._skip_whitespace()
+                if self.position < len(self.buffer):
+                    self._invalid_json(self.position, "Extra data")
+                return self.eof
+            try:
+                self._step()
+                self.committed = self.position
+            except _Incomplete:
+                # Steps are all-or-nothing: start over once there is more data
+                self.position = self.committed
+                self._validate_pending()
+                self._compact()
+                self.retry_at = len(self.buffer) + len(self.buffer) // 2
+                return False
+            self._validate_pending()
+        return True
+
+    def _step(self) -> None:
+        """Consumes one token or value, depending on the state"""
+        character = self._next_character()
+        state = self.state
+
+        if state == "start":
+            if character != "{":
+                raise _NotAnIdeaRequest()
+            self.position += 1
+            self.state = "first_key"
+        elif state in ("first_key", "key"):
+            if character == "}" and state == "first_key":
+                raise _NotAnIdeaRequest()  # {}: "ideas" is missing
+            if character != '"':
+                self._invalid_json(self.position, "Expecting property name enclosed in double quotes")
+            key = self._value()
+            self._expect(":")
+            if key == "ideas":
+                if "ideas" in self.fields:
+                    self._invalid_json(self.position, "Duplicate 'ideas' key")
+                if self._next_character() != "[":
+                    raise _NotAnIdeaRequest()
+                self.position += 1
+                self.fields["ideas"] = None
+                self.state = "first_idea"
+            else:
+                self.fields[key] = self._value()
+                self.state = "key_separator"
+        elif state == "key_separator":
+            self._separator(character, "}", "key", "done")
+        else:
+            self._read_ideas()
+
+    def _separator(self, character: str, end: str, next_state: str, end_state: str) -> None:
+        if character == ",":
+            self.state = next_state
+        elif character == end:
+            self.state = end_state
+        else:
+            self._invalid_json(self.position, f"Expecting ',' delimiter")
+        self.position += 1
+
+    def _read_ideas(self) -> None:
+        """
+        Reads elements of the ideas array, up to VALIDATION_BATCH of them, into `pending`. This is
+        where nearly all of the body is, so it's a single loop rather than one step per token.
+        Every complete element (and separator) is committed right away.
+        """
+        buffer, position, state = self.buffer, self.position, self.state
+        end = len(buffer)
+        pending = self.pending
+        while len(pending) < VALIDATION_BATCH:
+            position = _whitespace.match(buffer, position).end()
+            if position >= end:
+                raise _Incomplete()
+            character = buffer[position]
+            if state == "idea_separator" or (state == "first_idea" and character == "]"):
+                if character == "]":
+                    state = "key_separator"
+                elif character == "," and state == "idea_separator":
+                    state = "idea"
+                else:
+                    self._invalid_json(position, "Expecting ',' delimiter")
+                position += 1
+            else:
+                try:
+                    item, position = _decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError as error:
+                    if not self.eof:
+                        raise _Incomplete()
+                    self._invalid_json(error.pos, error.msg)
+                if position == end and not self.eof:
+                    raise _Incomplete()  # e.g. more digits of a number might follow
+                pending.append(item)
+                state = "idea_separator"
+            self.position = self.committed = position
+            self.state = state
+            if state == "key_separator":
+                return
+
+    def _validate_pending(self) -> None:
+        if not self.pending:
+            return
+        items, self.pending = self.pending, []
+        index, self.index = self.index, self.index + len(items)
+        try:
+            ideas = validation.IDEAS.validate_python(items)
+        except ValidationError as error:
+            self.errors.extend(
+                {**e, "loc": ("body", "ideas", index + e["loc"][0], *e["loc"][1:])}
+                for e in error.errors(include_url=False)
+            )
+            return
+        if not self.errors:
+            # Once the request is known to be invalid, only keep collecting errors
+            self.collector.add(ideas)
+
+    def _next_character(self) -> str:
+        self._skip_whitespace()
+        if self.position >= len(self.buffer):
+            raise _Incomplete()
+        return self.buffer[self.position]
+
+    def _skip_whitespace(self) -> None:
+        self.position = _whitespace.match(self.buffer, self.position).end()
+
+    def _expect(self, character: str) -> None:
+        if self._next_character() != character:
+            self._invalid_json(self.position, f"Expecting '{character}' delimiter")
+        self.position += 1
+
+    def _value(self) -> Any:
+        """Decodes the complete JSON value at the current position"""
+        self._next_character()
+        try:
+            value, end = _decoder.raw_decode(self.buffer, self.position)
+        except json.JSONDecodeError as error:
+            if not self.eof:
+                raise _Incomplete()
+            self._invalid_json(error.pos, error.msg)
+        if end == len(self.buffer) and not self.eof:
+            raise _Incomplete()  # e.g. more digits of a number might follow
+        self.position = end
+        return value
+
+    def _compact(self) -> None:
+        """Drops the consumed part of the buffer"""
+        if self.position:
+            self.buffer = self.buffer[self.position:]
+            self.consumed += self.position
+            self.position = self.committed = 0
+
+    def _invalid_json(self, position: int, message: str) -> None:
+        raise RequestValidationError([{
+            "type": "json_invalid",
+            "loc": ("body", self.consumed + position),
+            "msg": "JSON decode error",
+            "input": {},
+            "ctx": {"error": message},
+        }])
+
+    def _finish(self) -> IdeaBatch:
+        if self.collector.limit_error is not None:
+            return self.collector.batch()
+
+        advanced_features = None
+        fields = dict(self.fields)
+        if "ideas" in fields:
+            fields["ideas"] = []
+        try:
+            # Validates everything except the ideas, which were validated in batches
+            advanced_features = validation.IDEA_REQUEST.validate_python(fields).get("advanced_features")
+        except ValidationError as error:
+            self.errors.extend({**e, "loc": ("body", *e["loc"])} for e in error.errors(include_url=False))
+        if self.errors:
+            raise RequestValidationError(self.errors)
+        return self.collector.batch(advanced_features)
+
+    def _validate_whole(self, body: bytes) -> IdeaBatch:
+        try:
+            data = validation.IDEA_REQUEST.validate_json(body)
+        except ValidationError as error:
+            raise RequestValidationError(
+                [{**e, "loc": ("body", *e["loc"])} for e in error.errors(include_url=False)]
+            )
+        return batch_from_data(data)
@@ -0,0 +1,227 @@
+"""
+Live ranking of analysis sessions over WebSockets (see /sessions/{id}/live).
+
+Everyone subscribed to a session shares one channel. Ideas submitted within BATCH_WINDOW of
+each other are added to the session together, with one update of the analysis, and everyone gets
+the changes: the new ideas, and the existing ideas whose rank, cluster or (beyond SCORE_TOLERANCE)
+similarity score changed. Changes are relative to the last state that was broadcast, so
+subscribers that apply them in order (see `version`) stay in sync.
+
+Messages are JSON objects with a `type`:
+- to the client: `snapshot` (on subscribing), `update`, `accepted` (to the submitter) and `error`
+- from the client: `add_ideas`, with `ideas` like in a /rank_ideas request
+"""
+import asyncio
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+import numpy as np
+from fastapi import HTTPException, WebSocket
+
+from app.core.serialization import dumps
+from app.services.credits import CreditService
+from app.services.sessions import Session
+from .ingest import IdeaBatch
+
+# Seconds to wait for more submissions before updating the analysis
+BATCH_WINDOW = 0.25
+# Score changes smaller than this aren't sent (the centroid moves a little with every new idea)
+SCORE_TOLERANCE = 1e-4
+
+# Adds a batch of ideas to a session; see routes/sessions.add_ideas
+AddIdeas = Callable[[Session, IdeaBatch], Awaitable[bool]]
+
+
+@dataclass
+class RankingState:
+    """Rank, score & cluster of every idea, by input index, as last sent to subscribers"""
+    version: int
+    analyzed: int  # ideas in the session's last full analysis
+    rank: np.ndarray
+    score: np.ndarray
+    cluster: np.ndarray
+
+    @classmethod
+    def of(cls, session: Session) -> "RankingState":
+        analysis = session.analysis
+        n = len(analysis)
+        rank, score, cluster = np.empty(n, dtype=np.intp), np.empty(n), np.empty(n, dtype=np.intp)
+        rank[analysis.order] = np.arange(n)
+        score[analysis.order] = analysis.similarity[:n]
+        cluster[analysis.order] = analysis.cluster_labels
+        return cls(session.version, session.analyzed, rank, score, cluster)
+
+
+def idea_entries(session: Session, state: RankingState, indices: np.ndarray, with_text: bool) -> List[dict]:
+    ranks, scores, clusters = state.rank[indices].tolist(), state.score[indices].tolist(), state.cluster[indices].tolist()
+    entries = []
+    for position, index in enumerate(indices.tolist()):
+        entry = {
+            "index": index,  # position in the order the ideas were added; ids needn't be unique
+            "id": session.ids[index],
+            "rank": ranks[position],
+            "similarity_score": scores[position],
+            "cluster_id": clusters[position],
+        }
+        if with_text:
+            entry["author_id"] = session.author_ids[index]
+            entry["idea"] = session.analysis.ideas[index]
+        entries.append(entry)
+    return entries
+
+
+def ranking_changes(session: Session, before: RankingState, after: RankingState) -> dict:
+    """The `update` message from one broadcast state to the next"""
+    n = len(before.rank)
+    changed = np.flatnonzero(
+        (before.rank != after.rank[:n])
+        | (before.cluster != after.cluster[:n])
+        | (np.abs(before.score - after.score[:n]) >= SCORE_TOLERANCE)
+    )
+    return {
+        "type": "update",
+        "version": after.version,
+        "total": len(after.rank),
+        "reanalyzed": after.analyzed != before.analyzed,
+        "added": idea_entries(session, after, np.arange(n, len(after.rank)), with_text=True),
+        "changed": idea_entries(session, after, changed, with_text=False),
+    }
+
+
+@dataclass
+class Submission:
+    websocket: WebSocket
+    user_id: str
+    batch: IdeaBatch
+
+
+class LiveChannel:
+    def __init__(self, session: Session, add_ideas: AddIdeas):
+        self.session = session
+        self.add_ideas = add_ideas
+        self.subscribers: Set[WebSocket] = set()
+        # Submissions waiting for the next batch, which is scheduled while there are any
+        self.pending: List[Submission] = []
+        self.state = RankingState.of(session)
+        self._scheduled = False
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def pending_ideas(self) -> int:
+        return sum(len(submission.batch) for submission in self.pending)
+
+    @property
+    def pending_bytes(self) -> int:
+        return sum(submission.batch.total_bytes for submission in self.pending)
+
+    async def send(self, websocket: WebSocket, message: dict) -> bool:
+        try:
+            await websocket.send_text(dumps(message).decode())
+            return True
+        except Exception:
+            # Gone; its receive loop unsubscribes it
+            return False
+
+    async def broadcast(self, message: dict):
+        await asyncio.gather(*(self.send(websocket, message) for websocket in list(self.subscribers)))
+
+    async def subscribe(self, websocket: WebSocket):
+        """Adds a subscriber and sends it the whole ranking; later updates are relative to it"""
+        message = self._advance()
+        others = list(self.subscribers)
+        self.subscribers.add(websocket)
+        state = self.state
+        snapshot = {
+            "type": "snapshot",
+            "version": state.version,
+            "total": len(state.rank),
+            "ideas": idea_entries(self.session, state, self.session.analysis.order, with_text=True),
+        }
+        if message is not None:
+            await asyncio.gather(*(self.send(other, message) for other in others))
+        await self.send(websocket, snapshot)
+
+    def unsubscribe(self, websocket: WebSocket):
+        self.subscribers.discard(websocket)
+        self._close_if_idle()
+
+    def submit(self, submission: Submission):
+        """Queues ideas; they're added together with the others that arrive within BATCH_WINDOW"""
+        self.pending.append(submission)
+        if not self._scheduled:
+            self._scheduled = True
+            task = asyncio.create_task(self._add_pending())
+            self._tasks.add(task)
+            task.add_done_callback(self._task_done)
+
+    def _task_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        self._close_if_idle()
+
+    def _close_if_idle(self):
+        if not self.subscribers and not self.pending and not self._tasks and live_channels.get(self.session.id) is self:
+            del live_channels[self.session.id]
+
+    async def _add_pending(self):
+        await asyncio.sleep(BATCH_WINDOW)
+        # Submissions from here on go into the next batch, which is added after this one (see Session.lock)
+        submissions, self.pending, self._scheduled = self.pending, [], False
+        batches = [submission.batch for submission in submissions]
+        batch = IdeaBatch(
+            [text for batch in batches for text in batch.texts],
+            [id for batch in batches for id in batch.ids],
+            [author_id for batch in batches for author_id in batch.author_ids],
+            sum(batch.total_bytes for batch in batches),
+        )
+        try:
+            await self.add_ideas(self.session, batch)
+        except HTTPException as e:
+            await self._reject(submissions, e.detail)
+            return
+        except ValueError:
+            await self._reject(submissions, "The analysis is too large for a session")
+            return
+        except Exception as e:
+            print(f"Adding ideas to session {self.session.id} failed: {e}")
+            await self._reject(submissions, "The analysis failed")
+            return
+
+        for submission in submissions:
+            await CreditService.deduct_credits(submission.user_id, "basic_analysis", len(submission.batch), submission.batch.total_bytes)
+            await self.send(submission.websocket, {"type": "accepted", "count": len(submission.batch)})
+        await self.publish()
+
+    async def _reject(self, submissions: List[Submission], detail: str):
+        await asyncio.gather(*(self.send(submission.websocket, {"type": "error", "detail": detail}) for submission in submissions))
+
+    def _advance(self) -> Optional[dict]:
+        """The changes from the last broadcast state to the session's current one, which becomes the new state"""
+        if self.session.version == self.state.version:
+            return None
+        before, after = self.state, RankingState.of(self.session)
+        self.state = after
+        return ranking_changes(self.session, before, after)
+
+    async def publish(self):
+        """Sends the changes since the last broadcast, if there are any"""
+        message = self._advance()
+        if message is not None:
+            await self.broadcast(message)
+
+
+# Session id -> its channel, while anyone is subscribed (or ideas are pending)
+live_channels: Dict[str, LiveChannel] = {}
+
+
+def channel_for(session: Session, add_ideas: AddIdeas) -> LiveChannel:
+    channel = live_channels.get(session.id)
+    if channel is None:
+        channel = live_channels[session.id] = LiveChannel(session, add_ideas)
+    return channel
+
+
+async def publish(session: Session):
+    """Tells a session's subscribers about ideas that were added outside the channel (over HTTP)"""
+    channel = live_channels.get(session.id)
+    if channel is not None:
+        await channel.publish()
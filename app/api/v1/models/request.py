@@ -1,5 +1,6 @@
 from pydantic import BaseModel, BeforeValidator, Field
-from typing import Annotated, List, Dict, Optional, Union, Any
+from typing import Annotated, List, Dict, Literal, Optional, Union, Any
+from typing_extensions import NotRequired, TypedDict
 
 # Define a validator function to convert any idea value to string
 def ensure_string(v: Any) -> str:
@@ -16,7 +17,34 @@ class AdvancedFeatures(BaseModel):
     relationship_graph: bool = False
     pairwise_similarity_matrix: bool = False
     cluster_names: bool = False
+    
+    # Relationship graph sparsification; without either option the graph connects every pair of ideas
+    relationship_graph_top_k: Optional[int] = Field(default=None, ge=1, description="Only keep each idea's k most similar neighbours")
+    relationship_graph_min_similarity: Optional[float] = Field(default=None, ge=-1, le=1, description="Only keep edges with at least this similarity")
+    relationship_graph_format: Literal["objects", "columnar"] = Field(default="objects", description="'columnar' returns parallel arrays instead of one object per node/edge")
+    
+    # Pairwise similarity matrix encoding; by default the full matrix as nested JSON arrays
+    pairwise_similarity_format: Literal["dense", "upper_triangle", "topk"] = Field(default="dense", description="'upper_triangle' only returns the upper triangle (incl. diagonal) of the symmetric matrix; 'topk' only each idea's most similar ideas, CSR-style")
+    pairwise_similarity_encoding: Literal["json", "float32", "float16", "uint8"] = Field(default="json", description="Binary encodings return base64-packed little-endian values; uint8 is quantized")
+    pairwise_similarity_top_k: int = Field(default=10, ge=1, description="Number of neighbours per idea for the 'topk' format")
 
 class IdeaRequest(BaseModel):
     ideas: List[IdeaInput]
     advanced_features: Optional[AdvancedFeatures] = None
+
+# Sent over /sessions/{id}/live to add ideas to the session
+class LiveAddIdeas(BaseModel):
+    type: Literal["add_ideas"]
+    ideas: List[IdeaInput]
+
+
+# Plain-dict mirrors of the models above, for validating large requests without building a model
+# instance per idea (see app/api/v1/validation.py). Keep them in sync with the models!
+class IdeaInputData(TypedDict):
+    id: NotRequired[Optional[int | str]]
+    author_id: NotRequired[Optional[int | str]]
+    idea: Annotated[str, BeforeValidator(ensure_string)]
+
+class IdeaRequestData(TypedDict):
+    ideas: List[IdeaInputData]
+    advanced_features: NotRequired[Optional[AdvancedFeatures]]
@@ -1,5 +1,6 @@
+from datetime import datetime
 from pydantic import BaseModel
-from typing import List, Dict, Optional
+from typing import List, Dict, Literal, Optional, Union
 
 from app.services.types import ClusterName, RankedIdea
 
@@ -20,8 +21,112 @@ class RelationshipGraph(BaseModel):
     nodes: List[GraphNode]
     edges: List[GraphEdge]
 
+class ColumnarGraphNodes(BaseModel):
+    id: List[int | str]
+    x: List[float]
+    y: List[float]
+
+class ColumnarGraphEdges(BaseModel):
+    # Indices into the node arrays
+    source: List[int]
+    target: List[int]
+    similarity: List[float]
+
+class ColumnarRelationshipGraph(BaseModel):
+    """Same graph as RelationshipGraph, encoded as parallel arrays. The centroid is the last node."""
+    format: Literal["columnar"] = "columnar"
+    nodes: ColumnarGraphNodes
+    edges: ColumnarGraphEdges
+
+class EncodedSimilarityMatrix(BaseModel):
+    """
+    Compact pairwise similarity matrix. `data` holds the dense matrix (row-major), its upper 
+    triangle incl. diagonal (in np.triu_indices order) or, for 'topk', the CSR values: the 
+    neighbours of idea i are indices[indptr[i]:indptr[i+1]] with similarities in the same slice 
+    of `data`, most similar first. Values are JSON numbers or base64-packed `dtype` values; 
+    uint8 values decode as offset + value * scale.
+    """
+    format: Literal["dense", "upper_triangle", "topk"]
+    shape: List[int]
+    encoding: Literal["json", "float32", "float16", "uint8"]
+    dtype: Optional[str] = None
+    offset: Optional[float] = None
+    scale: Optional[float] = None
+    data: Union[List[float], str]
+    # 'topk' only
+    k: Optional[int] = None
+    indices: Optional[List[int]] = None
+    indptr: Optional[List[int]] = None
+
 class AnalysisResponse(BaseModel):
     ranked_ideas: List[RankedIdea]
-    relationship_graph: Optional[RelationshipGraph] = None
-    pairwise_similarity_matrix: Optional[List[List[float]]] = None
+    relationship_graph: Optional[Union[RelationshipGraph, ColumnarRelationshipGraph]] = None
+    pairwise_similarity_matrix: Optional[Union[List[List[float]], EncodedSimilarityMatrix]] = None
     cluster_names: Optional[List[ClusterName]] = None
+
+class BatchResult(BaseModel):
+    # 200, or the status code of the error for this set
+    status: int
+    result: Optional[AnalysisResponse] = None
+    error: Optional[str] = None
+
+class BatchAnalysisResponse(BaseModel):
+    results: List[BatchResult]
+
+class JobResponse(BaseModel):
+    id: str
+    status: Literal["queued", "running", "succeeded", "failed"]
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    # Finished jobs are deleted after this
+    expires_at: Optional[datetime] = None
+    result: Optional[AnalysisResponse] = None
+    error: Optional[str] = None
+
+class CacheTierStats(BaseModel):
+    name: str
+    entries: int
+    bytes: int
+    max_bytes: int
+    evictions: int
+
+class CacheStats(BaseModel):
+    enabled: bool
+    hits: int
+    misses: int
+    tiers: List[CacheTierStats]
+
+class SessionResponse(BaseModel):
+    id: str
+    num_ideas: int
+    created_at: datetime
+    # The session and its views are deleted after this
+    expires_at: datetime
+
+class SessionRanking(BaseModel):
+    total: int
+    offset: int
+    ranked_ideas: List[RankedIdea]
+
+class KMeansDataModel(BaseModel):
+    data: List[List[float]]
+    centers: List[List[float]]
+    cluster: List[int]
+
+class SessionClusters(BaseModel):
+    k: int
+    # Cluster id of each idea, in ranked order
+    cluster_ids: List[int]
+    kmeans_data: KMeansDataModel
+
+class SimilarityRows(BaseModel):
+    offset: int
+    # Rows of the pairwise similarity matrix (ideas in ranked order, centroid last); each row has
+    # the similarity to every idea and, last, to the centroid
+    rows: List[List[float]]
+
+class SessionUpdate(SessionRanking):
+    version: int
+    # Whether all ideas were analyzed again, rather than just the new ones
+    reanalyzed: bool
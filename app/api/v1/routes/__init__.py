@@ -1,4 +1,7 @@
 from . import ideas
 from . import auth
+from . import jobs
+from . import admin
+from . import sessions
 
-__all__ = ['ideas', 'auth']
+__all__ = ['ideas', 'auth', 'jobs', 'admin', 'sessions']
@@ -0,0 +1,21 @@
+from fastapi import APIRouter, Depends
+from starlette.concurrency import run_in_threadpool
+
+from app.services.cache import analysis_cache
+from ..dependencies.auth import verify_admin_key
+from ..models.response import CacheStats
+
+router = APIRouter(prefix="/admin", tags=["admin"], dependencies=[Depends(verify_admin_key)])
+
+
+@router.get("/cache", response_model=CacheStats)
+async def get_cache_stats():
+    """Hits & misses since the start, and the size of each tier of the analysis cache"""
+    return analysis_cache.stats()
+
+
+@router.delete("/cache", response_model=CacheStats)
+async def flush_cache():
+    """Removes all cached analyses, e.g. after a change to the analysis. Returns the emptied stats."""
+    await run_in_threadpool(analysis_cache.clear)
+    return analysis_cache.stats()
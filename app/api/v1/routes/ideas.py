@@ -1,29 +1,59 @@
+import asyncio
 from fastapi import APIRouter, Depends, HTTPException, Request, Response
-from typing import List
+from fastapi.responses import StreamingResponse
+from typing import AsyncIterator, Iterable, Iterator, List, Optional, Tuple
 import json
+import numpy as np
 
 from app.core.limiter import limiter
+from app.core.serialization import FastJSONResponse
 from app.core.config import settings
+from app.core.workers import analysis_pool
+from app.services.cache import analysis_cache, analysis_flights, analysis_key
 from app.services.clustering import summarize_clusters
 from app.services.credits import CreditService
+from app.services.similarity import SimilarityTile, dense_tiles, encode_similarity_matrix, encode_top_k, sparse_edges
 from ..dependencies.auth import verify_token
+from ..idempotency import IDEMPOTENCY_KEY, idempotent, request_fingerprint
+from ..ingest import IdeaBatch, batch_to_data, read_idea_batch, read_idea_batches
+from ..streaming import EVENT_STREAM, EVENT_STREAM_HEADERS, Stage, sse_event
+from ..formats import (
+    NDJSON,
+    OPENAPI_RESPONSES, 
+    negotiate_response_format, 
+    render_response, 
+    request_body_openapi
+)
 
-from ....services.analyzer import centroid_analysis
+from ....services.analyzer import StagedAnalysis, centroid_analysis
 from ....services.analyzer import Analyzer
-from ..models.request import IdeaInput, IdeaRequest
-from ..models.response import AnalysisResponse, RelationshipGraph
-from app.services.types import PlotData, Results, RankedIdea
+from ..models.request import AdvancedFeatures, IdeaRequest
+from ..models.response import (
+    AnalysisResponse, 
+    BatchAnalysisResponse,
+    ColumnarGraphEdges, 
+    ColumnarGraphNodes, 
+    ColumnarRelationshipGraph, 
+    EncodedSimilarityMatrix,
+    RelationshipGraph
+)
+from app.services.types import AnalysisResult, RankedIdea
 
 router = APIRouter(tags=["ideas"])
 
-@router.post("/rank_ideas", response_model=AnalysisResponse)
+@router.post(
+    "/rank_ideas", 
+    response_model=AnalysisResponse, 
+    responses=OPENAPI_RESPONSES, 
+    openapi_extra=request_body_openapi(IdeaRequest)
+)
 @limiter.limit(
     settings.RATE_LIMIT_PER_USER,
     key_func=lambda request: request.client.host if request.client else "global"
 )
 async def rank_ideas(
     request: Request,
-    ideaRequest: IdeaRequest,
+    batch: IdeaBatch = Depends(read_idea_batch),
     user_info: dict = Depends(verify_token),
 ) -> AnalysisResponse | Response:
     """
@@ -41,105 +71,391 @@ async def rank_ideas(
     - Cluster names: 5 credits
     
     Returns:
-        AnalysisResponse containing ranked ideas and optional advanced analysis
+        AnalysisResponse containing ranked ideas and optional advanced analysis.
+        Binary formats (Arrow IPC, Parquet, .npy/.npz, MessagePack, CBOR) and streamed NDJSON can be
+        requested via the Accept header. The request body can be sent as JSON, MessagePack or CBOR (Content-Type header).
+        With an Idempotency-Key header, retries of the request get the stored response.
     
     Raises:
         HTTPException(400): If input data is invalid
         HTTPException(402): If insufficient credits
+        HTTPException(406): If a binary format is requested that isn't available
+        HTTPException(409): If a request with the same Idempotency-Key is still in progress
+        HTTPException(415): If the request body's format isn't available
+        HTTPException(422): If the Idempotency-Key was used for a different request
         HTTPException(429): If rate limit is exceeded
     """
     print('Ranking ideas')
     
-    # Filter out empty ideas from the original request
-    filtered_idea_inputs = [item for item in ideaRequest.ideas if item.idea.strip()]
-        
-    # Extract ideas from filtered inputs
-    ideas = [item.idea for item in filtered_idea_inputs]
-    num_ideas = len(ideas)
-    total_bytes = sum(len(idea.encode('utf-8')) for idea in ideas)
+    # Fail fast on response formats we can't produce, before doing any work
+    media_type = negotiate_response_format(request)
+    user_id = user_info["user_id"]
 
-    if num_ideas < 4:
-        return Response(status_code=400, content='Please provide at least 4 items to analyze')
+    # Retries with the same Idempotency-Key get the first attempt's response, without another
+    # analysis or charge. Streamed responses aren't kept, so they can't be replayed.
+    if media_type == NDJSON and IDEMPOTENCY_KEY in request.headers:
+        raise HTTPException(status_code=400, detail="Idempotency-Key isn't supported for NDJSON responses")
+    return await idempotent(
+        request,
+        user_id,
+        lambda: request_fingerprint(batch_to_data(batch), media_type),
+        lambda: rank_batch(batch, user_id, media_type),
+    )
 
-    if num_ideas > 10_000:
-        return Response(status_code=400, content='Please provide less than 10000 items to analyze')
+async def rank_batch(batch: IdeaBatch, user_id: str, media_type: str) -> Response:
+    """The /rank_ideas response for a batch, in the negotiated format"""
+    error = await check_batch(batch, user_id)
+    if error:
+        return error
+    
+    print('Starting analysis for ideas: \n', batch)
+    # NDJSON generates the graph & dense matrix while streaming
+    response, analysis = await run_analysis(batch, user_id, stream=media_type == NDJSON)
 
-    if total_bytes > 10_000_000:
-        return Response(status_code=400, content='Please provide less than 10MB of data to analyze')
+    print('Results calculated successfully!')
+    if response["ranked_ideas"]:
+        print('First 5 ranked ideas:', response["ranked_ideas"][:5])
+    if isinstance(response["pairwise_similarity_matrix"], np.ndarray):
+        print('First 5 similarity scores:', response["pairwise_similarity_matrix"][:5])
+    if response["cluster_names"]:
+        print('First 5 cluster names:', response["cluster_names"][:5])
+    if isinstance(response["relationship_graph"], RelationshipGraph):
+        print('First 5 graph nodes & edges:', response["relationship_graph"].nodes[:5], response["relationship_graph"].edges[:5])    
+    elif response["relationship_graph"]:
+        print('Columnar graph with', len(response["relationship_graph"].nodes.id), 'nodes')
+    
+    # Everything in the response was built from validated data, so skip re-validating it
+    # into an AnalysisResponse and serialize it (numpy arrays included) straight to bytes;
+    # or to one of the binary formats if the client asked for it.
+    return render_response(media_type, response, analysis, batch.advanced_features)
 
-    is_valid, message = Analyzer.check_ideas_are_sentences(ideas, 80)
-    if not is_valid:
-        return Response(status_code=400, content=message)
+async def analyze_ideas(ideas: List[str]) -> AnalysisResult:
+    """
+    The analysis of the ideas: from the cache, shared with an identical analysis that's already
+    running, or computed (and cached)
+    """
+    key = analysis_key(ideas)
 
+    async def compute() -> AnalysisResult:
+        analysis = await analysis_cache.get(key, ideas)
+        if analysis is None:
+            # In a worker process, so the event loop stays free for other requests
+            analysis = await analysis_pool.run(centroid_analysis, ideas)
+            await analysis_cache.set(key, analysis)
+        return analysis
 
-    # Check credits for basic analysis
-    user_id = user_info["user_id"]
-    
+    analysis = await analysis_flights.run(key, compute)
+    # A shared analysis belongs to the request that started it; responses use each caller's own ideas
+    return analysis if analysis.ideas == ideas else analysis.with_ideas(ideas)
+
+async def run_analysis(
+    batch: IdeaBatch, 
+    user_id: str, 
+    stream: bool = False, 
+    charge: bool = True
+) -> Tuple[dict, AnalysisResult]:
+    """
+    Analyzes a batch that passed check_batch, deducting the credits for each part as it's done
+    (unless `charge` is off). Returns the assembled response and the analysis; see
+    process_advanced_features for `stream`.
+    """
+    ideas = batch.texts
+    num_ideas = len(ideas)
+    total_bytes = batch.total_bytes
+
+    # Identical idea sets reuse the cached or running analysis; they're still charged for
+    analysis = await analyze_ideas(ideas)
+    if charge:
+        await CreditService.deduct_credits(user_id, "basic_analysis", num_ideas, total_bytes)
+
+    response = await build_base_response(analysis, batch)
+
+    if batch.advanced_features:
+        response = await process_advanced_features(
+            batch, response, user_id, ideas, analysis, num_ideas, total_bytes, stream=stream, charge=charge
+        )
+    return response, analysis
+
+def requested_operations(batch: IdeaBatch) -> List[str]:
+    """The credit operations a request asks for"""
     operations = ["basic_analysis"]
-    
-    if ideaRequest.advanced_features:
-        if ideaRequest.advanced_features.relationship_graph:
+    if batch.advanced_features:
+        if batch.advanced_features.relationship_graph:
             operations.append("relationship_graph")
-        if ideaRequest.advanced_features.cluster_names:
+        if batch.advanced_features.cluster_names:
             operations.append("cluster_names")
+    return operations
+
+def check_input(batch: IdeaBatch) -> Optional[str]:
+    """The reason a batch of ideas can't be analyzed (limits, too few ideas, not sentences), if any"""
+    # The body was read incrementally: empty ideas are already filtered out, and reading
+    # stopped early if the item or size limit was exceeded
+    if batch.limit_error:
+        return batch.limit_error
 
+    if len(batch) < 4:
+        return 'Please provide at least 4 items to analyze'
+
+    is_valid, message = Analyzer.check_ideas_are_sentences(batch.texts, 80)
+    if not is_valid:
+        return message
+    return None
+
+async def refund(user_id: str, amounts: dict):
+    """Gives back credits deducted up front, per operation"""
+    for operation, amount in amounts.items():
+        if amount:
+            await CreditService.refund_amount(user_id, operation, amount)
+
+def insufficient_credits(required: int, available: int) -> HTTPException:
+    print(f"Insufficient credits. Required: {required}; Available: {available}")
+    return HTTPException(
+        status_code=402,
+        detail=f"Insufficient credits for analysis. Required credits: {required}; Available credits: {available}"
+    )
+
+async def check_batch(batch: IdeaBatch, user_id: str) -> Optional[Response]:
+    """
+    The checks before analyzing a batch of ideas: limits, enough ideas, sentences and credits.
+    Returns the 400 response for invalid input; raises 402 for insufficient credits.
+    """
+    message = check_input(batch)
+    if message:
+        return Response(status_code=400, content=message)
+
+    operations = requested_operations(batch)
     if not await CreditService.has_sufficient_credits(
-        user_id, operations, num_ideas, total_bytes
+        user_id, operations, len(batch), batch.total_bytes
     ):
-        required = await CreditService.get_total_cost(operations, num_ideas, total_bytes)
+        required = await CreditService.get_total_cost(operations, len(batch), batch.total_bytes)
         available = await CreditService.get_credits(user_id)
-        print(f"Insufficient credits. Required: {required}; Available: {available}")
-        raise HTTPException(
-            status_code=402,
-            detail=f"Insufficient credits for analysis. Required credits: {required}; Available credits: {available}"
-        )
+        raise insufficient_credits(required, available)
+    return None
+
+@router.post(
+    "/rank_ideas/batch",
+    response_model=BatchAnalysisResponse,
+    openapi_extra=request_body_openapi(List[IdeaRequest])
+)
+@limiter.limit(
+    settings.RATE_LIMIT_PER_USER,
+    key_func=lambda request: request.client.host if request.client else "global"
+)
+async def rank_ideas_batch(
+    request: Request,
+    batches: List[IdeaBatch] = Depends(read_idea_batches),
+    user_info: dict = Depends(verify_token),
+) -> BatchAnalysisResponse:
+    """
+    Analyzes many independent idea sets in one call: the body is a list of /rank_ideas requests.
+    
+    The user is authenticated and the credits for all valid sets are deducted together up front
+    (so concurrent requests can't spend them twice), the sets are analyzed concurrently, and the
+    credits for sets that failed are refunded. `results` has one entry per set, in order: `status`
+    200 with the /rank_ideas `result`, or the status code and `error` of that set (e.g. 400 for
+    too few ideas).
     
-    # Perform core analysis
-    print('Starting analysis for ideas: \n', ideaRequest)
-    results, plot_data = centroid_analysis(ideas)
-    await CreditService.deduct_credits(user_id, "basic_analysis", num_ideas, total_bytes)
+    Raises:
+        HTTPException(400): If there are too many sets or too much data overall
+        HTTPException(402): If the credits don't cover all valid sets
+    """
+    user_id = user_info["user_id"]
+    print(f'Ranking a batch of {len(batches)} idea sets')
 
-    response = await build_base_response(ideas, results, plot_data, ideaRequest.ideas)
+    results: List[Optional[dict]] = [None] * len(batches)
+    valid = []
+    for index, batch in enumerate(batches):
+        message = check_input(batch)
+        if message:
+            results[index] = {"status": 400, "result": None, "error": message}
+        else:
+            valid.append(index)
 
-    if ideaRequest.advanced_features:
-        response = await process_advanced_features(
-            ideaRequest, response, user_id, ideas, plot_data, num_ideas, total_bytes
-        )
+    # One balance check for the whole batch
+    costs = {
+        index: {
+            operation: await CreditService.get_operation_cost(operation, len(batches[index]), batches[index].total_bytes)
+            for operation in requested_operations(batches[index])
+        }
+        for index in valid
+    }
+    required = sum(sum(cost.values()) for cost in costs.values())
+    available = await CreditService.get_credits(user_id)
+    if required > available:
+        raise insufficient_credits(required, available)
+
+    # One deduction per operation for all valid sets, before the analyses; each is all or nothing
+    totals = {}
+    for cost in costs.values():
+        for operation, amount in cost.items():
+            totals[operation] = totals.get(operation, 0) + amount
+    reserved = {}
+    for operation, amount in totals.items():
+        if not await CreditService.deduct_amount(user_id, operation, amount):
+            # Spent by another request since the balance check
+            await refund(user_id, reserved)
+            raise insufficient_credits(required, await CreditService.get_credits(user_id))
+        reserved[operation] = amount
+
+    outcomes = await asyncio.gather(
+        *(run_analysis(batches[index], user_id, charge=False) for index in valid),
+        return_exceptions=True
+    )
+
+    refunds = {}
+    for index, outcome in zip(valid, outcomes):
+        if isinstance(outcome, Exception):
+            if isinstance(outcome, HTTPException):
+                results[index] = {"status": outcome.status_code, "result": None, "error": str(outcome.detail)}
+            else:
+                print(f"Analysis of set {index} failed: {outcome}")
+                results[index] = {"status": 500, "result": None, "error": "The analysis failed."}
+            for operation, cost in costs[index].items():
+                refunds[operation] = refunds.get(operation, 0) + cost
+        else:
+            results[index] = {"status": 200, "result": outcome[0], "error": None}
 
-    results = AnalysisResponse(**response)
+    await refund(user_id, refunds)
+
+    return FastJSONResponse(content={"results": results})
+
+@router.post(
+    "/rank_ideas/stream",
+    responses={200: {"content": {EVENT_STREAM: {}}}},
+    openapi_extra=request_body_openapi(IdeaRequest)
+)
+@limiter.limit(
+    settings.RATE_LIMIT_PER_USER,
+    key_func=lambda request: request.client.host if request.client else "global"
+)
+async def rank_ideas_stream(
+    request: Request,
+    batch: IdeaBatch = Depends(read_idea_batch),
+    user_info: dict = Depends(verify_token),
+) -> Response:
+    """
+    Same analysis as /rank_ideas, sent as Server-Sent Events as soon as each stage is done, so the
+    ranking arrives without waiting for clustering, the graph layout or the cluster names.
     
-    print('Results calculated successfully!')
-    if results.ranked_ideas:
-        print('First 5 ranked ideas:', results.ranked_ideas[:5])
-    if results.pairwise_similarity_matrix:
-        print('First 5 similarity scores:', results.pairwise_similarity_matrix[:5])
-    if results.cluster_names:
-        print('First 5 cluster names:', results.cluster_names[:5])
-    if results.relationship_graph:
-        print('First 5 graph nodes & edges:', results.relationship_graph.nodes[:5], results.relationship_graph.edges[:5])    
+    Events, in this order (each `data` is JSON):
+    - ranking: {"ranked_ideas": [...]}, like /rank_ideas but without cluster_id
+    - clusters: {"cluster_ids": [...]}, the cluster of each ranked idea
+    - relationship_graph: the graph (if requested)
+    - pairwise_similarity_matrix: the matrix (if requested)
+    - cluster_names: the cluster names (if requested)
+    - done: {} after the last result, or error: {"detail": ...} if the analysis failed midway
     
-    return results
+    Invalid input and insufficient credits are reported before the stream starts, with the same
+    status codes as /rank_ideas. Credits are deducted as each part is delivered.
+    """
+    print('Ranking ideas (streaming)')
+    user_id = user_info["user_id"]
+    error = await check_batch(batch, user_id)
+    if error:
+        return error
+    
+    return StreamingResponse(
+        analysis_events(batch, user_id),
+        media_type=EVENT_STREAM,
+        headers=EVENT_STREAM_HEADERS,
+    )
+
+async def analysis_events(batch: IdeaBatch, user_id: str) -> AsyncIterator[bytes]:
+    """The events of /rank_ideas/stream; the CPU-bound stages run in the threadpool"""
+    num_ideas, total_bytes = len(batch), batch.total_bytes
+    features = batch.advanced_features
+    staged = StagedAnalysis(batch.texts)
+    try:
+        stage = Stage.in_thread(staged.rank)
+        async for keepalive in stage:
+            yield keepalive
+        order, similarity = stage.result()
+        await CreditService.deduct_credits(user_id, "basic_analysis", num_ideas, total_bytes)
+        yield sse_event("ranking", {"ranked_ideas": list(ranked_idea_fields(batch, order, similarity))})
+
+        stage = Stage.in_thread(staged.cluster)
+        async for keepalive in stage:
+            yield keepalive
+        yield sse_event("clusters", {"cluster_ids": stage.result()})
+
+        stage = Stage.in_thread(staged.scatter)
+        async for keepalive in stage:
+            yield keepalive
+        analysis = staged.result()
+        response = await build_base_response(analysis, batch)
+
+        if features and features.relationship_graph:
+            build_graph = (
+                build_columnar_relationship_graph 
+                if features.relationship_graph_format == "columnar" 
+                else build_relationship_graph
+            )
+            stage = Stage.in_thread(
+                build_graph,
+                response["ranked_ideas"],
+                analysis,
+                features.relationship_graph_top_k,
+                features.relationship_graph_min_similarity,
+            )
+            async for keepalive in stage:
+                yield keepalive
+            await CreditService.deduct_credits(user_id, "relationship_graph", num_ideas, total_bytes)
+            yield sse_event("relationship_graph", stage.result())
+
+        if features and features.pairwise_similarity_matrix:
+            stage = Stage.in_thread(build_pairwise_similarity_matrix, analysis, features)
+            async for keepalive in stage:
+                yield keepalive
+            yield sse_event("pairwise_similarity_matrix", stage.result())
+
+        if features and features.cluster_names:
+            stage = Stage(summarize_clusters(response["ranked_ideas"]))
+            async for keepalive in stage:
+                yield keepalive
+            await CreditService.deduct_credits(user_id, "cluster_names", num_ideas, total_bytes)
+            yield sse_event("cluster_names", stage.result())
+
+        yield sse_event("done", {})
+    except Exception as e:
+        # The status line is already sent, so report the failure in the stream
+        print(f"Streaming analysis failed: {e}")
+        yield sse_event("error", {"detail": "The analysis failed. Please try again."})
+
+def _similarity_tiles(similarity: AnalysisResult | np.ndarray | List[List[float]], n: int) -> Iterable[SimilarityTile]:
+    """Row blocks of the n x n idea similarities, without materializing an analysis' full matrix"""
+    if isinstance(similarity, AnalysisResult):
+        return similarity.similarity_tiles()
+    return dense_tiles(np.asarray(similarity), n)
 
-def _generate_edges(ranked_ideas: List[RankedIdea], similarity_matrix: List[List[float]]) -> List[dict]:
+def _generate_edges(
+    ranked_ideas: List[RankedIdea], 
+    similarity_matrix: AnalysisResult | np.ndarray | List[List[float]],
+    top_k: Optional[int] = None,
+    min_similarity: Optional[float] = None
+) -> List[dict]:
     """
     Generate graph edges showing relationships between ideas and to centroid.
     
     Creates two types of edges:
-    1. Between ideas based on pairwise similarity
+    1. Between ideas based on pairwise similarity; all pairs by default, or only each idea's 
+       `top_k` nearest neighbours and/or the pairs with at least `min_similarity`
     2. From each idea to the centroid based on similarity scores
     """
-    edges = []
+    n = min(len(ranked_ideas), len(similarity_matrix))
+    ids = [idea.id for idea in ranked_ideas]
     
     # Create edges between ideas
-    for i, idea_from in enumerate(ranked_ideas):
-        if i+1 > len(similarity_matrix): 
-            break
-        for j, idea_to in enumerate(ranked_ideas[i+1:], i+1):
-            edges.append({
-                "from_id": idea_from.id,
-                "to_id": idea_to.id,
-                "similarity": similarity_matrix[i][j]
-            })
+    sources, targets, weights = sparse_edges(
+        _similarity_tiles(similarity_matrix, n), n, top_k=top_k, min_similarity=min_similarity
+    )
+    edges = [
+        {
+            "from_id": ids[i],
+            "to_id": ids[j],
+            "similarity": similarity
+        }
+        for i, j, similarity in zip(sources.tolist(), targets.tolist(), weights.tolist())
+    ]
     
     # Create edges to centroid
     for idea in ranked_ideas:
@@ -151,24 +467,34 @@ def _generate_edges(ranked_ideas: List[RankedIdea], similarity_matrix: List[List
     
     return edges
 
-async def build_base_response(ideas: List[str], results: Results, plot_data: PlotData, idea_inputs: List[IdeaInput]) -> dict:
-    """Build base response with ranked ideas and similarity scores"""
-    # Create lookup dict from idea string to original input
-    idea_to_input = {input.idea: input for input in idea_inputs}
+def ranked_idea_fields(batch: IdeaBatch, order: np.ndarray, similarity: np.ndarray) -> Iterator[dict]:
+    """The fields of each ranked idea apart from its cluster, gathered via the ranking permutation"""
+    texts, ids, author_ids = batch.texts, batch.ids, batch.author_ids
+    similarity = similarity.tolist()
+    for index, i in enumerate(order.tolist()):
+        yield {
+            "id": str(ids[i]) if ids[i] is not None else str(index),
+            "idea": texts[i],
+            "author_id": str(author_ids[i]) if author_ids[i] is not None else '',
+            "similarity_score": similarity[index],
+        }
+
+async def build_base_response(analysis: AnalysisResult, batch: IdeaBatch) -> dict:
+    """
+    Build base response with ranked ideas and similarity scores.
     
+    `batch` must hold the ideas that were analyzed; the analysis' ranking permutation is used to
+    gather them, so no text lookups or re-sorting are needed (and ideas with identical text keep
+    their own ids).
+    """
+    clusters = analysis.cluster_labels.tolist()
+    
+    # The inputs were validated on the way in, so construct without re-validating
     ranked_ideas = [
-        RankedIdea(
-            id=str(idea_to_input[idea].id) if idea_to_input[idea].id is not None else str(index),
-            idea=idea,
-            author_id=str(idea_to_input[idea].author_id) if idea_to_input[idea].author_id is not None else '',
-            similarity_score=results["similarity"][index],
-            cluster_id=plot_data["kmeans_data"]["cluster"][index],
-        )
-        for index, idea in enumerate(results["ideas"])
+        RankedIdea.model_construct(**fields, cluster_id=clusters[index])
+        for index, fields in enumerate(ranked_idea_fields(batch, analysis.order, analysis.similarity))
     ]
     
-    ranked_ideas.sort(key=lambda x: x.similarity_score, reverse=True)
-    
     return {
         "ranked_ideas": ranked_ideas,
         "relationship_graph": None,
@@ -177,38 +503,94 @@ async def build_base_response(ideas: List[str], results: Results, plot_data: Plo
     }
 
 async def process_advanced_features(
-    request: IdeaRequest,
+    request: IdeaBatch,
     response: dict,
     user_id: str,
     ideas: List[str],
-    plot_data: PlotData,
+    analysis: AnalysisResult,
     num_ideas: int,
-    total_bytes: int
+    total_bytes: int,
+    stream: bool = False,
+    charge: bool = True
 ) -> dict:
-    """Process and add advanced features if credits are available"""
-    if request.advanced_features and request.advanced_features.relationship_graph:
-        response["relationship_graph"] = build_relationship_graph(
-            response["ranked_ideas"], plot_data
+    """
+    Process and add advanced features if credits are available. With `stream`, the relationship
+    graph and the dense JSON matrix are left out (but charged); they're generated while the
+    response is streamed. Without `charge`, the caller deducts the credits.
+    """
+    if request.advanced_features and request.advanced_features.relationship_graph and stream:
+        if charge:
+            await CreditService.deduct_credits(user_id, "relationship_graph", num_ideas, total_bytes)
+    elif request.advanced_features and request.advanced_features.relationship_graph:
+        build_graph = (
+            build_columnar_relationship_graph 
+            if request.advanced_features.relationship_graph_format == "columnar" 
+            else build_relationship_graph
+        )
+        response["relationship_graph"] = build_graph(
+            response["ranked_ideas"], 
+            analysis,
+            top_k=request.advanced_features.relationship_graph_top_k,
+            min_similarity=request.advanced_features.relationship_graph_min_similarity
         )
-        await CreditService.deduct_credits(user_id, "relationship_graph", num_ideas, total_bytes)
+        if charge:
+            await CreditService.deduct_credits(user_id, "relationship_graph", num_ideas, total_bytes)
     
     if request.advanced_features and request.advanced_features.cluster_names:
         response["cluster_names"] = await summarize_clusters(response["ranked_ideas"])
-        await CreditService.deduct_credits(user_id, "cluster_names", num_ideas, total_bytes)
+        if charge:
+            await CreditService.deduct_credits(user_id, "cluster_names", num_ideas, total_bytes)
            
     if request.advanced_features and request.advanced_features.pairwise_similarity_matrix:
-        response["pairwise_similarity_matrix"] = plot_data["pairwise_similarity"]
+        features = request.advanced_features
+        dense_json = features.pairwise_similarity_format == "dense" and features.pairwise_similarity_encoding == "json"
+        if not (stream and dense_json):
+            response["pairwise_similarity_matrix"] = build_pairwise_similarity_matrix(analysis, features)
         
     return response
 
-def build_relationship_graph(ranked_ideas: List[RankedIdea], plot_data: PlotData) -> RelationshipGraph:
+def build_pairwise_similarity_matrix(
+    analysis: AnalysisResult, 
+    features: AdvancedFeatures
+) -> np.ndarray | EncodedSimilarityMatrix:
+    """
+    The pairwise similarity matrix (ideas in ranked order, centroid last), either as is or in
+    the compact format/encoding requested in the advanced features.
+    """
+    if features.pairwise_similarity_format == "topk":
+        # Computed tile by tile, the dense matrix is never materialized
+        encoded = encode_top_k(
+            analysis.similarity_tiles(), 
+            len(analysis), 
+            features.pairwise_similarity_top_k, 
+            features.pairwise_similarity_encoding
+        )
+        return EncodedSimilarityMatrix.model_construct(**encoded)
+    
+    if features.pairwise_similarity_format == "dense" and features.pairwise_similarity_encoding == "json":
+        # Stays a numpy array; it's serialized directly without converting to nested lists
+        return analysis.pairwise_similarity
+    
+    encoded = encode_similarity_matrix(
+        analysis.pairwise_similarity, 
+        features.pairwise_similarity_format, 
+        features.pairwise_similarity_encoding
+    )
+    return EncodedSimilarityMatrix.model_construct(**encoded)
+
+def build_relationship_graph(
+    ranked_ideas: List[RankedIdea], 
+    analysis: AnalysisResult,
+    top_k: Optional[int] = None,
+    min_similarity: Optional[float] = None
+) -> RelationshipGraph:
     """
     Builds a graph representation of idea relationships including:
     - Nodes with coordinates from MDS analysis
-    - Edges showing similarity between ideas
+    - Edges showing similarity between ideas (optionally sparsified, see _generate_edges)
     - Centroid connections
     """
-    coords = plot_data["scatter_points"]
+    coords = analysis.scatter_points_list()
     
     # Create nodes including centroid
     nodes = [
@@ -230,6 +612,46 @@ def build_relationship_graph(ranked_ideas: List[RankedIdea], plot_data: PlotData
     })
     
     # Generate edges between ideas and to centroid
-    edges = _generate_edges(ranked_ideas, plot_data["pairwise_similarity"])
+    edges = _generate_edges(ranked_ideas, analysis, top_k, min_similarity)
+    
+    return RelationshipGraph.model_construct(nodes=nodes, edges=edges)
+
+def build_columnar_relationship_graph(
+    ranked_ideas: List[RankedIdea], 
+    analysis: AnalysisResult,
+    top_k: Optional[int] = None,
+    min_similarity: Optional[float] = None
+) -> ColumnarRelationshipGraph:
+    """
+    Same graph as build_relationship_graph, but as parallel arrays:
+    - Nodes: ids, x and y coordinates; the centroid is the last node
+    - Edges: source & target node indices and similarity
+    
+    The arrays stay numpy arrays until the response is serialized.
+    """
+    n = len(ranked_ideas)
+    ids = [idea.id for idea in ranked_ideas] + ["Centroid"]
+    
+    sources, targets, weights = sparse_edges(
+        analysis.similarity_tiles(), n, top_k=top_k, min_similarity=min_similarity
+    )
+    
+    # Edges to centroid
+    idea_indices = np.arange(n)
+    sources = np.concatenate((sources, idea_indices))
+    targets = np.concatenate((targets, np.full(n, n, dtype=np.intp)))
+    weights = np.concatenate((weights, analysis.similarity[:n]))
     
-    return RelationshipGraph(nodes=nodes, edges=edges)
+    return ColumnarRelationshipGraph.model_construct(
+        format="columnar",
+        nodes=ColumnarGraphNodes.model_construct(
+            id=ids,
+            x=np.ascontiguousarray(analysis.coords[:n + 1, 0]),
+            y=np.ascontiguousarray(analysis.coords[:n + 1, 1]),
+        ),
+        edges=ColumnarGraphEdges.model_construct(
+            source=sources,
+            target=targets,
+            similarity=weights,
+        ),
+    )
@@ -0,0 +1,118 @@
+from datetime import datetime, UTC
+
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+
+from app.core.config import settings
+from app.core.limiter import limiter
+from app.core.serialization import FastJSONResponse, dumps
+from app.services.credits import CreditService
+from app.services.jobs import Job, JobQueue
+from .. import validation
+from ..etags import conditional_response, make_etag
+from ..dependencies.auth import verify_token
+from ..formats import request_body_openapi
+from ..ingest import IdeaBatch, batch_from_data, batch_to_data, read_idea_batch
+from ..models.request import IdeaRequest
+from ..models.response import JobResponse
+from .ideas import check_batch, requested_operations, run_analysis
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+
+async def run_rank_ideas_job(user_id: str, payload: bytes) -> bytes:
+    """Runs a queued /jobs/rank_ideas request; the result is the /rank_ideas JSON response"""
+    batch = batch_from_data(validation.IDEA_REQUEST.validate_json(payload))
+    # Charged by charge_rank_ideas_job once it succeeded, since a requeued job runs again
+    response, _ = await run_analysis(batch, user_id, charge=False)
+    return dumps(response)
+
+
+async def charge_rank_ideas_job(user_id: str, payload: bytes):
+    """Deducts what run_analysis would have for the job"""
+    batch = batch_from_data(validation.IDEA_REQUEST.validate_json(payload))
+    for operation in requested_operations(batch):
+        await CreditService.deduct_credits(user_id, operation, len(batch), batch.total_bytes)
+
+
+job_queue = JobQueue(
+    settings.JOBS_DATABASE,
+    run_rank_ideas_job,
+    charge=charge_rank_ideas_job,
+    concurrency=settings.JOB_CONCURRENCY,
+    ttl=settings.JOB_RESULT_TTL,
+)
+
+
+def _timestamp(value):
+    return datetime.fromtimestamp(value, UTC) if value is not None else None
+
+
+def job_body(job: Job) -> dict:
+    """A JobResponse; the stored result is already JSON and is embedded as is"""
+    return {
+        "id": job.id,
+        "status": job.status,
+        "created_at": _timestamp(job.created_at),
+        "started_at": _timestamp(job.started_at),
+        "finished_at": _timestamp(job.finished_at),
+        "expires_at": _timestamp(job.expires_at),
+        "result": orjson.Fragment(job.result) if job.result is not None else None,
+        "error": job.error,
+    }
+
+
+@router.post(
+    "/rank_ideas",
+    status_code=202,
+    response_model=JobResponse,
+    openapi_extra=request_body_openapi(IdeaRequest)
+)
+@limiter.limit(
+    settings.RATE_LIMIT_PER_USER,
+    key_func=lambda request: request.client.host if request.client else "global"
+)
+async def submit_rank_ideas_job(
+    request: Request,
+    batch: IdeaBatch = Depends(read_idea_batch),
+    user_info: dict = Depends(verify_token),
+) -> JobResponse | Response:
+    """
+    Queues a /rank_ideas analysis and returns right away, for analyses that take longer than an
+    HTTP request can stay open. Poll the job (its URL is in the Location header) for the result.
+    
+    The request is checked like /rank_ideas: invalid input gets 400 and insufficient credits
+    402 here, not in the job. Credits are deducted once the job succeeded.
+    """
+    user_id = user_info["user_id"]
+    error = await check_batch(batch, user_id)
+    if error:
+        return error
+
+    job = await job_queue.submit(user_id, dumps(batch_to_data(batch)))
+    print(f"Queued job {job.id} with {len(batch)} ideas")
+    return FastJSONResponse(
+        content=job_body(job),
+        status_code=202,
+        headers={"Location": str(request.url_for("get_job", job_id=job.id))},
+    )
+
+
+@router.get("/{job_id}", response_model=JobResponse)
+async def get_job(request: Request, job_id: str, user_info: dict = Depends(verify_token)) -> JobResponse:
+    """
+    The status of a job and, once it succeeded, its result (the /rank_ideas response).
+    Jobs are only visible to the user who submitted them (outside of trial mode), until they expire.
+    
+    Responses have an ETag; polls with a matching If-None-Match header get 304 Not Modified
+    while the job hasn't changed.
+    """
+    # Trial mode users get a new id with every request, so their jobs can't be tied to them;
+    # the unguessable job id is all there is
+    owner = None if settings.is_in_trial_mode else user_info["user_id"]
+    job = await job_queue.get(job_id, owner)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    # A job only changes when its status does, and its result is set once, when it finishes
+    etag = make_etag(job.id, job.status, job.started_at, job.finished_at)
+    return conditional_response(request, etag, lambda: FastJSONResponse(content=job_body(job)))
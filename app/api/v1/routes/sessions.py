@@ -0,0 +1,424 @@
+from datetime import datetime, UTC
+from typing import List, Literal, Optional, Union
+
+import numpy as np
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    WebSocket,
+    WebSocketDisconnect,
+    WebSocketException,
+    status,
+)
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.core.limiter import limiter
+from app.core.serialization import FastJSONResponse
+from app.core.workers import analysis_pool
+from app.services.analyzer import cluster_vectors
+from app.services.cache import analysis_key
+from app.services.credits import CreditService
+from app.services.incremental import append_ideas, can_append, needs_reanalysis
+from app.services.sessions import Session, SessionStore
+from app.services.types import RankedIdea
+from .. import live
+from ..dependencies.auth import verify_token, verify_websocket_token
+from ..etags import conditional_response, etag_matches, make_etag, not_modified, with_etag
+from ..formats import request_body_openapi
+from ..ingest import MAX_IDEA_BYTES, MAX_IDEAS, TOO_MANY_BYTES, TOO_MANY_IDEAS, IdeaBatch, batch_from_data, read_idea_batch
+from ..models.request import IdeaRequest, LiveAddIdeas
+from ..models.response import (
+    ColumnarRelationshipGraph,
+    RelationshipGraph,
+    SessionClusters,
+    SessionRanking,
+    SessionResponse,
+    SessionUpdate,
+    SimilarityRows,
+)
+from .ideas import (
+    analyze_ideas,
+    build_columnar_relationship_graph,
+    build_relationship_graph,
+    check_batch,
+    insufficient_credits,
+    ranked_idea_fields,
+)
+
+router = APIRouter(prefix="/sessions", tags=["sessions"])
+
+# Similarity rows per /matrix request
+MAX_MATRIX_ROWS = 1000
+
+session_store = SessionStore(settings.SESSION_MAX_BYTES, settings.SESSION_TTL)
+
+
+def _timestamp(value: float) -> datetime:
+    return datetime.fromtimestamp(value, UTC)
+
+
+def session_body(session: Session) -> dict:
+    return {
+        "id": session.id,
+        "num_ideas": len(session),
+        "created_at": _timestamp(session.created_at),
+        "expires_at": _timestamp(session.expires_at),
+    }
+
+
+def session_batch(session: Session) -> IdeaBatch:
+    return IdeaBatch(session.analysis.ideas, session.ids, session.author_ids, session.total_bytes)
+
+
+def find_session(session_id: str, user_info: dict) -> Optional[Session]:
+    # Trial mode users get a new id with every request, so (like jobs) only the id identifies a session
+    owner = None if settings.is_in_trial_mode else user_info["user_id"]
+    return session_store.get(session_id, owner)
+
+
+async def get_session(session_id: str, user_info: dict = Depends(verify_token)) -> Session:
+    # async, so it runs on the event loop like everything else that touches the (unsynchronized) store
+    session = find_session(session_id, user_info)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return session
+
+
+def session_etag(session: Session, view: str, *parameters) -> str:
+    """
+    Views only depend on the analysis (its content hash, and the ideas added since), the ideas'
+    ids and the view's parameters
+    """
+    return make_etag(session.key, session.id, session.version, view, *parameters)
+
+
+@router.post(
+    "",
+    status_code=201,
+    response_model=SessionResponse,
+    openapi_extra=request_body_openapi(IdeaRequest)
+)
+@limiter.limit(
+    settings.RATE_LIMIT_PER_USER,
+    key_func=lambda request: request.client.host if request.client else "global"
+)
+async def create_session(
+    request: Request,
+    batch: IdeaBatch = Depends(read_idea_batch),
+    user_info: dict = Depends(verify_token),
+) -> SessionResponse | Response:
+    """
+    Analyzes the ideas (same request body as /rank_ideas) and keeps the analysis for
+    SESSION_TTL seconds, so its views can be requested without sending the ideas again.
+
+    Creating a session costs a basic analysis; advanced features are requested per view
+    instead. Returns 201 with the session's URL in the Location header.
+    """
+    user_id = user_info["user_id"]
+    batch.advanced_features = None
+    error = await check_batch(batch, user_id)
+    if error:
+        return error
+
+    analysis = await analyze_ideas(batch.texts)
+    try:
+        session = session_store.create(
+            user_id, analysis_key(batch.texts), analysis, batch.ids, batch.author_ids, batch.total_bytes
+        )
+    except ValueError:
+        raise HTTPException(status_code=413, detail="The analysis is too large for a session; use /rank_ideas instead")
+    await CreditService.deduct_credits(user_id, "basic_analysis", len(batch), batch.total_bytes)
+
+    print(f"Created session {session.id} with {len(session)} ideas")
+    return FastJSONResponse(
+        content=session_body(session),
+        status_code=201,
+        headers={"Location": str(request.url_for("get_session_info", session_id=session.id))},
+    )
+
+
+@router.get("/{session_id}", response_model=SessionResponse)
+async def get_session_info(session: Session = Depends(get_session)) -> SessionResponse:
+    return FastJSONResponse(content=session_body(session))
+
+
+@router.delete("/{session_id}", status_code=204)
+async def delete_session(session: Session = Depends(get_session)):
+    session_store.delete(session.id, session.user_id)
+    return Response(status_code=204)
+
+
+async def add_ideas(session: Session, batch: IdeaBatch) -> bool:
+    """
+    Adds the batch's ideas to the session's analysis: incrementally, or with a full analysis of
+    all ideas once enough were added since the last one. Returns whether it was a full analysis.
+
+    Raises:
+        HTTPException(400): If the session would have more than MAX_IDEAS ideas or MAX_IDEA_BYTES
+        ValueError: If the session would get too large for the session store
+    """
+    async with session.lock:
+        # Checked under the lock, so concurrent additions can't both pass it
+        if len(session) + len(batch) > MAX_IDEAS:
+            raise HTTPException(status_code=400, detail=TOO_MANY_IDEAS)
+        if session.total_bytes + batch.total_bytes > MAX_IDEA_BYTES:
+            raise HTTPException(status_code=400, detail=TOO_MANY_BYTES)
+        texts = session.analysis.ideas + batch.texts
+        appended = session.appended + len(batch)
+        key = None
+        if needs_reanalysis(session.analyzed, appended) or not can_append(session.analysis):
+            key = analysis_key(texts)
+            analysis = await analyze_ideas(texts)
+        else:
+            # In the threadpool rather than a worker process, which would need a copy of all the vectors
+            analysis = await run_in_threadpool(append_ideas, session.analysis, batch.texts)
+        session_store.update(
+            session,
+            analysis,
+            session.ids + batch.ids,
+            session.author_ids + batch.author_ids,
+            session.total_bytes + batch.total_bytes,
+            key=key,
+        )
+        return key is not None
+
+
+def session_ranked_ideas(session: Session, start: int = 0, stop: Optional[int] = None) -> List[RankedIdea]:
+    """Ranked ideas start:stop, built from the stored ranking like /rank_ideas builds them"""
+    analysis = session.analysis
+    stop = len(analysis) if stop is None else min(stop, len(analysis))
+    clusters = analysis.cluster_labels[start:stop].tolist()
+    fields = ranked_idea_fields(session_batch(session), analysis.order[start:stop], analysis.similarity[start:stop])
+    # Built from validated data, so constructed without re-validating
+    return [RankedIdea.model_construct(**idea, cluster_id=clusters[index]) for index, idea in enumerate(fields)]
+
+
+@router.post(
+    "/{session_id}/ideas",
+    response_model=SessionUpdate,
+    openapi_extra=request_body_openapi(IdeaRequest)
+)
+@limiter.limit(
+    settings.RATE_LIMIT_PER_USER,
+    key_func=lambda request: request.client.host if request.client else "global"
+)
+async def add_session_ideas(
+    request: Request,
+    batch: IdeaBatch = Depends(read_idea_batch),
+    session: Session = Depends(get_session),
+    user_info: dict = Depends(verify_token),
+) -> SessionUpdate | Response:
+    """
+    Adds ideas (same request body as /rank_ideas) to the session and returns the updated ranking.
+
+    Only the new ideas are analyzed: the centroid and every idea's similarity to it are updated,
+    and the new ideas join the existing clusters. Once the ideas added since the last full
+    analysis reach a quarter of it, all ideas are analyzed again (and re-clustered). Costs a basic
+    analysis of the new ideas.
+    """
+    if batch.limit_error:
+        return Response(status_code=400, content=batch.limit_error)
+    if not batch:
+        return Response(status_code=400, content="Please provide ideas to add")
+
+    user_id = user_info["user_id"]
+    operations = ["basic_analysis"]
+    if not await CreditService.has_sufficient_credits(user_id, operations, len(batch), batch.total_bytes):
+        required = await CreditService.get_total_cost(operations, len(batch), batch.total_bytes)
+        raise insufficient_credits(required, await CreditService.get_credits(user_id))
+
+    try:
+        reanalyzed = await add_ideas(session, batch)
+    except ValueError:
+        raise HTTPException(status_code=413, detail="The analysis is too large for a session")
+    await CreditService.deduct_credits(user_id, "basic_analysis", len(batch), batch.total_bytes)
+    await live.publish(session)
+
+    return FastJSONResponse(content={
+        "version": session.version,
+        "reanalyzed": reanalyzed,
+        "total": len(session),
+        "offset": 0,
+        "ranked_ideas": session_ranked_ideas(session),
+    })
+
+
+def submission_error(session: Session, channel: live.LiveChannel, batch: IdeaBatch) -> Optional[str]:
+    """
+    Why ideas submitted over the live channel can't be added, if they can't (like /ideas' 400s).
+    Counts the pending ideas too, for early feedback; add_ideas checks the limits again.
+    """
+    if batch.limit_error:
+        return batch.limit_error
+    if not batch:
+        return "Please provide ideas to add"
+    if len(session) + channel.pending_ideas + len(batch) > MAX_IDEAS:
+        return TOO_MANY_IDEAS
+    if session.total_bytes + channel.pending_bytes + batch.total_bytes > MAX_IDEA_BYTES:
+        return TOO_MANY_BYTES
+    return None
+
+
+@router.websocket("/{session_id}/live")
+async def live_session(websocket: WebSocket, session_id: str, user_info: dict = Depends(verify_websocket_token)):
+    """
+    Live ranking for everyone working on a session (see app/api/v1/live.py for the messages).
+
+    Subscribers get a snapshot of the ranking, then an update with only what changed whenever
+    ideas are added, by any subscriber or over POST /{session_id}/ideas. Ideas submitted within a
+    moment of each other are added together. Each submitter pays a basic analysis of their ideas.
+    """
+    session = find_session(session_id, user_info)
+    if session is None:
+        raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason="Session not found")
+    user_id = user_info["user_id"]
+
+    await websocket.accept()
+    channel = live.channel_for(session, add_ideas)
+    await channel.subscribe(websocket)
+    try:
+        while True:
+            text = await websocket.receive_text()
+            try:
+                message = LiveAddIdeas.model_validate_json(text)
+            except ValidationError as e:
+                await channel.send(websocket, {"type": "error", "detail": e.errors(include_url=False, include_context=False)})
+                continue
+            if session_store.get(session.id, None) is not session:
+                await channel.send(websocket, {"type": "error", "detail": "Session not found"})
+                await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Session not found")
+                break
+
+            batch = batch_from_data({"ideas": [idea.model_dump() for idea in message.ideas]})
+            error = submission_error(session, channel, batch)
+            if error is None and not await CreditService.has_sufficient_credits(user_id, ["basic_analysis"], len(batch), batch.total_bytes):
+                error = insufficient_credits(
+                    await CreditService.get_total_cost(["basic_analysis"], len(batch), batch.total_bytes),
+                    await CreditService.get_credits(user_id),
+                ).detail
+            if error is not None:
+                await channel.send(websocket, {"type": "error", "detail": error})
+                continue
+            channel.submit(live.Submission(websocket, user_id, batch))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        channel.unsubscribe(websocket)
+
+
+@router.get("/{session_id}/ranking", response_model=SessionRanking)
+async def get_ranking(
+    request: Request,
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1),
+    session: Session = Depends(get_session),
+) -> SessionRanking:
+    """The ranked ideas (closest to the centroid first), or a page of them"""
+    stop = None if limit is None else offset + limit
+    return conditional_response(
+        request,
+        session_etag(session, "ranking", offset, limit),
+        lambda: FastJSONResponse(content={
+            "total": len(session),
+            "offset": offset,
+            "ranked_ideas": session_ranked_ideas(session, offset, stop),
+        }),
+    )
+
+
+@router.get("/{session_id}/clusters", response_model=SessionClusters)
+async def get_clusters(
+    request: Request,
+    k: Optional[int] = Query(None, ge=2, description="Number of clusters; by default, the analysis picks one"),
+    session: Session = Depends(get_session),
+) -> SessionClusters:
+    """
+    The cluster of each idea (in ranked order) and the kmeans data, for the analysis' own
+    clustering or for `k` clusters. Clusterings for other k's are computed on the first request.
+    """
+    if k is not None and k >= len(session):
+        raise HTTPException(status_code=400, detail=f"k must be less than the number of ideas ({len(session)})")
+    etag = session_etag(session, "clusters", k)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    analysis = session.analysis
+    if k is None:
+        kmeans = {"data": analysis.cluster_points, "centers": analysis.cluster_centers, "cluster": analysis.cluster_labels}
+    elif k in session.clusterings:
+        kmeans = session.clusterings[k]
+    else:
+        clusterings = session.clusterings
+        kmeans = await analysis_pool.run(cluster_vectors, analysis.vectors, k)
+        # Only kept if no ideas were added meanwhile (which replaces the session's clusterings)
+        clusterings[k] = kmeans
+
+    labels = np.asarray(kmeans["cluster"])
+    return with_etag(FastJSONResponse(content={
+        "k": int(labels.max()) + 1 if k is None else k,
+        "cluster_ids": labels,
+        # (PCA's output isn't always C-contiguous, which orjson needs to write arrays directly)
+        "kmeans_data": {
+            "data": np.ascontiguousarray(kmeans["data"]) if kmeans["data"] is not None else [],
+            "centers": np.ascontiguousarray(kmeans["centers"]) if kmeans["centers"] is not None else [],
+            "cluster": labels,
+        },
+    }), etag)
+
+
+@router.get("/{session_id}/graph", response_model=Union[RelationshipGraph, ColumnarRelationshipGraph])
+async def get_graph(
+    request: Request,
+    top_k: Optional[int] = Query(None, ge=1, description="Only keep each idea's k most similar neighbours"),
+    min_similarity: Optional[float] = Query(None, ge=-1, le=1, description="Only keep edges with at least this similarity"),
+    format: Literal["objects", "columnar"] = Query("objects", description="'columnar' returns parallel arrays instead of one object per node/edge"),
+    session: Session = Depends(get_session),
+    user_info: dict = Depends(verify_token),
+) -> RelationshipGraph | ColumnarRelationshipGraph:
+    """
+    The relationship graph, like /rank_ideas' `relationship_graph` with the same options.
+    Costs the relationship graph credits, unless the client already has it (304).
+    """
+    etag = session_etag(session, "graph", top_k, min_similarity, format)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    user_id = user_info["user_id"]
+    operations = ["relationship_graph"]
+    if not await CreditService.has_sufficient_credits(user_id, operations, len(session), session.total_bytes):
+        required = await CreditService.get_total_cost(operations, len(session), session.total_bytes)
+        raise insufficient_credits(required, await CreditService.get_credits(user_id))
+
+    build_graph = build_columnar_relationship_graph if format == "columnar" else build_relationship_graph
+    graph = await run_in_threadpool(
+        build_graph, session_ranked_ideas(session), session.analysis, top_k=top_k, min_similarity=min_similarity
+    )
+    await CreditService.deduct_credits(user_id, "relationship_graph", len(session), session.total_bytes)
+    return with_etag(FastJSONResponse(content=graph), etag)
+
+
+@router.get("/{session_id}/matrix", response_model=SimilarityRows)
+async def get_similarity_rows(
+    request: Request,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=MAX_MATRIX_ROWS),
+    session: Session = Depends(get_session),
+) -> SimilarityRows:
+    """
+    Rows offset to offset + limit of the pairwise similarity matrix (ideas in ranked order,
+    centroid last, so there are num_ideas + 1 rows). Only the requested rows are computed.
+    """
+    return conditional_response(
+        request,
+        session_etag(session, "matrix", offset, limit),
+        lambda: FastJSONResponse(content={
+            "offset": offset,
+            "rows": np.ascontiguousarray(session.analysis.similarity_rows(offset, offset + limit)),
+        }),
+    )
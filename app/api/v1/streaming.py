@@ -0,0 +1,63 @@
+"""
+Server-Sent Events for /rank_ideas/stream.
+
+Each event is `event: <name>` plus one JSON `data:` line, serialized like FastJSONResponse (numpy
+arrays and models included). While a stage is still running, comment lines are sent as
+keep-alives, so proxies don't close the connection during long analyses.
+"""
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, TypeVar
+
+from starlette.concurrency import run_in_threadpool
+
+from app.core.serialization import dumps
+
+EVENT_STREAM = "text/event-stream"
+KEEPALIVE_INTERVAL = 15  # seconds
+KEEPALIVE = b": keep-alive\n\n"
+
+# Keep intermediaries from buffering the stream
+EVENT_STREAM_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+}
+
+T = TypeVar("T")
+
+
+def sse_event(event: str, data: Any) -> bytes:
+    """One event; the JSON never contains raw newlines, so it fits in a single data line"""
+    return b"event: " + event.encode() + b"\ndata: " + dumps(data) + b"\n\n"
+
+
+class Stage:
+    """
+    Runs a CPU-bound callable in the threadpool (or awaits a coroutine) while the event stream
+    keeps going:
+
+        stage = Stage.in_thread(analysis.rank)
+        async for keepalive in stage:
+            yield keepalive
+        order, similarity = stage.result()
+    """
+    def __init__(self, awaitable: Awaitable[T]):
+        self._task = asyncio.ensure_future(awaitable)
+
+    @classmethod
+    def in_thread(cls, function: Callable[..., T], *args) -> "Stage":
+        return cls(run_in_threadpool(function, *args))
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        try:
+            while True:
+                done, _ = await asyncio.wait({self._task}, timeout=KEEPALIVE_INTERVAL)
+                if done:
+                    return
+                yield KEEPALIVE
+        finally:
+            # The client went away mid-stage; a thread can't be interrupted, but its result is dropped
+            if not self._task.done():
+                self._task.cancel()
+
+    def result(self) -> T:
+        return self._task.result()
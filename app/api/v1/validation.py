@@ -0,0 +1,48 @@
+"""
+Fast validation for large requests.
+
+Pydantic builds a model instance per idea (and runs the validators through the model machinery),
+which is a noticeable part of the time of a 10k idea request. The validators here run the same
+checks against the TypedDict mirrors in models/request.py instead, compiled once into a
+TypeAdapter, and return plain dicts.
+
+Errors are exactly the models' own: invalid data is validated again with the model, and that
+error is raised (this only costs anything for requests that fail anyway).
+"""
+from typing import Any, List
+
+from pydantic import BaseModel, TypeAdapter, ValidationError
+
+from .models.request import IdeaInput, IdeaInputData, IdeaRequest, IdeaRequestData
+
+
+class FastValidator:
+    """
+    Validates into `data_type` (a TypedDict mirror of `model_type`). Mirrors the TypeAdapter
+    interface, so it can be used wherever a TypeAdapter is expected.
+    """
+    def __init__(self, data_type: Any, model_type: Any):
+        self.adapter = TypeAdapter(data_type)
+        self.model_adapter = TypeAdapter(model_type)
+
+    def validate_python(self, data: Any) -> Any:
+        try:
+            return self.adapter.validate_python(data)
+        except ValidationError:
+            return self._from_model(self.model_adapter.validate_python(data))
+
+    def validate_json(self, data: str | bytes) -> Any:
+        try:
+            return self.adapter.validate_json(data)
+        except ValidationError:
+            return self._from_model(self.model_adapter.validate_json(data))
+
+    def _from_model(self, result: Any) -> Any:
+        # Only reached if the model accepts what the TypedDict didn't, e.g. model instances in the data
+        return self.adapter.validate_python(self.model_adapter.dump_python(result, exclude_unset=True))
+
+
+# Compiled once at import
+IDEAS = FastValidator(List[IdeaInputData], List[IdeaInput])
+IDEA_REQUEST = FastValidator(IdeaRequestData, IdeaRequest)
+IDEA_REQUESTS = FastValidator(List[IdeaRequestData], List[IdeaRequest])
@@ -0,0 +1,420 @@
+"""
+Response compression (gzip, zstd, brotli), negotiated through `Accept-Encoding`, and decoding of
+compressed request bodies (gzip, zstd) sent with `Content-Encoding`.
+
+Unlike Starlette's GZipMiddleware, compressing large bodies doesn't block the event loop: chunks
+above `thread_threshold` bytes are compressed in the thread pool (zlib, zstandard and brotli all
+release the GIL while compressing). Streamed responses are compressed chunk by chunk, and each
+chunk is flushed, so clients still receive the data as it is produced.
+
+zstd and brotli need the optional `zstandard` / `brotli` packages; encodings whose package isn't
+installed are never selected.
+"""
+import zlib
+from typing import Dict, List, Optional, Sequence
+
+from anyio import to_thread
+from fastapi import HTTPException
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Content types that are already compressed, or are streamed event by event
+EXCLUDED_CONTENT_TYPES = (
+    "image/",
+    "video/",
+    "audio/",
+    "application/zip",
+    "application/gzip",
+    "application/zstd",
+    "application/vnd.apache.parquet",
+    "text/event-stream",
+)
+
+
+class Compressor:
+    """Minimal common interface of the compression libraries"""
+    def compress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+    def flush(self) -> bytes:
+        """Emits everything compressed so far, without ending the stream"""
+        raise NotImplementedError
+
+    def finish(self) -> bytes:
+        raise NotImplementedError
+
+
+class GzipCompressor(Compressor):
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class ZstdCompressor(Compressor):
+    def __init__(self, level: int):
+        import zstandard
+        self._flush_block = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(self._flush_block)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class BrotliCompressor(Compressor):
+    def __init__(self, quality: int):
+        import brotli
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+def make_compressor(encoding: str, level: int) -> Compressor:
+    if encoding == "zstd":
+        return ZstdCompressor(level)
+    if encoding == "br":
+        return BrotliCompressor(level)
+    return GzipCompressor(level)
+
+
+# Python package needed for each encoding (None: standard library)
+ENCODING_PACKAGES = {"gzip": None, "zstd": "zstandard", "br": "brotli"}
+
+
+def available_encodings(encodings: Sequence[str]) -> List[str]:
+    """The configured encodings whose compression library is installed, in the same order"""
+    available = []
+    for encoding in encodings:
+        if encoding not in ENCODING_PACKAGES:
+            raise ValueError(f"Unsupported compression encoding: {encoding}")
+        package = ENCODING_PACKAGES[encoding]
+        if package is not None:
+            try:
+                __import__(package)
+            except ImportError:
+                print(f"{encoding} compression disabled: {package} is not installed")
+                continue
+        available.append(encoding)
+    return available
+
+
+def select_encoding(accept_encoding: str, encodings: Sequence[str]) -> Optional[str]:
+    """
+    Picks the encoding for a response: among the encodings the client accepts (q > 0), the one
+    that comes first in our preference order `encodings`. None means no compression.
+    """
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        coding, *params = [item.strip() for item in part.split(";")]
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            accepted[coding.lower()] = quality
+
+    for encoding in encodings:
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+class CompressionMiddleware:
+    """
+    Compresses responses of at least `minimum_size` bytes with the best encoding the client accepts.
+
+    Args:
+        encodings: Encodings to offer, in order of preference ("zstd", "br", "gzip")
+        minimum_size: Smaller (non-streamed) responses are sent uncompressed
+        thread_threshold: Chunks of at least this many bytes are compressed in the thread pool
+        gzip_level / zstd_level / brotli_quality: Compression levels
+    """
+    def __init__(
+        self,
+        app: ASGIApp,
+        encodings: Sequence[str] = ("zstd", "br", "gzip"),
+        minimum_size: int = 1024,
+        thread_threshold: int = 64 * 1024,
+        gzip_level: int = 6,
+        zstd_level: int = 3,
+        brotli_quality: int = 4,
+    ) -> None:
+        self.app = app
+        self.encodings = available_encodings(encodings)
+        self.minimum_size = minimum_size
+        self.thread_threshold = thread_threshold
+        self.levels = {"gzip": gzip_level, "zstd": zstd_level, "br": brotli_quality}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = select_encoding(Headers(scope=scope).get("accept-encoding", ""), self.encodings)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = CompressionResponder(send, encoding, self.levels[encoding], self.minimum_size, self.thread_threshold)
+        await self.app(scope, receive, responder.send)
+
+
+class CompressionResponder:
+    """Wraps `send` for one response: holds back the headers until it knows whether to compress"""
+    def __init__(self, send: Send, encoding: str, level: int, minimum_size: int, thread_threshold: int):
+        self._send = send
+        self.encoding = encoding
+        self.level = level
+        self.minimum_size = minimum_size
+        self.thread_threshold = thread_threshold
+        self.start_message: Optional[Message] = None
+        self.compressor: Optional[Compressor] = None
+        self.passthrough = False
+
+    async def send(self, message: Message) -> None:
+        message_type = message["type"]
+        if message_type == "http.response.start":
+            self.start_message = message
+            headers = Headers(raw=message["headers"])
+            content_type = headers.get("content-type", "")
+            self.passthrough = (
+                "content-encoding" in headers
+                or message["status"] < 200 or message["status"] in (204, 304)
+                or content_type.startswith(EXCLUDED_CONTENT_TYPES)
+            )
+            return
+
+        if message_type != "http.response.body":
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.start_message is not None:
+            start_message, self.start_message = self.start_message, None
+            if self.passthrough or (not more_body and len(body) < self.minimum_size):
+                await self._send(start_message)
+                await self._send(message)
+                self.passthrough = True
+                return
+
+            self.compressor = make_compressor(self.encoding, self.level)
+            headers = MutableHeaders(raw=start_message["headers"])
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            if more_body:
+                # Length of a compressed stream isn't known upfront
+                del headers["Content-Length"]
+            else:
+                body = await self._run(self._compress_last, body)
+                headers["Content-Length"] = str(len(body))
+                await self._send(start_message)
+                await self._send({"type": "http.response.body", "body": body})
+                return
+            await self._send(start_message)
+
+        if self.passthrough:
+            await self._send(message)
+            return
+
+        if more_body:
+            body = await self._run(self._compress_chunk, body)
+        else:
+            body = await self._run(self._compress_last, body)
+        await self._send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+    async def _run(self, function, body: bytes) -> bytes:
+        if len(body) >= self.thread_threshold:
+            return await to_thread.run_sync(function, body)
+        return function(body)
+
+    def _compress_chunk(self, body: bytes) -> bytes:
+        return self.compressor.compress(body) + self.compressor.flush()
+
+    def _compress_last(self, body: bytes) -> bytes:
+        return self.compressor.compress(body) + self.compressor.finish()
+
+
+
+class RequestBodyTooLarge(Exception):
+    pass
+
+
+class Decompressor:
+    """Incremental decompression that stops as soon as the output exceeds `max_size` bytes"""
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+
+    def decompress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+    def finish(self) -> bytes:
+        """Called after the last chunk; raises ValueError if the stream is incomplete"""
+        return b""
+
+    def _count(self, size: int) -> None:
+        self.size += size
+        if self.size > self.max_size:
+            raise RequestBodyTooLarge()
+
+
+class GzipDecompressor(Decompressor):
+    def __init__(self, max_size: int):
+        super().__init__(max_size)
+        self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def decompress(self, data: bytes) -> bytes:
+        try:
+            # Never inflate more than one byte past the limit, however well the input compresses
+            output = self._decompressor.decompress(data, self.max_size - self.size + 1)
+        except zlib.error as error:
+            raise ValueError(str(error)) from error
+        self._count(len(output))
+        if self._decompressor.unconsumed_tail:
+            raise RequestBodyTooLarge()
+        return output
+
+    def finish(self) -> bytes:
+        if not self._decompressor.eof:
+            raise ValueError("Incomplete gzip stream")
+        return b""
+
+
+class ZstdDecompressor(Decompressor):
+    # A zstd block decodes to at most 128KB and takes at least 4 bytes (an RLE block), so the input
+    # is fed in slices that can't inflate much past the limit (decompressobj has no output limit)
+    MAX_RATIO = 32 * 1024
+    MIN_SLICE = 64
+
+    def __init__(self, max_size: int):
+        import zstandard
+        super().__init__(max_size)
+        self._error = zstandard.ZstdError
+        self._decompressor = zstandard.ZstdDecompressor()
+        self._frame = self._decompressor.decompressobj()
+
+    def decompress(self, data: bytes) -> bytes:
+        output = []
+        view, offset = memoryview(data), 0
+        while offset < len(view):
+            if self._frame.eof:
+                # Concatenated frames decode to the concatenated contents
+                self._frame = self._decompressor.decompressobj()
+            size = max(self.MIN_SLICE, (self.max_size - self.size) // self.MAX_RATIO + 1)
+            try:
+                chunk = self._frame.decompress(view[offset:offset + size])
+            except self._error as error:
+                raise ValueError(str(error)) from error
+            offset += size
+            if self._frame.eof and self._frame.unused_data:
+                # Input after the end of the frame; the next frame starts there
+                offset -= len(self._frame.unused_data)
+            self._count(len(chunk))
+            output.append(chunk)
+        return b"".join(output)
+
+    def finish(self) -> bytes:
+        if not self._frame.eof:
+            raise ValueError("Incomplete zstd frame")
+        return b""
+
+
+REQUEST_DECOMPRESSORS = {"gzip": GzipDecompressor, "zstd": ZstdDecompressor}
+
+
+class RequestDecompressionMiddleware:
+    """
+    Decodes request bodies sent with `Content-Encoding: gzip` or `zstd`.
+
+    The body is decompressed chunk by chunk while the app reads it, so it's never held compressed
+    and decompressed at the same time. Once the decoded body exceeds `max_size` bytes, reading it
+    fails with 413 (so a small "zip bomb" can't inflate into gigabytes). Corrupt bodies fail with
+    400 and unsupported encodings with 415. For the app, decoded requests look like uncompressed ones.
+
+    Args:
+        max_size: Maximum size of a decoded body in bytes
+        thread_threshold: Chunks of at least this many bytes are decompressed in the thread pool
+    """
+    def __init__(self, app: ASGIApp, max_size: int, thread_threshold: int = 64 * 1024) -> None:
+        self.app = app
+        self.max_size = max_size
+        self.thread_threshold = thread_threshold
+        self.encodings = available_encodings(REQUEST_DECOMPRESSORS)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        encoding = headers.get("content-encoding", "identity").strip().lower()
+        if encoding == "identity":
+            await self.app(scope, receive, send)
+            return
+
+        if encoding not in self.encodings:
+            response = JSONResponse(
+                status_code=415,
+                content={"detail": f"Unsupported Content-Encoding: {encoding}. Supported: {', '.join(self.encodings)}"},
+                headers={"Accept-Encoding": ", ".join(self.encodings)}
+            )
+            await response(scope, receive, send)
+            return
+
+        decompressor = REQUEST_DECOMPRESSORS[encoding](self.max_size)
+
+        async def receive_decompressed() -> Message:
+            message = await receive()
+            if message["type"] != "http.request":
+                return message
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            try:
+                if len(body) >= self.thread_threshold:
+                    body = await to_thread.run_sync(decompressor.decompress, body)
+                else:
+                    body = decompressor.decompress(body)
+                if not more_body:
+                    body += decompressor.finish()
+            except RequestBodyTooLarge:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"Please provide less than {self.max_size // 1_000_000}MB of (decompressed) data"
+                )
+            except ValueError as error:
+                raise HTTPException(status_code=400, detail=f"Invalid {encoding} request body: {error}")
+            return {**message, "body": body, "more_body": more_body}
+
+        # The app sees the decoded body; its length isn't known upfront
+        scope = dict(scope)
+        scope["headers"] = [
+            (name, value) for name, value in scope["headers"]
+            if name not in (b"content-encoding", b"content-length")
+        ]
+        await self.app(scope, receive_decompressed, send)
@@ -1,5 +1,5 @@
 from pydantic_settings import SettingsConfigDict, BaseSettings
-from typing import Dict, TypedDict
+from typing import Dict, List, TypedDict
 import os
 
 class OperationCost(TypedDict):
@@ -55,6 +55,49 @@ class Settings(BaseSettings):
     
     is_in_trial_mode: bool = True
     
+    # Response compression. Encodings in order of preference; zstd & br need the zstandard / brotli packages
+    COMPRESSION_ENABLED: bool = True
+    COMPRESSION_ENCODINGS: List[str] = ["zstd", "br", "gzip"]
+    COMPRESSION_MINIMUM_SIZE: int = 1024  # bytes; smaller responses aren't worth compressing
+    COMPRESSION_THREAD_THRESHOLD: int = 64 * 1024  # bytes; larger chunks are compressed off the event loop
+    GZIP_LEVEL: int = 6
+    ZSTD_LEVEL: int = 3
+    BROTLI_QUALITY: int = 4
+    
+    # Request bodies sent with Content-Encoding gzip / zstd are rejected once they decompress to more than this.
+    # Leaves room for the JSON around 10MB of ideas (ids, escaped non-ASCII text)
+    MAX_DECOMPRESSED_REQUEST_SIZE: int = 32_000_000  # bytes
+    
+    # Worker processes for the CPU-bound analysis; 0 runs it in the threadpool of the server process.
+    # Each worker holds its own copy of the NLTK data and embeddings.
+    ANALYSIS_WORKERS: int = os.cpu_count() or 1
+    
+    # Background jobs (/v1/jobs). Put the database on a persistent volume, so queued jobs survive restarts
+    JOBS_DATABASE: str = "jobs.sqlite3"
+    JOB_CONCURRENCY: int = 1  # jobs running at once; each runs its analysis in the analysis worker pool
+    JOB_RESULT_TTL: int = 86400  # seconds that finished jobs & their results are kept
+    JOB_DRAIN_TIMEOUT: float = 20  # seconds to wait for running jobs on shutdown before requeueing them
+    
+    # Idempotency-Key support for /v1/rank_ideas: responses are kept in this database for the TTL.
+    # Requests that never finished release their key after the lock timeout
+    IDEMPOTENCY_DATABASE: str = "idempotency.sqlite3"
+    IDEMPOTENCY_TTL: int = 86400  # seconds
+    IDEMPOTENCY_LOCK_TIMEOUT: int = 600  # seconds
+    
+    # Analysis result cache: identical idea sets reuse the analysis. Entries are kept in memory, and in
+    # CACHE_DIR too if it's set (put it on a persistent volume, so the cache survives restarts)
+    CACHE_ENABLED: bool = True
+    CACHE_MAX_BYTES: int = 128_000_000
+    CACHE_DIR: str = ""
+    CACHE_DISK_MAX_BYTES: int = 1_000_000_000
+    
+    # Analysis sessions (/v1/sessions) are kept in memory for the TTL, within this many bytes in total
+    SESSION_TTL: int = 3600  # seconds
+    SESSION_MAX_BYTES: int = 128_000_000
+    
+    # Key for the /v1/admin endpoints (sent as X-Admin-Key); they're disabled while it's empty
+    ADMIN_API_KEY: str = ""
+    
     # Environment
     ENVIRONMENT: str = "DEV"
     
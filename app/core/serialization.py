@@ -0,0 +1,35 @@
+from typing import Any
+
+import orjson
+from fastapi.responses import Response
+from pydantic import BaseModel
+
+# Numpy arrays (e.g. the pairwise similarity matrix) are written directly by orjson,
+# without ever being converted into nested Python lists.
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def _default(obj: Any) -> Any:
+    """Fallback for objects orjson doesn't know natively"""
+    if isinstance(obj, BaseModel):
+        # Models are built with model_construct() on the fast path, so there is nothing to
+        # validate; iterating a model yields its fields and orjson recurses into the values.
+        return dict(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    """Serialize a response payload (dicts, models, numpy arrays) straight to JSON bytes"""
+    return orjson.dumps(content, default=_default, option=ORJSON_OPTIONS)
+
+
+class FastJSONResponse(Response):
+    """
+    JSON response that skips FastAPI's response_model validation & jsonable_encoder pass.
+
+    Only use this for payloads that were built from already-validated data.
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,88 @@
+"""
+Process pool for the CPU-bound analysis.
+
+An analysis of a few thousand ideas takes seconds to minutes of pure CPU. Run on the event loop,
+it stalls every other request (auth, credits, other users' analyses) for that long; run in a
+thread, it still competes for the GIL. The pool runs analyses in separate worker processes, so
+the API stays responsive and concurrent analyses use all cores.
+
+The workers are pre-warmed with the NLTK data and embeddings when the app starts (see main.py).
+Without a running pool (ANALYSIS_WORKERS=0, or in tests that don't start the app) the work is
+done in the threadpool instead.
+"""
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional, TypeVar
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+
+T = TypeVar("T")
+
+
+def _warm_up_worker():
+    from app.services.analyzer import warm_up
+    warm_up()
+
+
+def _ready() -> bool:
+    return True
+
+
+class AnalysisPool:
+    """
+    Runs functions in worker processes: `result = await pool.run(function, *args)`.
+    The function, its arguments and its result must be picklable.
+    """
+    def __init__(self, workers: int, initializer: Optional[Callable[[], None]] = _warm_up_worker):
+        self.workers = workers
+        self.initializer = initializer
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def running(self) -> bool:
+        return self._executor is not None
+
+    def start(self):
+        """Starts the worker processes, which load their resources in the background"""
+        if self.workers <= 0 or self._executor is not None:
+            return
+        # 'spawn' instead of fork: forking the server process would copy its threads' state
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=self.initializer,
+        )
+        # Workers are started on demand; one task per worker starts (and warms up) all of them now
+        for _ in range(self.workers):
+            self._executor.submit(_ready)
+        print(f"Started {self.workers} analysis worker processes")
+
+    def shutdown(self):
+        """Waits for the running analyses to finish, then stops the workers"""
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    async def run(self, function: Callable[..., T], *args) -> T:
+        executor = self._executor
+        if executor is None:
+            return await run_in_threadpool(function, *args)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, function, *args)
+        except BrokenProcessPool:
+            # A worker died, e.g. killed for using too much memory. Don't retry in this process
+            # (the same analysis could take the server down), but replace the pool for the next requests.
+            print("Analysis worker pool broke; restarting it")
+            if self._executor is executor:
+                self._executor = None
+                executor.shutdown(wait=False, cancel_futures=True)
+                self.start()
+            raise HTTPException(status_code=503, detail="The analysis was interrupted. Please try again.")
+
+
+analysis_pool = AnalysisPool(settings.ANALYSIS_WORKERS)
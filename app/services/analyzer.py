@@ -1,9 +1,9 @@
 import os
 import time
+from functools import lru_cache
 from typing import List
 from pathlib import Path
 import numpy as np
-import random
 from numpy.random import RandomState
 import matplotlib.pyplot as plt
 from matplotlib.collections import LineCollection
@@ -20,7 +20,8 @@ from nltk.tokenize import word_tokenize, sent_tokenize
 
 from nltk.stem import WordNetLemmatizer
 from typing import List
-from .types import CentroidAnalysisResult, PlotData, Results
+from .similarity import normalize_rows
+from .types import AnalysisResult, CentroidAnalysisResult
 
 
 def init_nltk_resources():
@@ -50,27 +51,127 @@ def init_nltk_resources():
     with open(cache_file, 'w') as f:
         f.write(str(current_time))
 
+# Bump this whenever a change to the analysis changes its results (or what they include); it's
+# part of the cache keys
+ALGORITHM_VERSION = 3
+ANALYSIS_SEED = 42
+
+# Replace with the path to your GloVe embeddings file; without it, only the word counts are used
+GLOVE_FILE_PATH = 'glove.6B.100d.txt'
+
+@lru_cache(maxsize=1)
+def load_glove_embeddings(file_path: str):
+    """The GloVe word vectors, parsed once per process (or None if the file doesn't exist)"""
+    if not Path(file_path).exists():
+        return None
+    embeddings_index = {}
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            values = line.split()
+            word = values[0]
+            coefs = np.asarray(values[1:], dtype='float32')
+            embeddings_index[word] = coefs
+    return embeddings_index
+
+def analysis_parameters() -> dict:
+    """Everything besides the ideas that determines the result of centroid_analysis"""
+    return {
+        "version": ALGORITHM_VERSION,
+        "seed": ANALYSIS_SEED,
+        "vectorizer": "count",
+        "embeddings": GLOVE_FILE_PATH if Path(GLOVE_FILE_PATH).exists() else None,
+    }
+
+def warm_up():
+    """
+    Loads the NLTK corpora & models and the embeddings into this process, so the first analysis
+    doesn't pay for it. Used to pre-warm the analysis worker processes.
+    """
+    stopwords.words('english')
+    WordNetLemmatizer().lemmatize('ideas')
+    word_tokenize(sent_tokenize('Warming up the tokenizers.')[0])
+    load_glove_embeddings(GLOVE_FILE_PATH)
+
 def centroid_analysis(ideas: list) -> CentroidAnalysisResult:
-    # Initialize CountVectorizer to convert text into numerical vectors
-    count_vectorizer = CountVectorizer()
-    analyzer = Analyzer(ideas, count_vectorizer)
     print("Preprocessing and analyzing the ideas...")
-    coords, marker_sizes, kmeans_data = analyzer.process_get_data()
+    analysis = StagedAnalysis(ideas)
+    analysis.rank()
+    analysis.scatter()
+    analysis.cluster()
     print("Done.")
+    return analysis.result()
+
+def cluster_vectors(vectors: np.ndarray, n_clusters: int) -> dict:
+    """
+    k-means with a given number of clusters, over the normalized idea vectors of an analysis
+    (ranked order, centroid last). Same clustering and kmeans data as the analysis' own, which
+    picks the number of clusters itself.
+    """
+    ideas = vectors[:-1]
+    # The pairwise cosine distances, like Analyzer.pairwise_distance
+    idea_matrix = np.clip(1 - ideas @ ideas.T, 0, 2)
+    kmeans = KMeans(n_clusters=n_clusters, random_state=42)
+    labels = kmeans.fit_predict(idea_matrix)
+    pca = PCA(n_components=2)
+    return {
+        "data": pca.fit_transform(idea_matrix),
+        "centers": pca.transform(kmeans.cluster_centers_),
+        "cluster": labels,
+    }
+
+class StagedAnalysis:
+    """
+    The centroid analysis, one stage at a time, so that each stage's results can be sent as soon
+    as they are available (see /rank_ideas/stream). Every stage is CPU-bound; run them in a
+    worker thread when calling from async code.
 
-    results = Results(
-        ideas = analyzer.ideas, 
-        similarity = [x[0] for x in analyzer.cos_similarity.tolist()], 
-        distance = [x[0] for x in analyzer.distance_to_centroid.tolist()]
-    )
-    plot_data = PlotData(
-        scatter_points = coords.tolist(),
-        marker_sizes = marker_sizes.tolist(),
-        ideas = analyzer.ideas,
-        pairwise_similarity = analyzer.pairwise_similarity.tolist(),
-        kmeans_data = kmeans_data
-    )
-    return results, plot_data
+    1. rank():    preprocessing, vectors & similarity to the centroid -> (order, similarity)
+    2. cluster(): kmeans over the pairwise distances -> cluster labels (ranked order)
+    3. scatter(): MDS coordinates of the ideas and the centroid
+    
+    cluster() and scatter() only need rank(), not each other. result() returns the complete
+    AnalysisResult once all three have run.
+    """
+    def __init__(self, ideas: List[str]):
+        self.ideas = ideas
+        # CountVectorizer converts the text into numerical vectors
+        self.analyzer = Analyzer(ideas, CountVectorizer())
+        self.kmeans_data = None
+        self.coords = None
+
+    def rank(self):
+        self.analyzer.preprocess_ideas()
+        self.analyzer.calculate_similarities()
+        return self.analyzer.order, self.analyzer.cos_similarity[:, 0]
+
+    def cluster(self):
+        cluster_results = self.analyzer.perform_kmeans_analysis()
+        self.kmeans_data = self.analyzer.get_kmeans_data(cluster_results)
+        return np.asarray(self.kmeans_data["cluster"])
+
+    def scatter(self):
+        self.coords, _ = self.analyzer.create_scatter_plot_data(1)
+        return self.coords
+
+    def result(self) -> AnalysisResult:
+        if self.coords is None or self.kmeans_data is None:
+            raise RuntimeError("result() needs the cluster() and scatter() stages")
+        analyzer = self.analyzer
+        # Keep everything as arrays; conversion to lists only happens for the fields that get emitted
+        return AnalysisResult(
+            ideas = self.ideas,
+            order = analyzer.order,
+            similarity = analyzer.cos_similarity[:, 0],
+            distance = analyzer.distance_to_centroid[:, 0],
+            coords = self.coords,
+            pairwise_similarity = None,  # computed from the vectors only if the full matrix is requested
+            vectors = analyzer.vectors,
+            cluster_labels = self.kmeans_data["cluster"],
+            cluster_points = self.kmeans_data["data"],
+            cluster_centers = self.kmeans_data["centers"],
+            vocabulary = np.asarray(analyzer.vectorizer.get_feature_names_out(), dtype=str),
+            centroid = analyzer.centroid,
+        )
 
 class Analyzer:
     """
@@ -86,7 +187,7 @@ class Analyzer:
     """
     def __init__(self, ideas: List[str], vectorizer):
         self.processed_ideas = ideas  # these ones we modify & preprocess, i.e. remove punctuation, lemmatize etc...
-        self.ideas = ideas   # these stay unmodified, but will be sorted by similarity later
+        self.ideas = ideas   # these stay unmodified; `self.order` holds their ranking once calculated
         self.vectorizer = vectorizer
 
     def preprocess_ideas(self):
@@ -107,22 +208,9 @@ class Analyzer:
         return self.processed_ideas
 
     def embedd_ideas(self):
-
-        def load_glove_embeddings(file_path):
-            embeddings_index = {}
-            with open(file_path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    values = line.split()
-                    word = values[0]
-                    coefs = np.asarray(values[1:], dtype='float32')
-                    embeddings_index[word] = coefs
-            return embeddings_index
-
-        # Replace 'path_to_glove_file' with the path to your GloVe embeddings file
-        glove_file_path = Path('glove.6B.100d.txt')
-        if not glove_file_path.exists():
+        embeddings_index = load_glove_embeddings(GLOVE_FILE_PATH)
+        if embeddings_index is None:
             return None
-        embeddings_index = load_glove_embeddings(glove_file_path)
 
         def get_sentence_embedding(tokens, embeddings_index):
             valid_embeddings = [embeddings_index[word] for word in tokens if word in embeddings_index]
@@ -153,26 +241,29 @@ class Analyzer:
 
         # Calculate the centroid (mean) of the idea array along axis 0 (rows)
         centroid = np.mean(idea_matrix, axis=0)
+        # Kept (with the vocabulary) so ideas can be added to the analysis later, see incremental.py
+        self.centroid = centroid
 
         # Add the centroid as another row/column
         idea_matrix = np.vstack([idea_matrix, centroid])
 
-        # Sort the idea_matrix based on the pairwise distances
-        # we only need this temporarily to then be able to sort the idea_matrix 
-        # according to which ideas _will_ be closest to the centroid. 
-        # Then after sorting, we'll have to create pairwise_distances and others again.
-        temp_pairwise_distance = pairwise_distances(idea_matrix, metric='cosine')
-        sorted_indices = np.argsort(temp_pairwise_distance[:-1, -1])
+        # Rank the ideas by their similarity to the centroid (most similar first).
+        # Only the similarity to the centroid is needed for this, not the full pairwise matrix.
+        # A stable sort keeps ties in input order, so the ranking is deterministic.
+        centroid_similarity = cosine_similarity(idea_matrix[:-1], centroid.reshape(1, -1))[:, 0]
+        sorted_indices = np.argsort(-centroid_similarity, kind='stable')
         idea_matrix = np.concatenate((idea_matrix[sorted_indices], idea_matrix[-1:]))
 
-        # (also make sure that we keep the order of our ideas array the same)
-        self.ideas = [self.ideas[i] for i in sorted_indices]
+        # The ideas themselves are never reordered; instead we keep the permutation
+        # (ranked position -> input index) and carry it through to the response.
+        self.order = sorted_indices
 
         # Calculate similarity & distances
         # *Distances* between ideas (including the centroid), used to get the coords on the scatterplot:
         self.pairwise_distance = pairwise_distances(idea_matrix, metric='cosine')
-        # *Similarity* between each idea; for the weight of the connecting lines:
-        self.pairwise_similarity = cosine_similarity(idea_matrix, idea_matrix)
+        # Normalized idea vectors; the *similarity* between each idea (for the weight of the connecting lines)
+        # is their dot product, which is only computed for the parts of the matrix that are needed:
+        self.vectors = normalize_rows(idea_matrix)
         # Similarity to centroid:
         self.cos_similarity = cosine_similarity(idea_matrix, centroid.reshape(1, -1))
         # make it so that 0 is 'same' and 1 is very different. This is used to calculate the marker size:
@@ -252,7 +343,11 @@ class Analyzer:
 
         if n_clusters is None:
             optimal_k_inertia, optimal_k_silhouette = self.find_optimal_clusters()
-            n_clusters = random.choice([optimal_k_inertia, optimal_k_silhouette])  # Don't know which optimum is better, so choose random...
+            # Don't know which optimum is better, so choose "randomly"... by the ideas' cache key
+            # (which ignores case & whitespace), so all idea lists sharing a cached result get the
+            # same clusters. Imported here, since the cache module imports this one.
+            from .cache import analysis_key
+            n_clusters = (optimal_k_inertia, optimal_k_silhouette)[int(analysis_key(self.ideas)[:2], 16) % 2]
 
         kmeans = KMeans(n_clusters=n_clusters, random_state=42)
         cluster_labels = kmeans.fit_predict(idea_matrix)
@@ -282,11 +377,11 @@ class Analyzer:
         # Calculate the cluster centers in the reduced space
         reduced_centers = pca.transform(kmeans.cluster_centers_)
 
-        # Add the data to the kmeans_data_points dict
+        # Add the data to the kmeans_data_points dict (as arrays; they only get converted when emitted)
         kmeans_data_points = {
-            "data": reduced_data.tolist(), 
-            "centers": reduced_centers.tolist(), 
-            "cluster": labels.tolist()
+            "data": reduced_data, 
+            "centers": reduced_centers, 
+            "cluster": labels
         }
 
         return kmeans_data_points
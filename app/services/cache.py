@@ -0,0 +1,318 @@
+"""
+Content-addressed cache for analysis results.
+
+The same idea sets come in again and again: retries, dashboards that refresh, demos, the same set
+asked for in another format. The analysis only depends on the idea texts (up to case and
+whitespace, which preprocessing drops anyway) and on the algorithm, and it's seeded, so a result
+can be reused for any request with the same normalized ideas in the same order.
+
+Results are stored under a hash of exactly that, in tiers: a memory LRU bounded by bytes, and
+optionally a directory on disk, which survives restarts (e.g. the machine scaling to zero).
+Disk hits are promoted to memory.
+
+Only the arrays of an AnalysisResult are stored, not the ideas; a hit is rebuilt around the
+caller's ideas, so ids and original texts are always the caller's own. The features built from
+the arrays (graph, pairwise matrix) are cheap compared to the analysis and aren't cached.
+
+Concurrent requests for the same analysis (e.g. the same page open in several tabs) don't each
+run it either: SingleFlight lets them await the one that's already in progress.
+"""
+import asyncio
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, TypeVar
+
+import numpy as np
+import orjson
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from .analyzer import analysis_parameters
+from .types import AnalysisResult
+
+Arrays = Dict[str, np.ndarray]
+T = TypeVar("T")
+
+
+def normalize_idea(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def analysis_key(ideas: List[str]) -> str:
+    """Hash of the normalized ideas and the parameters of the analysis"""
+    digest = hashlib.sha256(orjson.dumps(analysis_parameters(), option=orjson.OPT_SORT_KEYS))
+    for idea in ideas:
+        # Length-prefixed, so no two lists of ideas hash the same input
+        normalized = normalize_idea(idea).encode()
+        digest.update(len(normalized).to_bytes(8, "little"))
+        digest.update(normalized)
+    return digest.hexdigest()
+
+
+def arrays_size(arrays: Arrays) -> int:
+    return sum(array.nbytes for array in arrays.values())
+
+
+class CacheBackend:
+    """A store of arrays by key, bounded by bytes. Implementations must be thread-safe."""
+    name = "backend"
+
+    def get(self, key: str) -> Optional[Arrays]:
+        raise NotImplementedError
+
+    def set(self, key: str, arrays: Arrays):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        raise NotImplementedError
+
+
+class MemoryBackend(CacheBackend):
+    """Least recently used entries are evicted first"""
+    name = "memory"
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Arrays]" = OrderedDict()
+        self._bytes = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Arrays]:
+        with self._lock:
+            arrays = self._entries.get(key)
+            if arrays is not None:
+                self._entries.move_to_end(key)
+            return arrays
+
+    def set(self, key: str, arrays: Arrays):
+        size = arrays_size(arrays)
+        if size > self.max_bytes:
+            return
+        # Cached arrays are shared between requests; nothing may change them
+        for array in arrays.values():
+            array.flags.writeable = False
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= arrays_size(previous)
+            self._entries[key] = arrays
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= arrays_size(evicted)
+                self._evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "name": self.name,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self._evictions,
+            }
+
+
+class DiskBackend(CacheBackend):
+    """
+    One .npz file per entry (no pickles, so a tampered file can't run code). Files are written
+    to a temporary name and renamed, so readers never see half an entry; the least recently
+    used files (by modification time, which hits update) are evicted first.
+    """
+    name = "disk"
+    SUFFIX = ".npz"
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._evictions = 0
+        self._lock = threading.Lock()
+        # key -> size, least recently used first
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        files = sorted(self.directory.glob("*" + self.SUFFIX), key=lambda path: path.stat().st_mtime)
+        for path in files:
+            self._entries[path.stem] = path.stat().st_size
+        self._bytes = sum(self._entries.values())
+
+    def _path(self, key: str) -> Path:
+        return self.directory / (key + self.SUFFIX)
+
+    def get(self, key: str) -> Optional[Arrays]:
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                arrays = {name: data[name] for name in data.files}
+            os.utime(path)
+        except (OSError, ValueError) as e:
+            # Gone (flushed meanwhile) or unreadable: drop it
+            print(f"Dropping unreadable cache entry {key}: {e}")
+            self._remove(key)
+            return None
+        return arrays
+
+    def set(self, key: str, arrays: Arrays):
+        if arrays_size(arrays) > self.max_bytes:
+            return
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                # The idea vectors are mostly zeros (word counts), so they compress well
+                np.savez_compressed(f, **arrays)
+            size = os.path.getsize(tmp)
+            os.replace(tmp, self._path(key))
+        except OSError as e:
+            print(f"Failed to write cache entry {key}: {e}")
+            Path(tmp).unlink(missing_ok=True)
+            return
+
+        with self._lock:
+            self._bytes += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+            evicted = []
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                old_key, old_size = self._entries.popitem(last=False)
+                self._bytes -= old_size
+                self._evictions += 1
+                evicted.append(old_key)
+        for old_key in evicted:
+            self._path(old_key).unlink(missing_ok=True)
+
+    def _remove(self, key: str):
+        with self._lock:
+            self._bytes -= self._entries.pop(key, 0)
+        self._path(key).unlink(missing_ok=True)
+
+    def clear(self):
+        with self._lock:
+            keys = list(self._entries)
+            self._entries.clear()
+            self._bytes = 0
+        for key in keys:
+            self._path(key).unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "name": self.name,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self._evictions,
+            }
+
+
+class AnalysisCache:
+    """
+    Looks results up in its backends in order (fastest first), and promotes hits to the
+    faster ones. Without backends, nothing is cached.
+    """
+    def __init__(self, backends: List[CacheBackend]):
+        self.backends = backends
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.backends)
+
+    def _get(self, key: str) -> Optional[Arrays]:
+        for i, backend in enumerate(self.backends):
+            arrays = backend.get(key)
+            if arrays is not None:
+                for faster in self.backends[:i]:
+                    faster.set(key, arrays)
+                return arrays
+        return None
+
+    def _set(self, key: str, arrays: Arrays):
+        for backend in self.backends:
+            backend.set(key, arrays)
+
+    async def get(self, key: str, ideas: List[str]) -> Optional[AnalysisResult]:
+        """The cached analysis for `key`, rebuilt around `ideas`"""
+        if not self.enabled:
+            return None
+        arrays = await run_in_threadpool(self._get, key)
+        if arrays is None:
+            self._misses += 1
+            return None
+        self._hits += 1
+        return AnalysisResult.from_arrays(ideas, arrays)
+
+    async def set(self, key: str, analysis: AnalysisResult):
+        if self.enabled:
+            await run_in_threadpool(self._set, key, analysis.arrays())
+
+    def clear(self):
+        for backend in self.backends:
+            backend.clear()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "hits": self._hits,
+            "misses": self._misses,
+            "tiers": [backend.stats() for backend in self.backends],
+        }
+
+    @classmethod
+    def from_settings(cls) -> "AnalysisCache":
+        if not settings.CACHE_ENABLED:
+            return cls([])
+        backends: List[CacheBackend] = [MemoryBackend(settings.CACHE_MAX_BYTES)]
+        if settings.CACHE_DIR:
+            backends.append(DiskBackend(settings.CACHE_DIR, settings.CACHE_DISK_MAX_BYTES))
+        return cls(backends)
+
+
+class SingleFlight:
+    """
+    Runs one computation per key at a time; calls for a key that's already in progress await
+    that computation and get its result (or its exception):
+
+        analysis = await flights.run(key, compute)
+    """
+    def __init__(self):
+        self._flights: Dict[str, asyncio.Future] = {}
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    def _landed(self, key: str, flight: asyncio.Future):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        # Nobody may be waiting for a failed flight anymore; don't log its exception as unretrieved
+        if not flight.cancelled():
+            flight.exception()
+
+    async def run(self, key: str, compute: Callable[[], Awaitable[T]]) -> T:
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = asyncio.ensure_future(compute())
+            self._flights[key] = flight
+            flight.add_done_callback(lambda done: self._landed(key, done))
+        # A caller that goes away (e.g. a disconnected client) doesn't cancel it for the others
+        return await asyncio.shield(flight)
+
+
+analysis_cache = AnalysisCache.from_settings()
+analysis_flights = SingleFlight()
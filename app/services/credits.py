@@ -38,16 +38,37 @@ class CreditService:
             return True
         cost = await CreditService.get_operation_cost(operation, data_size, bytes)
         print(f"Deducting {cost} credits from {user_id} for {operation} with {data_size} statements and a total of {bytes} bytes")
+        return await CreditService.deduct_amount(user_id, operation, cost)
+
+    @staticmethod
+    async def deduct_amount(user_id: str, operation: str, amount: int) -> bool:
+        """Deduct an already calculated amount, e.g. the total of one operation over a batch of analyses"""
+        if settings.is_in_trial_mode:
+            return True
         result = db.rpc(
             'deduct_credits',
             {
                 'p_user_id': user_id,
-                'amount': cost,
+                'amount': amount,
                 'operation': operation
             }
         ).execute()
         return result.data
 
+    @staticmethod
+    async def refund_amount(user_id: str, operation: str, amount: int):
+        """Give back credits deducted up front for an operation that then failed"""
+        if settings.is_in_trial_mode:
+            return
+        db.rpc(
+            'refund_credits',
+            {
+                'p_user_id': user_id,
+                'amount': amount,
+                'operation': operation
+            }
+        ).execute()
+
     @staticmethod
     async def get_operation_cost(operation: str, data_size: int, bytes: int) -> int:
         """Calculate credit cost based on operation type and data size"""
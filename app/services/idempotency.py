@@ -0,0 +1,121 @@
+"""
+Idempotency keys: a client that retries a request (e.g. after a proxy timed it out) with the same
+`Idempotency-Key` gets the stored response of the first attempt, instead of a second analysis and
+a second charge.
+
+The first request with a key claims it with an in-progress marker; once it's done, its response
+is stored in place of the marker for `ttl` seconds. Failed requests release the key, so they can
+be retried. Markers of requests that never finished (e.g. the server was stopped) expire after
+`lock_timeout` seconds. Backed by a SQLite file, like the job queue, so stored responses outlive
+a restart when it's on persistent storage.
+"""
+import json
+import sqlite3
+import time
+from contextlib import closing
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+IN_PROGRESS = "in_progress"
+COMPLETED = "completed"
+
+MAX_KEY_LENGTH = 255
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    owner TEXT NOT NULL,
+    key TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    status TEXT NOT NULL,
+    status_code INTEGER,
+    headers TEXT,
+    body BLOB,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (owner, key)
+);
+CREATE INDEX IF NOT EXISTS idempotency_keys_expiry ON idempotency_keys (expires_at);
+"""
+
+
+@dataclass
+class StoredResponse:
+    status_code: int
+    headers: Dict[str, str]
+    body: bytes
+
+
+class IdempotencyStore:
+    def __init__(self, path: str, ttl: float = 86400, lock_timeout: float = 600):
+        self.path = path
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        if not self._initialized:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+            self._initialized = True
+        return db
+
+    def _begin(self, owner: str, key: str, fingerprint: str) -> Optional[tuple]:
+        now = time.time()
+        with closing(self._connect()) as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.execute("DELETE FROM idempotency_keys WHERE expires_at <= ?", (now,))
+                claimed = db.execute(
+                    "INSERT OR IGNORE INTO idempotency_keys (owner, key, fingerprint, status, expires_at) VALUES (?, ?, ?, ?, ?)",
+                    (owner, key, fingerprint, IN_PROGRESS, now + self.lock_timeout),
+                ).rowcount
+                row = None if claimed else db.execute(
+                    "SELECT fingerprint, status, status_code, headers, body FROM idempotency_keys WHERE owner = ? AND key = ?",
+                    (owner, key),
+                ).fetchone()
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return row
+
+    async def begin(self, owner: str, key: str, fingerprint: str) -> Optional[StoredResponse]:
+        """
+        Claims the key for a request, or returns the response stored for it. `fingerprint`
+        identifies the request; a key can't be reused for a different one.
+
+        Returns None if the caller claimed the key; it must then `complete` or `release` it.
+        """
+        if not key or len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail=f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters")
+        row = await run_in_threadpool(self._begin, owner, key, fingerprint)
+        if row is None:
+            return None
+        stored_fingerprint, status, status_code, headers, body = row
+        if stored_fingerprint != fingerprint:
+            raise HTTPException(status_code=422, detail="This Idempotency-Key was already used for a different request")
+        if status == IN_PROGRESS:
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+        return StoredResponse(status_code=status_code, headers=json.loads(headers), body=body)
+
+    async def complete(self, owner: str, key: str, response: StoredResponse):
+        await run_in_threadpool(
+            self._execute,
+            "UPDATE idempotency_keys SET status = ?, status_code = ?, headers = ?, body = ?, expires_at = ? WHERE owner = ? AND key = ?",
+            (COMPLETED, response.status_code, json.dumps(response.headers), response.body, time.time() + self.ttl, owner, key),
+        )
+
+    async def release(self, owner: str, key: str):
+        """Drops the in-progress marker of a request that failed, so it can be retried"""
+        await run_in_threadpool(
+            self._execute,
+            "DELETE FROM idempotency_keys WHERE owner = ? AND key = ? AND status = ?",
+            (owner, key, IN_PROGRESS),
+        )
+
+    def _execute(self, query: str, parameters=()):
+        with closing(self._connect()) as db:
+            db.execute(query, parameters)
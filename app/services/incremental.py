@@ -0,0 +1,107 @@
+"""
+Adding ideas to an existing analysis without analyzing everything again.
+
+A full analysis of n ideas is O(n²) (pairwise distances, MDS, kmeans). Appending m ideas here is
+O(m·n) plus O(n) for re-ranking:
+
+- The new ideas are vectorized with the analysis' vocabulary (words it hasn't seen only count
+  through the word embeddings) and the centroid is updated from the stored mean vector.
+- Every idea's similarity to the new centroid is one dot product, so the whole ranking is updated.
+- Only the new ideas' similarities to the existing ones are computed. They're used to assign each
+  new idea to the existing cluster it's most similar to on average, and to place it on the scatter
+  plot among its most similar ideas.
+
+Clusters and coordinates drift from what a full analysis would give as more ideas are added, so
+callers should re-run the full analysis once enough have been appended (see needs_reanalysis).
+"""
+from typing import List
+
+import numpy as np
+from sklearn.feature_extraction.text import CountVectorizer
+
+from .analyzer import Analyzer
+from .similarity import normalize_rows
+from .types import AnalysisResult
+
+# Re-run the full analysis once the ideas added since the last one are this fraction of it
+REANALYSIS_RATIO = 0.25
+
+# New ideas are placed at the similarity-weighted mean of this many of their most similar ideas
+PLACEMENT_NEIGHBOURS = 5
+
+
+def can_append(analysis: AnalysisResult) -> bool:
+    return analysis.vectors is not None and analysis.vocabulary is not None and analysis.centroid is not None
+
+
+def needs_reanalysis(analyzed: int, appended: int) -> bool:
+    """Whether `appended` ideas added since a full analysis of `analyzed` ideas warrant a new one"""
+    return appended >= REANALYSIS_RATIO * analyzed
+
+
+def idea_features(ideas: List[str], vocabulary: np.ndarray) -> np.ndarray:
+    """The (not normalized) idea vectors of new ideas, in the feature space of an existing analysis"""
+    analyzer = Analyzer(ideas, CountVectorizer(vocabulary=vocabulary.tolist()))
+    analyzer.preprocess_ideas()
+    counts = analyzer.vectorizer.transform(analyzer.processed_ideas).toarray()
+    embedded = analyzer.embedd_ideas()
+    return counts if embedded is None else np.concatenate((counts, embedded), axis=1)
+
+
+def _place(similarity: np.ndarray, points: np.ndarray) -> np.ndarray:
+    """Positions for new ideas: the mean of their most similar ideas' points, weighted by similarity"""
+    k = min(PLACEMENT_NEIGHBOURS, similarity.shape[1])
+    neighbours = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+    weights = np.clip(np.take_along_axis(similarity, neighbours, axis=1), 0, None) + 1e-9
+    return (weights[:, :, None] * points[neighbours]).sum(axis=1) / weights.sum(axis=1)[:, None]
+
+
+def append_ideas(analysis: AnalysisResult, ideas: List[str]) -> AnalysisResult:
+    """The analysis with `ideas` added (after the existing ideas in input order)"""
+    if not can_append(analysis):
+        raise ValueError("The analysis doesn't have what's needed to add ideas to it")
+    n, m = len(analysis), len(ideas)
+    features = idea_features(ideas, analysis.vocabulary)
+
+    centroid = (analysis.centroid * n + features.sum(axis=0)) / (n + m)
+    unit_centroid = normalize_rows(centroid[np.newaxis, :])[0]
+    old_vectors = analysis.vectors[:n]  # ranked order
+    new_vectors = normalize_rows(features)
+
+    # The only pairwise similarities that are computed: new ideas to existing ones, (m, n)
+    new_to_old = new_vectors @ old_vectors.T
+
+    # Assign each new idea to the cluster with the highest mean similarity
+    labels = analysis.cluster_labels
+    clusters = int(labels.max()) + 1
+    members = np.zeros((n, clusters))
+    members[np.arange(n), labels] = 1
+    mean_similarity = (new_to_old @ members) / np.maximum(members.sum(axis=0), 1)
+    new_labels = np.argmax(mean_similarity, axis=1)
+
+    # Existing ideas first (in their old ranked order), then the new ones; re-ranked below
+    vectors = np.concatenate((old_vectors, new_vectors))
+    similarity = vectors @ unit_centroid
+    ranking = np.argsort(-similarity, kind="stable")
+
+    input_index = np.concatenate((analysis.order, np.arange(n, n + m)))
+    coords = np.concatenate((analysis.coords[:n], _place(new_to_old, analysis.coords[:n])))
+    cluster_points = None
+    if analysis.cluster_points is not None:
+        cluster_points = np.concatenate((analysis.cluster_points, _place(new_to_old, analysis.cluster_points)))[ranking]
+
+    similarity = np.append(similarity[ranking], 1.0)  # the centroid's similarity to itself
+    return AnalysisResult(
+        ideas=list(analysis.ideas) + list(ideas),
+        order=input_index[ranking],
+        similarity=similarity,
+        distance=1 - similarity,
+        coords=np.concatenate((coords[ranking], analysis.coords[n:])),
+        pairwise_similarity=None,
+        vectors=np.concatenate((vectors[ranking], unit_centroid[np.newaxis, :])),
+        cluster_labels=np.concatenate((labels, new_labels))[ranking],
+        cluster_points=cluster_points,
+        cluster_centers=analysis.cluster_centers,
+        vocabulary=analysis.vocabulary,
+        centroid=centroid,
+    )
@@ -0,0 +1,243 @@
+"""
+A persistent job queue for analyses that take longer than an HTTP request may (e.g. the proxy's
+timeout), backed by a SQLite file.
+
+Jobs are submitted with an opaque payload and run by a few runner tasks in the server process,
+which hand the CPU-bound work on to the analysis worker processes. A job goes
+queued -> running -> succeeded | failed; its result (or error) is kept until `expires_at`.
+
+On shutdown, the runners stop taking new jobs and wait a while for the running ones; anything
+still running after that is put back in the queue, so it's picked up again after a restart
+(when the database is on persistent storage). Since a job may run more than once, it's charged
+for separately, once, after it succeeded (see `charge`).
+"""
+import asyncio
+import sqlite3
+import time
+import uuid
+from contextlib import closing
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List, Optional
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    payload BLOB,
+    result BLOB,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    expires_at REAL,
+    charged INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, created_at);
+"""
+
+_COLUMNS = "id, user_id, status, result, error, created_at, started_at, finished_at, expires_at"
+
+
+@dataclass
+class Job:
+    id: str
+    user_id: str
+    status: str
+    result: Optional[bytes] = None  # as returned by the handler, e.g. serialized JSON
+    error: Optional[str] = None
+    created_at: float = 0.0
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    expires_at: Optional[float] = None
+
+
+# (user id, payload) -> result
+JobHandler = Callable[[str, bytes], Awaitable[bytes]]
+# (user id, payload); deducts the credits for a job
+JobCharge = Callable[[str, bytes], Awaitable[None]]
+
+
+class JobQueue:
+    def __init__(
+        self,
+        path: str,
+        handler: JobHandler,
+        charge: Optional[JobCharge] = None,
+        concurrency: int = 1,
+        ttl: float = 86400,
+        poll_interval: float = 1.0,
+    ):
+        self.path = path
+        self.handler = handler
+        self.charge = charge
+        self.concurrency = max(concurrency, 1)
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self._runners: List[asyncio.Task] = []
+        self._running_jobs = set()
+        self._stopping = False
+        self._wakeup: Optional[asyncio.Event] = None
+        self._initialized = False
+
+    # Storage. SQLite calls are blocking, so the async methods run them in the threadpool with
+    # a connection each; WAL mode lets the readers (status polls) run alongside the writers.
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        if not self._initialized:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+            if "charged" not in [column[1] for column in db.execute("PRAGMA table_info(jobs)")]:
+                # Databases from before jobs were charged separately
+                db.execute("ALTER TABLE jobs ADD COLUMN charged INTEGER NOT NULL DEFAULT 0")
+            self._initialized = True
+        return db
+
+    def _execute(self, query: str, parameters=()) -> List[tuple]:
+        with closing(self._connect()) as db:
+            return db.execute(query, parameters).fetchall()
+
+    async def submit(self, user_id: str, payload: bytes) -> Job:
+        job = Job(id=uuid.uuid4().hex, user_id=user_id, status=QUEUED, created_at=time.time())
+        await run_in_threadpool(
+            self._execute,
+            "INSERT INTO jobs (id, user_id, status, payload, created_at) VALUES (?, ?, ?, ?, ?)",
+            (job.id, user_id, QUEUED, payload, job.created_at),
+        )
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job
+
+    async def get(self, job_id: str, user_id: Optional[str]) -> Optional[Job]:
+        """The job, if it belongs to the user (any user for None) and hasn't expired"""
+        rows = await run_in_threadpool(
+            self._execute,
+            f"SELECT {_COLUMNS} FROM jobs WHERE id = ? AND (? IS NULL OR user_id = ?) AND (expires_at IS NULL OR expires_at > ?)",
+            (job_id, user_id, user_id, time.time()),
+        )
+        return Job(*rows[0]) if rows else None
+
+    def _claim(self) -> Optional[tuple]:
+        """Atomically marks the oldest queued job as running; returns (id, user_id, payload, charged)"""
+        rows = self._execute(
+            """
+            UPDATE jobs SET status = ?, started_at = ?
+            WHERE id = (SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1)
+            RETURNING id, user_id, payload, charged
+            """,
+            (RUNNING, time.time(), QUEUED),
+        )
+        return rows[0] if rows else None
+
+    def _mark_charged(self, job_id: str):
+        self._execute("UPDATE jobs SET charged = 1 WHERE id = ?", (job_id,))
+
+    def _finish(self, job_id: str, status: str, result: Optional[bytes] = None, error: Optional[str] = None):
+        now = time.time()
+        # The payload isn't needed anymore
+        self._execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, payload = NULL, finished_at = ?, expires_at = ? WHERE id = ?",
+            (status, result, error, now, now + self.ttl, job_id),
+        )
+
+    def _requeue(self, job_ids=None):
+        """Puts running jobs (all of them, or the given ones) back in the queue"""
+        if job_ids is None:
+            self._execute("UPDATE jobs SET status = ?, started_at = NULL WHERE status = ?", (QUEUED, RUNNING))
+        else:
+            for job_id in job_ids:
+                self._execute("UPDATE jobs SET status = ?, started_at = NULL WHERE id = ? AND status = ?", (QUEUED, job_id, RUNNING))
+
+    def _delete_expired(self) -> int:
+        with closing(self._connect()) as db:
+            return db.execute("DELETE FROM jobs WHERE expires_at <= ?", (time.time(),)).rowcount
+
+    # Runners
+
+    async def start(self):
+        """
+        Starts the runners. Jobs left running by a previous process (which was stopped before it
+        could put them back) are queued again.
+        """
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        await run_in_threadpool(self._requeue)
+        self._runners = [asyncio.create_task(self._run()) for _ in range(self.concurrency)]
+
+    async def drain(self, timeout: float):
+        """Stops taking jobs, waits up to `timeout` seconds for the running ones, and requeues the rest"""
+        self._stopping = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+        if not self._runners:
+            return
+        _, pending = await asyncio.wait(self._runners, timeout=timeout)
+        unfinished = list(self._running_jobs)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        if unfinished:
+            print(f"Requeueing {len(unfinished)} unfinished jobs")
+            await run_in_threadpool(self._requeue, unfinished)
+        self._runners = []
+
+    async def _finish_safely(self, job_id: str, status: str, result: Optional[bytes] = None, error: Optional[str] = None):
+        """_finish, but a failing database only loses this job (it's requeued on the next start), not the runner"""
+        try:
+            await run_in_threadpool(self._finish, job_id, status, result, error)
+        except Exception as e:
+            print(f"Finishing job {job_id} failed: {e}")
+
+    async def _run(self):
+        last_cleanup = 0.0
+        while not self._stopping:
+            if time.monotonic() - last_cleanup > 60:
+                last_cleanup = time.monotonic()
+                await run_in_threadpool(self._delete_expired)
+
+            claimed = await run_in_threadpool(self._claim)
+            if claimed is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            job_id, user_id, payload, charged = claimed
+            self._running_jobs.add(job_id)
+            try:
+                result = await self.handler(user_id, payload)
+            except asyncio.CancelledError:
+                # Drained: the job stays running here and gets requeued by drain()
+                raise
+            except HTTPException as e:
+                await self._finish_safely(job_id, FAILED, None, str(e.detail))
+            except Exception as e:
+                print(f"Job {job_id} failed: {e}")
+                await self._finish_safely(job_id, FAILED, None, "The analysis failed.")
+            else:
+                try:
+                    if self.charge is not None and not charged:
+                        # Marked first: if the job is interrupted in between (and runs again), it's
+                        # charged at most once rather than twice
+                        await run_in_threadpool(self._mark_charged, job_id)
+                        await self.charge(user_id, payload)
+                except Exception as e:
+                    # The result isn't released without the charge
+                    print(f"Charging job {job_id} failed: {e}")
+                    detail = e.detail if isinstance(e, HTTPException) else "Charging credits for the job failed."
+                    await self._finish_safely(job_id, FAILED, None, str(detail))
+                else:
+                    await self._finish_safely(job_id, SUCCEEDED, result)
+            finally:
+                self._running_jobs.discard(job_id)
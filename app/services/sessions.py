@@ -0,0 +1,148 @@
+"""
+Analysis sessions: an analysis stored under an id for a while, so its views (ranking, clusters,
+graph, similarity rows) can be requested as often as needed without uploading and analyzing the
+ideas again.
+
+Sessions are kept in memory, bounded by SESSION_MAX_BYTES: when a new session doesn't fit, the
+ones that expire soonest go first. They don't survive a restart; recreating one is cheap while
+its analysis is still in the result cache.
+"""
+import asyncio
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from .types import AnalysisResult
+
+
+@dataclass
+class Session:
+    id: str
+    user_id: str
+    key: str  # content hash of the analysis (see app/services/cache.py)
+    analysis: AnalysisResult
+    ids: List[Optional[int | str]]  # of the ideas, in input order like analysis.ideas
+    author_ids: List[Optional[int | str]]
+    total_bytes: int
+    created_at: float
+    expires_at: float
+    size: int = 0  # approximate memory use in bytes
+    # kmeans data (arrays) for other k's than the analysis' own, once requested
+    clusterings: Dict[int, dict] = field(default_factory=dict)
+    # Incremented whenever ideas are added
+    version: int = 0
+    # Ideas in the last full analysis, and added incrementally since (see incremental.py)
+    analyzed: int = 0
+    appended: int = 0
+    # Held while ideas are added, so additions are applied one after the other
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+    def __len__(self) -> int:
+        return len(self.analysis)
+
+
+def _size(analysis: AnalysisResult, total_bytes: int) -> int:
+    """Approximate memory use of a session"""
+    return sum(array.nbytes for array in analysis.arrays().values()) + total_bytes + 100 * len(analysis)
+
+
+class SessionStore:
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._sessions: Dict[str, Session] = {}
+        self._bytes = 0
+
+    def _remove(self, session_id: str):
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._bytes -= session.size
+
+    def _expire(self):
+        now = time.time()
+        for session_id in [id for id, session in self._sessions.items() if session.expires_at <= now]:
+            self._remove(session_id)
+
+    def create(
+        self,
+        user_id: str,
+        key: str,
+        analysis: AnalysisResult,
+        ids: List[Optional[int | str]],
+        author_ids: List[Optional[int | str]],
+        total_bytes: int,
+    ) -> Session:
+        """Stores an analysis. Raises ValueError if it's larger than the whole store."""
+        now = time.time()
+        session = Session(
+            id=uuid.uuid4().hex,
+            user_id=user_id,
+            key=key,
+            analysis=analysis,
+            ids=ids,
+            author_ids=author_ids,
+            total_bytes=total_bytes,
+            created_at=now,
+            expires_at=now + self.ttl,
+        )
+        session.analyzed = len(analysis)
+        size = session.size = _size(analysis, total_bytes)
+        if size > self.max_bytes:
+            raise ValueError(f"The analysis needs {size} bytes; sessions are limited to {self.max_bytes}")
+
+        self._expire()
+        while self._bytes + size > self.max_bytes:
+            self._remove(min(self._sessions.values(), key=lambda stored: stored.expires_at).id)
+        self._sessions[session.id] = session
+        self._bytes += size
+        return session
+
+    def update(
+        self,
+        session: Session,
+        analysis: AnalysisResult,
+        ids: List[Optional[int | str]],
+        author_ids: List[Optional[int | str]],
+        total_bytes: int,
+        key: Optional[str] = None,
+    ):
+        """
+        Replaces a session's analysis with one that has ideas added: incrementally, or, with the
+        new content hash as `key`, by a full analysis.
+        """
+        size = _size(analysis, total_bytes)
+        if size > self.max_bytes:
+            raise ValueError(f"The analysis needs {size} bytes; sessions are limited to {self.max_bytes}")
+        added = len(analysis) - len(session.analysis)
+        if key is None:
+            session.appended += added
+        else:
+            session.key, session.analyzed, session.appended = key, len(analysis), 0
+        session.analysis = analysis
+        session.ids, session.author_ids, session.total_bytes = ids, author_ids, total_bytes
+        session.clusterings = {}
+        session.version += 1
+
+        if session.id in self._sessions:
+            self._bytes += size - session.size
+        session.size = size
+        while self._bytes > self.max_bytes and len(self._sessions) > 1:
+            others = [stored for stored in self._sessions.values() if stored is not session]
+            self._remove(min(others, key=lambda stored: stored.expires_at).id)
+
+    def get(self, session_id: str, user_id: Optional[str]) -> Optional[Session]:
+        """The session, if it belongs to the user (any user for None) and hasn't expired"""
+        session = self._sessions.get(session_id)
+        if session is None or (user_id is not None and session.user_id != user_id):
+            return None
+        if session.expires_at <= time.time():
+            self._remove(session_id)
+            return None
+        return session
+
+    def delete(self, session_id: str, user_id: Optional[str]) -> bool:
+        if self.get(session_id, user_id) is None:
+            return False
+        self._remove(session_id)
+        return True
@@ -0,0 +1,240 @@
+import base64
+from typing import Callable, Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+
+# Rows of the similarity matrix that are processed at once. Bounds the temporary memory of the
+# partial selection to DEFAULT_TILE_ROWS x n values, regardless of how many ideas there are.
+DEFAULT_TILE_ROWS = 512
+
+SimilarityTile = Tuple[int, np.ndarray]  # (first row index, rows x n block of similarities)
+
+
+def dense_tiles(matrix: np.ndarray, n: int, tile_rows: int = DEFAULT_TILE_ROWS) -> Iterator[SimilarityTile]:
+    """Yields row blocks of the top-left n x n part of an already computed similarity matrix"""
+    for start in range(0, n, tile_rows):
+        yield start, matrix[start:min(start + tile_rows, n), :n]
+
+
+def vector_tiles(vectors: np.ndarray, n: int, tile_rows: int = DEFAULT_TILE_ROWS) -> Iterator[SimilarityTile]:
+    """
+    Yields row blocks of the n x n cosine similarities of L2-normalized vectors, computing one
+    block at a time so the dense matrix is never materialized.
+    """
+    columns = vectors[:n].T
+    for start in range(0, n, tile_rows):
+        yield start, vectors[start:min(start + tile_rows, n)] @ columns
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalizes rows; all-zero rows stay zero (like sklearn's cosine_similarity)"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+Edges = Tuple[np.ndarray, np.ndarray, np.ndarray]  # (sources, targets, weights)
+
+
+def sparse_edges(
+    tiles: Iterable[SimilarityTile],
+    n: int,
+    top_k: Optional[int] = None,
+    min_similarity: Optional[float] = None,
+) -> Edges:
+    """
+    Selects the edges of the similarity graph between n items, one tile of rows at a time.
+
+    * top_k: keep each item's k most similar neighbours (argpartition per row, so O(n·k) output).
+      An edge is kept if either of its two ends selected it.
+    * min_similarity: drop edges below this similarity.
+    * neither: every unordered pair (i < j), i.e. the full graph.
+
+    Returns:
+        (sources, targets, weights) arrays with sources < targets, sorted by (source, target)
+    """
+    chunks = list(iter_sparse_edges(tiles, n, top_k, min_similarity))
+    if not chunks:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float64)
+    if len(chunks) == 1:
+        return chunks[0]
+    sources, targets, weights = (np.concatenate(arrays) for arrays in zip(*chunks))
+    return sources.astype(np.intp, copy=False), targets.astype(np.intp, copy=False), weights
+
+
+def iter_sparse_edges(
+    tiles: Iterable[SimilarityTile],
+    n: int,
+    top_k: Optional[int] = None,
+    min_similarity: Optional[float] = None,
+) -> Iterator[Edges]:
+    """
+    The edges of sparse_edges, in (source, target) order, as chunks of arrays. Without top_k, each
+    chunk is computed from one tile, so only one tile's edges are in memory at a time (even for
+    the full graph). top_k needs every row's selection before de-duplicating, and yields one chunk.
+    """
+    if top_k is not None:
+        edges = _top_k_edges(tiles, n, top_k, min_similarity)
+        if len(edges[0]):
+            yield edges
+        return
+
+    for start, tile in tiles:
+        rows = np.arange(start, start + tile.shape[0])
+        # Upper triangle only, so each pair shows up once
+        mask = np.arange(tile.shape[1])[None, :] > rows[:, None]
+        if min_similarity is not None:
+            mask &= tile >= min_similarity
+        row_index, targets = np.nonzero(mask)
+        if len(targets):
+            yield (
+                rows[row_index].astype(np.intp, copy=False),
+                targets.astype(np.intp, copy=False),
+                np.asarray(tile[row_index, targets], dtype=np.float64),
+            )
+
+
+def _top_k_edges(tiles: Iterable[SimilarityTile], n: int, top_k: int, min_similarity: Optional[float]) -> Edges:
+    sources, targets, weights = [], [], []
+    k = min(top_k, n - 1)
+
+    if k > 0:
+        for start, tile in tiles:
+            rows = np.arange(start, start + tile.shape[0])
+            # Never select an item as its own neighbour
+            tile = np.array(tile, dtype=np.float64)
+            tile[np.arange(tile.shape[0]), rows] = -np.inf
+            neighbours = np.argpartition(-tile, k - 1, axis=1)[:, :k]
+            tile_weights = np.take_along_axis(tile, neighbours, axis=1).ravel()
+            tile_sources = np.repeat(rows, k)
+            tile_targets = neighbours.ravel()
+
+            if min_similarity is not None:
+                keep = tile_weights >= min_similarity
+                tile_sources, tile_targets, tile_weights = tile_sources[keep], tile_targets[keep], tile_weights[keep]
+
+            sources.append(tile_sources)
+            targets.append(tile_targets)
+            weights.append(tile_weights)
+
+    if not sources:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float64)
+
+    sources = np.concatenate(sources).astype(np.intp, copy=False)
+    targets = np.concatenate(targets).astype(np.intp, copy=False)
+    weights = np.concatenate(weights)
+
+    # i->j and j->i are the same undirected edge: canonicalize and de-duplicate
+    low, high = np.minimum(sources, targets), np.maximum(sources, targets)
+    _, first = np.unique(low * n + high, return_index=True)
+    return low[first], high[first], weights[first]
+
+
+def top_k_neighbours(tiles: Iterable[SimilarityTile], n: int, k: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Each item's k most similar other items, as CSR-style arrays: the neighbours of row i are
+    indices[indptr[i]:indptr[i + 1]] with similarities scores[indptr[i]:indptr[i + 1]],
+    most similar first.
+    """
+    k = max(min(k, n - 1), 0)
+    indices = np.empty(n * k, dtype=np.intp)
+    scores = np.empty(n * k, dtype=np.float64)
+    if k > 0:
+        for start, tile in tiles:
+            rows = tile.shape[0]
+            tile = np.array(tile, dtype=np.float64)
+            tile[np.arange(rows), np.arange(start, start + rows)] = -np.inf
+            neighbours = np.argpartition(-tile, k - 1, axis=1)[:, :k]
+            neighbour_scores = np.take_along_axis(tile, neighbours, axis=1)
+            # argpartition doesn't order the k selected; sort just those
+            ranking = np.argsort(-neighbour_scores, axis=1, kind="stable")
+            indices[start * k:(start + rows) * k] = np.take_along_axis(neighbours, ranking, axis=1).ravel()
+            scores[start * k:(start + rows) * k] = np.take_along_axis(neighbour_scores, ranking, axis=1).ravel()
+    indptr = np.arange(0, n * k + 1, k, dtype=np.intp) if k > 0 else np.zeros(n + 1, dtype=np.intp)
+    return indptr, indices, scores
+
+
+# Encodings for returning (parts of) the similarity matrix compactly. Binary encodings are
+# little-endian and base64-packed; uint8 is linearly quantized: value ≈ offset + byte * scale
+MATRIX_DTYPES = {
+    "json": np.float64,
+    "float32": np.dtype("<f4"),
+    "float16": np.dtype("<f2"),
+    "uint8": np.dtype("u1"),
+}
+
+
+def _converter(encoding: str, low: float, high: float) -> Tuple[Callable[[np.ndarray], np.ndarray], Optional[float], Optional[float]]:
+    """Returns (values -> encoded values, offset, scale) for an encoding and the value range"""
+    if encoding != "uint8":
+        return (lambda values: values), None, None
+    scale = (high - low) / 255 if high > low else 1.0
+    return (lambda values: np.rint((values - low) / scale)), low, scale
+
+
+def upper_triangle(matrix: np.ndarray, dtype=np.float64, convert: Callable[[np.ndarray], np.ndarray] = lambda values: values) -> np.ndarray:
+    """
+    Flattens the upper triangle (including the diagonal) row by row, i.e. in the order of
+    np.triu_indices(n). Works one row at a time, so only the output array is allocated
+    (instead of n²/2 index arrays plus temporaries).
+    """
+    n = matrix.shape[0]
+    values = np.empty(n * (n + 1) // 2, dtype=dtype)
+    position = 0
+    for i in range(n):
+        row = convert(matrix[i, i:])
+        values[position:position + len(row)] = row
+        position += len(row)
+    return values
+
+
+def pack_values(values: np.ndarray, encoding: str, offset: Optional[float] = None, scale: Optional[float] = None) -> dict:
+    """
+    Packs already encoded values for a response: 'json' keeps them as an array (serialized as
+    JSON numbers), the binary encodings are base64 of the little-endian values.
+    """
+    if encoding == "json":
+        return {"encoding": "json", "data": values}
+    return {
+        "encoding": encoding,
+        "dtype": MATRIX_DTYPES[encoding].str,
+        "offset": offset,
+        "scale": scale,
+        "data": base64.b64encode(values.tobytes()).decode("ascii"),
+    }
+
+
+def encode_similarity_matrix(matrix: np.ndarray, format: str, encoding: str) -> dict:
+    """
+    Encodes a square similarity matrix as either the full matrix ('dense', row-major) or just its
+    upper triangle including the diagonal ('upper_triangle'), in one of MATRIX_DTYPES' encodings.
+    """
+    n = matrix.shape[0]
+    low, high = (float(matrix.min()), float(matrix.max())) if matrix.size else (0.0, 0.0)
+    convert, offset, scale = _converter(encoding, low, high)
+    dtype = MATRIX_DTYPES[encoding]
+
+    if format == "upper_triangle":
+        values = upper_triangle(matrix, dtype, convert)
+    else:
+        values = np.empty(n * n, dtype=dtype)
+        for i in range(n):
+            values[i * n:(i + 1) * n] = convert(matrix[i])
+
+    return {"format": format, "shape": [n, n], **pack_values(values, encoding, offset, scale)}
+
+
+def encode_top_k(tiles: Iterable[SimilarityTile], n: int, k: int, encoding: str) -> dict:
+    """Encodes each item's k nearest neighbours CSR-style, the scores in one of MATRIX_DTYPES' encodings"""
+    indptr, indices, scores = top_k_neighbours(tiles, n, k)
+    low, high = (float(scores.min()), float(scores.max())) if scores.size else (0.0, 0.0)
+    convert, offset, scale = _converter(encoding, low, high)
+    values = convert(scores).astype(MATRIX_DTYPES[encoding])
+    return {
+        "format": "topk",
+        "shape": [n, n],
+        "k": int(indptr[1] - indptr[0]) if n else 0,
+        "indices": indices,
+        "indptr": indptr,
+        **pack_values(values, encoding, offset, scale),
+    }
@@ -1,25 +1,149 @@
-from typing import List, Optional, TypedDict, Tuple
+from typing import Dict, Iterator, List, Optional, TypedDict
 
+import numpy as np
 from pydantic import BaseModel
 
+from .similarity import DEFAULT_TILE_ROWS, SimilarityTile, dense_tiles, vector_tiles
+
 class KMeansData(TypedDict):
     data: List[List[float]]
     centers: List[List[float]]
     cluster: List[int]
 
-class PlotData(TypedDict):
-    scatter_points: List[List[float]]
-    marker_sizes: List[float]
-    ideas: List[str]
-    pairwise_similarity: List[List[float]]
-    kmeans_data: KMeansData
+class AnalysisResult:
+    """
+    Array-backed result of a centroid analysis.
+    
+    All per-idea arrays are in *ranked* order (closest to the centroid first), and the
+    arrays that include the centroid carry it as their last row. `order` maps a ranked
+    position back to the index of the idea in the original input.
+    
+    Everything stays a numpy array until it is actually emitted; use the `*_list()`
+    helpers (or `.tolist()`) only for the fields that end up in a response.
+    
+    The pairwise similarity matrix is only materialized when it's accessed. Code that just
+    needs parts of it (e.g. nearest neighbours) should use `similarity_tiles()`, which computes
+    row blocks from the normalized idea vectors.
+    """
+    __slots__ = (
+        "ideas",
+        "order",
+        "similarity",
+        "distance",
+        "coords",
+        "vectors",
+        "_pairwise_similarity",
+        "cluster_labels",
+        "cluster_points",
+        "cluster_centers",
+        "vocabulary",
+        "centroid",
+    )
+
+    def __init__(
+        self,
+        ideas: List[str],
+        order: np.ndarray,
+        similarity: np.ndarray,
+        distance: np.ndarray,
+        coords: np.ndarray,
+        pairwise_similarity: Optional[np.ndarray],
+        cluster_labels: np.ndarray,
+        cluster_points: Optional[np.ndarray] = None,
+        cluster_centers: Optional[np.ndarray] = None,
+        vectors: Optional[np.ndarray] = None,
+        vocabulary: Optional[np.ndarray] = None,
+        centroid: Optional[np.ndarray] = None,
+    ):
+        if pairwise_similarity is None and vectors is None:
+            raise ValueError("Either the pairwise similarity matrix or the idea vectors are required")
+
+        self.ideas = ideas                                              # input order, unmodified
+        self.order = np.asarray(order, dtype=np.intp)                   # (n,) ranked position -> input index
+        self.similarity = np.asarray(similarity, dtype=np.float64)      # (n+1,) similarity to centroid
+        self.distance = np.asarray(distance, dtype=np.float64)          # (n+1,) 1 - similarity
+        # (contiguous, so they can be serialized straight from the buffer)
+        self.coords = np.ascontiguousarray(coords, dtype=np.float64)    # (n+1, 2) MDS scatter points
+        self._pairwise_similarity = None if pairwise_similarity is None else np.ascontiguousarray(pairwise_similarity, dtype=np.float64)  # (n+1, n+1)
+        self.vectors = None if vectors is None else np.asarray(vectors, dtype=np.float64)  # (n+1, d) L2-normalized idea vectors
+        self.cluster_labels = np.asarray(cluster_labels, dtype=np.intp)  # (n,)
+        self.cluster_points = None if cluster_points is None else np.asarray(cluster_points, dtype=np.float64)     # (n, 2) PCA-reduced kmeans input
+        self.cluster_centers = None if cluster_centers is None else np.asarray(cluster_centers, dtype=np.float64)  # (k, 2) PCA-reduced cluster centers
+        # For adding ideas to the analysis (see incremental.py):
+        self.vocabulary = None if vocabulary is None else np.asarray(vocabulary, dtype=str)  # (v,) terms of the count vector columns
+        self.centroid = None if centroid is None else np.asarray(centroid, dtype=np.float64)  # (d,) mean idea vector, not normalized
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    # The arrays that make up a result, e.g. for caching; the ideas and the pairwise matrix (unless
+    # there are no vectors to compute it from) aren't part of it
+    ARRAYS = (
+        "order", "similarity", "distance", "coords", "vectors",
+        "cluster_labels", "cluster_points", "cluster_centers", "vocabulary", "centroid",
+    )
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        arrays = {name: getattr(self, name) for name in self.ARRAYS if getattr(self, name) is not None}
+        if self.vectors is None:
+            arrays["pairwise_similarity"] = self._pairwise_similarity
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, ideas: List[str], arrays: Dict[str, np.ndarray]) -> "AnalysisResult":
+        return cls(ideas=ideas, pairwise_similarity=arrays.get("pairwise_similarity"), **{name: arrays.get(name) for name in cls.ARRAYS})
+
+    def with_ideas(self, ideas: List[str]) -> "AnalysisResult":
+        """The same analysis for another list of (equivalent) ideas, sharing the arrays"""
+        return self.from_arrays(ideas, self.arrays())
+
+    @property
+    def ranked_ideas(self) -> List[str]:
+        """The idea texts in ranked order"""
+        return [self.ideas[i] for i in self.order]
+
+    @property
+    def pairwise_similarity(self) -> np.ndarray:
+        """(n+1, n+1) cosine similarities, computed from the idea vectors on first access"""
+        if self._pairwise_similarity is None:
+            self._pairwise_similarity = self.vectors @ self.vectors.T
+        return self._pairwise_similarity
+
+    def similarity_tiles(self, tile_rows: int = DEFAULT_TILE_ROWS) -> Iterator[SimilarityTile]:
+        """Row blocks of the idea-to-idea similarities (without the centroid)"""
+        if self._pairwise_similarity is None:
+            return vector_tiles(self.vectors, len(self), tile_rows)
+        return dense_tiles(self._pairwise_similarity, len(self), tile_rows)
+
+    def pairwise_similarity_tiles(self, tile_rows: int = DEFAULT_TILE_ROWS) -> Iterator[SimilarityTile]:
+        """Row blocks of the full (n+1, n+1) pairwise similarity matrix, without materializing it"""
+        if self._pairwise_similarity is None:
+            return vector_tiles(self.vectors, len(self) + 1, tile_rows)
+        return dense_tiles(self._pairwise_similarity, len(self) + 1, tile_rows)
+
+    def similarity_rows(self, start: int, stop: int) -> np.ndarray:
+        """Rows start:stop of the (n+1, n+1) pairwise similarity matrix"""
+        if self._pairwise_similarity is None:
+            return self.vectors[start:stop] @ self.vectors.T
+        return self._pairwise_similarity[start:stop]
+
+    def similarity_list(self) -> List[float]:
+        return self.similarity.tolist()
+
+    def scatter_points_list(self) -> List[List[float]]:
+        return self.coords.tolist()
+
+    def pairwise_similarity_list(self) -> List[List[float]]:
+        return self.pairwise_similarity.tolist()
 
-class Results(TypedDict):
-    ideas: List[str]
-    similarity: List[float]
-    distance: List[float]
+    def kmeans_data(self) -> KMeansData:
+        return KMeansData(
+            data=self.cluster_points.tolist() if self.cluster_points is not None else [],
+            centers=self.cluster_centers.tolist() if self.cluster_centers is not None else [],
+            cluster=self.cluster_labels.tolist(),
+        )
 
-CentroidAnalysisResult = Tuple[Results, PlotData]
+CentroidAnalysisResult = AnalysisResult
 
 class ClusterName(BaseModel):
     id: int
@@ -30,4 +154,4 @@ class RankedIdea(BaseModel):
     author_id: Optional[int | str] = None
     idea: str
     similarity_score: float
-    cluster_id: int
\ No newline at end of file
+    cluster_id: int 
@@ -0,0 +1,101 @@
+"""
+Benchmark: serializing a /rank_ideas response.
+
+Compares the previous path (validated RankedIdea models + nested-list matrix, re-validated
+into an AnalysisResponse and then encoded by FastAPI) against the fast path
+(model_construct + orjson writing numpy arrays directly).
+
+Usage:
+    python benchmarks/serialization.py [--sizes 1000 5000 10000] [--repeat 3] [--legacy-matrix-limit 5000]
+
+The legacy path with the matrix needs several GB of RAM at 10k ideas, so it is skipped above
+--legacy-matrix-limit ideas.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import numpy as np
+from fastapi.encoders import jsonable_encoder
+
+from app.api.v1.models.response import AnalysisResponse
+from app.core.serialization import dumps
+from app.services.types import RankedIdea
+
+
+def make_payload(n: int, with_matrix: bool, fast: bool) -> dict:
+    rng = np.random.default_rng(42)
+    similarity = np.sort(rng.random(n))[::-1]
+    clusters = rng.integers(0, 8, n)
+    model = RankedIdea.model_construct if fast else RankedIdea
+    ranked_ideas = [
+        model(
+            id=str(i),
+            author_id=f"author_{i % 50}",
+            idea=f"Idea number {i} about improving the customer support experience",
+            similarity_score=float(similarity[i]),
+            cluster_id=int(clusters[i]),
+        )
+        for i in range(n)
+    ]
+    matrix = None
+    if with_matrix:
+        vectors = rng.random((n + 1, 32))
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        matrix = vectors @ vectors.T
+        if not fast:
+            matrix = matrix.tolist()
+    return {
+        "ranked_ideas": ranked_ideas,
+        "relationship_graph": None,
+        "pairwise_similarity_matrix": matrix,
+        "cluster_names": None,
+    }
+
+
+def legacy_serialize(payload: dict) -> bytes:
+    response = AnalysisResponse(**payload)
+    return json.dumps(jsonable_encoder(response)).encode("utf-8")
+
+
+def fast_serialize(payload: dict) -> bytes:
+    return dumps(payload)
+
+
+def timed(fn, payload, repeat: int):
+    best = float("inf")
+    size = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = fn(payload)
+        best = min(best, time.perf_counter() - start)
+        size = len(body)
+    return best, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 10000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--legacy-matrix-limit", type=int, default=5000)
+    args = parser.parse_args()
+
+    print(f"{'ideas':>6} {'matrix':>6} {'legacy (s)':>11} {'fast (s)':>9} {'speedup':>8} {'body (MB)':>10}")
+    for n in args.sizes:
+        for with_matrix in (False, True):
+            fast_time, size = timed(fast_serialize, make_payload(n, with_matrix, fast=True), args.repeat)
+            if with_matrix and n > args.legacy_matrix_limit:
+                legacy = "skipped"
+                speedup = "-"
+            else:
+                legacy_time, _ = timed(legacy_serialize, make_payload(n, with_matrix, fast=False), args.repeat)
+                legacy = f"{legacy_time:.3f}"
+                speedup = f"{legacy_time / fast_time:.1f}x"
+            print(f"{n:>6} {str(with_matrix):>6} {legacy:>11} {fast_time:>9.3f} {speedup:>8} {size / 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
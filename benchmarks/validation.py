@@ -0,0 +1,80 @@
+"""
+Benchmark: per-idea validation cost of an IdeaRequest.
+
+Compares validating into pydantic models (one IdeaInput per idea, as FastAPI does for the
+IdeaRequest body) against the compiled TypedDict validators in app/api/v1/validation.py, for
+both decoded data (MessagePack / CBOR / the incremental JSON parser) and raw JSON bytes, and
+the complete ingestion of a JSON body.
+
+Usage:
+    python benchmarks/validation.py [--sizes 1000 10000] [--repeat 5]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import List
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from pydantic import TypeAdapter
+from starlette.requests import Request
+
+from app.api.v1 import ingest, validation
+from app.api.v1.models.request import IdeaInput, IdeaRequest
+
+
+def make_ideas(n: int) -> list:
+    return [
+        {"id": i, "author_id": f"author_{i % 50}", "idea": f"Idea number {i} about improving the customer support experience"}
+        for i in range(n)
+    ]
+
+
+def body_request(body: bytes, chunk_size: int = 64 * 1024) -> Request:
+    chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+    position = 0
+
+    async def receive():
+        nonlocal position
+        position += 1
+        return {"type": "http.request", "body": chunks[position - 1], "more_body": position < len(chunks)}
+    return Request({"type": "http", "method": "POST", "path": "/", "headers": [(b"content-type", b"application/json")]}, receive)
+
+
+def timed(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    models = TypeAdapter(List[IdeaInput])
+    print(f"{'ideas':>6} {'case':<44} {'total (ms)':>10} {'per idea (ns)':>14}")
+    for n in args.sizes:
+        ideas = make_ideas(n)
+        body = json.dumps({"ideas": ideas}).encode("utf-8")
+        cases = [
+            ("python: IdeaInput per idea", lambda: [IdeaInput.model_validate(idea) for idea in ideas]),
+            ("python: TypeAdapter(List[IdeaInput])", lambda: models.validate_python(ideas)),
+            ("python: compiled TypedDict (validation.IDEAS)", lambda: validation.IDEAS.validate_python(ideas)),
+            ("json: IdeaRequest.model_validate_json", lambda: IdeaRequest.model_validate_json(body)),
+            ("json: compiled TypedDict (IDEA_REQUEST)", lambda: validation.IDEA_REQUEST.validate_json(body)),
+            ("json: complete ingestion (read_idea_batch)", lambda: asyncio.run(ingest.read_idea_batch(body_request(body)))),
+        ]
+        for name, fn in cases:
+            seconds = timed(fn, args.repeat)
+            print(f"{n:>6} {name:<44} {seconds * 1e3:>10.2f} {seconds / n * 1e9:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Benchmark: JSON vs MessagePack vs CBOR for /rank_ideas request and response bodies.
+
+Request: decoding + validating an IdeaRequest body (FastAPI's previous json.loads + validation,
+pydantic's one-pass model_validate_json, and decoding MessagePack / CBOR straight into the model).
+Response: encoding an assembled response (orjson vs MessagePack vs CBOR).
+
+Usage:
+    python benchmarks/wire_formats.py [--sizes 1000 5000 10000] [--repeat 3] [--matrix]
+
+Needs the optional msgpack and cbor2 packages; encodings whose package is missing are skipped.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import numpy as np
+
+from app.api.v1 import formats
+from app.api.v1.models.request import IdeaRequest
+from app.core.serialization import dumps
+from app.services.types import RankedIdea
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+
+def make_request(n: int) -> dict:
+    # ~1000 ideas per MB, i.e. the 10MB limit is reached around 10k ideas
+    sentence = "Idea number {} about improving the customer support experience by answering faster. "
+    return {
+        "ideas": [
+            {"id": i, "author_id": f"author_{i % 50}", "idea": (sentence * 10).format(*[i] * 10)}
+            for i in range(n)
+        ],
+        "advanced_features": {"relationship_graph": True, "pairwise_similarity_matrix": True},
+    }
+
+
+def make_response(n: int, with_matrix: bool) -> dict:
+    rng = np.random.default_rng(42)
+    similarity = np.sort(rng.random(n))[::-1]
+    clusters = rng.integers(0, 8, n)
+    matrix = None
+    if with_matrix:
+        vectors = rng.random((n + 1, 32))
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        matrix = vectors @ vectors.T
+    return {
+        "ranked_ideas": [
+            RankedIdea.model_construct(
+                id=str(i),
+                author_id=f"author_{i % 50}",
+                idea=f"Idea number {i} about improving the customer support experience",
+                similarity_score=float(similarity[i]),
+                cluster_id=int(clusters[i]),
+            )
+            for i in range(n)
+        ],
+        "relationship_graph": None,
+        "pairwise_similarity_matrix": matrix,
+        "cluster_names": None,
+    }
+
+
+def timed(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def request_cases(payload: dict) -> list:
+    body = json.dumps(payload).encode("utf-8")
+    cases = [
+        ("json (loads + validate)", body, lambda: IdeaRequest.model_validate(json.loads(body))),
+        ("json (validate_json)", body, lambda: IdeaRequest.model_validate_json(body)),
+    ]
+    if msgpack is not None:
+        packed = msgpack.packb(payload)
+        cases.append(("msgpack", packed, lambda: IdeaRequest.model_validate(msgpack.unpackb(packed))))
+    if cbor2 is not None:
+        encoded = cbor2.dumps(payload)
+        cases.append(("cbor", encoded, lambda: IdeaRequest.model_validate(cbor2.loads(encoded))))
+    return cases
+
+
+def response_cases(response: dict) -> list:
+    cases = [("json (orjson)", lambda: dumps(response))]
+    if msgpack is not None:
+        cases.append(("msgpack", lambda: formats.to_msgpack(response)))
+    if cbor2 is not None:
+        cases.append(("cbor", lambda: formats.to_cbor(response)))
+    return cases
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 10000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--matrix", action="store_true", help="Include the pairwise similarity matrix in the response")
+    args = parser.parse_args()
+
+    print("Request: decode + validate IdeaRequest")
+    print(f"{'ideas':>6} {'encoding':<24} {'time (s)':>9} {'body (MB)':>10}")
+    for n in args.sizes:
+        for name, body, fn in request_cases(make_request(n)):
+            print(f"{n:>6} {name:<24} {timed(fn, args.repeat):>9.3f} {len(body) / 1e6:>10.2f}")
+
+    print()
+    print(f"Response: encode AnalysisResponse{' with matrix' if args.matrix else ''}")
+    print(f"{'ideas':>6} {'encoding':<24} {'time (s)':>9} {'body (MB)':>10}")
+    for n in args.sizes:
+        response = make_response(n, args.matrix)
+        for name, fn in response_cases(response):
+            print(f"{n:>6} {name:<24} {timed(fn, args.repeat):>9.3f} {len(fn()) / 1e6:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
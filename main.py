@@ -1,9 +1,13 @@
 import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from starlette.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from slowapi.errors import RateLimitExceeded
 from slowapi import _rate_limit_exceeded_handler
 from app.core.config import settings
+from app.core.compression import CompressionMiddleware, RequestDecompressionMiddleware
+from app.core.workers import analysis_pool
 
 from app.services.analyzer import init_nltk_resources
 import app.api.v1.routes as v1
@@ -13,9 +17,20 @@ from dotenv import load_dotenv
 os.environ.clear()
 load_dotenv(override=True)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    analysis_pool.start()
+    await v1.jobs.job_queue.start()
+    yield
+    # Give running jobs a chance to finish (the rest is requeued), and let running analyses
+    # finish before the workers stop
+    await v1.jobs.job_queue.drain(settings.JOB_DRAIN_TIMEOUT)
+    await run_in_threadpool(analysis_pool.shutdown)
+
 # Main app for requests at the base url. This will serve documentation etc, but all API endpoints must go to a versioned one.
 app = FastAPI(
-  title=settings.PROJECT_NAME
+  title=settings.PROJECT_NAME,
+  lifespan=lifespan
 )
 
 ### V1 ###
@@ -26,6 +41,9 @@ v1_app = FastAPI(
 app.mount("/v1", v1_app)
 v1_app.include_router(v1.ideas.router)
 v1_app.include_router(v1.auth.router)
+v1_app.include_router(v1.jobs.router)
+v1_app.include_router(v1.admin.router)
+v1_app.include_router(v1.sessions.router)
 ### /V1 ###
 
 ACCESS_CONTROL_ALLOW_CREDENTIALS = os.environ.get(
@@ -48,6 +66,21 @@ app.add_middleware(CORSMiddleware,
                    allow_headers=ACCESS_CONTROL_ALLOW_HEADERS
                    )
 
+if settings.COMPRESSION_ENABLED:
+    app.add_middleware(CompressionMiddleware,
+                       encodings=settings.COMPRESSION_ENCODINGS,
+                       minimum_size=settings.COMPRESSION_MINIMUM_SIZE,
+                       thread_threshold=settings.COMPRESSION_THREAD_THRESHOLD,
+                       gzip_level=settings.GZIP_LEVEL,
+                       zstd_level=settings.ZSTD_LEVEL,
+                       brotli_quality=settings.BROTLI_QUALITY
+                       )
+
+app.add_middleware(RequestDecompressionMiddleware,
+                   max_size=settings.MAX_DECOMPRESSED_REQUEST_SIZE,
+                   thread_threshold=settings.COMPRESSION_THREAD_THRESHOLD
+                   )
+
 init_nltk_resources()
 
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
\ No newline at end of file
@@ -0,0 +1,24 @@
+-- Function to give back credits that were deducted for work that then failed
+-- (unlike add_credits, it leaves the daily free credit schedule alone)
+create or replace function public.refund_credits(
+  p_user_id uuid,
+  amount integer,
+  operation text
+) returns void
+language plpgsql security invoker set search_path = 'public' as $$
+begin
+  update credits
+  set balance = balance + amount
+  where credits.user_id = p_user_id;
+
+  insert into credit_transactions (
+    user_id,
+    amount,
+    operation_type
+  ) values (
+    p_user_id,
+    amount,
+    'refund: ' || operation
+  );
+end;
+$$;
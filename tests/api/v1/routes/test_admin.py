@@ -0,0 +1,57 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api.v1.dependencies.auth import verify_token
+from app.api.v1.routes import admin, ideas
+from app.core.config import settings
+from app.services import cache
+
+IDEAS = [
+    {"id": "1", "idea": "Implement a customer feedback system to gather real-time insights"},
+    {"id": "2", "idea": "Create an automated email response system for customer inquiries"},
+    {"id": "3", "idea": "Develop a mobile app for customer support"},
+    {"id": "4", "idea": "Set up a customer satisfaction survey program"},
+]
+
+@pytest.fixture
+def client(monkeypatch, mock_credit_service):
+    monkeypatch.setattr(settings, "ADMIN_API_KEY", "admin-secret")
+    app = FastAPI()
+    app.include_router(ideas.router)
+    app.include_router(admin.router)
+
+    async def mock_verify_token():
+        return {"user_id": "user-1"}
+    app.dependency_overrides[verify_token] = mock_verify_token
+    return TestClient(app)
+
+ADMIN = {"X-Admin-Key": "admin-secret"}
+
+def test_requires_admin_key(client, monkeypatch):
+    assert client.get("/admin/cache").status_code == 403
+    assert client.get("/admin/cache", headers={"X-Admin-Key": "wrong"}).status_code == 403
+    monkeypatch.setattr(settings, "ADMIN_API_KEY", "")
+    assert client.get("/admin/cache", headers=ADMIN).status_code == 404
+
+def test_repeated_analysis_hits_cache_and_flushes(client, monkeypatch):
+    calls = []
+    analyze = ideas.centroid_analysis
+    monkeypatch.setattr(ideas, "centroid_analysis", lambda texts: calls.append(texts) or analyze(texts))
+
+    first = client.post("/rank_ideas", json={"ideas": IDEAS})
+    # Same ideas, modulo case & whitespace
+    second = client.post("/rank_ideas", json={"ideas": [{**idea, "idea": f" {idea['idea'].lower()} "} for idea in IDEAS]})
+    assert first.status_code == second.status_code == 200
+    assert len(calls) == 1
+    assert [idea["id"] for idea in first.json()["ranked_ideas"]] == [idea["id"] for idea in second.json()["ranked_ideas"]]
+    assert second.json()["ranked_ideas"][0]["idea"].startswith(" ")  # the caller's own texts
+
+    stats = client.get("/admin/cache", headers=ADMIN).json()
+    assert stats["hits"] == 1 and stats["misses"] == 1
+    assert stats["tiers"][0]["entries"] == 1
+
+    flushed = client.delete("/admin/cache", headers=ADMIN).json()
+    assert flushed["tiers"][0]["entries"] == 0
+    client.post("/rank_ideas", json={"ideas": IDEAS})
+    assert len(calls) == 2
@@ -11,15 +11,15 @@ from slowapi.errors import RateLimitExceeded
 from unittest.mock import patch
 from app.api.v1.dependencies.auth import verify_token
 from app.services.types import (
-    Results,
-    PlotData,
+    AnalysisResult,
     RankedIdea,
     ClusterName
 )
 
 from app.services.clustering import summarize_clusters
 import uuid
-from unittest.mock import MagicMock
+import numpy as np
+from unittest.mock import AsyncMock, MagicMock
 import inspect
 
 # Create a test app with the router
@@ -107,17 +107,17 @@ async def test_rank_ideas_success(override_dependencies, mock_ideas, auth_header
          patch('app.services.analyzer.centroid_analysis') as mock_analysis:
         
         # Set up mock return for centroid_analysis
-        mock_results = {
-            "ideas": ["This is my first idea", "And I have a Second idea as well", "Let's add Other ideas", "These are Many ideas"],
-            "similarity": [0.9, 0.8, 0.7, 0.6]
-        }
-        mock_plot_data = {
-            "scatter_points": [[0.1, 0.2], [0.3, 0.4], [0.5, 0.6], [0.7, 0.8], [0.9, 1.0]],
-            "kmeans_data": {"cluster": [0, 0, 1, 1]},
-            "pairwise_similarity": [[1.0, 0.8, 0.7, 0.6], [0.8, 1.0, 0.5, 0.4], 
-                                   [0.7, 0.5, 1.0, 0.9], [0.6, 0.4, 0.9, 1.0]]
-        }
-        mock_analysis.return_value = (mock_results, mock_plot_data)
+        mock_analysis.return_value = AnalysisResult(
+            ideas=["This is my first idea", "And I have a Second idea as well", "Let's add Other ideas", "These are Many ideas"],
+            order=[0, 1, 2, 3],
+            similarity=[0.9, 0.8, 0.7, 0.6, 1.0],
+            distance=[0.1, 0.2, 0.3, 0.4, 0.0],
+            coords=[[0.1, 0.2], [0.3, 0.4], [0.5, 0.6], [0.7, 0.8], [0.9, 1.0]],
+            pairwise_similarity=[[1.0, 0.8, 0.7, 0.6, 0.9], [0.8, 1.0, 0.5, 0.4, 0.8], 
+                                 [0.7, 0.5, 1.0, 0.9, 0.7], [0.6, 0.4, 0.9, 1.0, 0.6],
+                                 [0.9, 0.8, 0.7, 0.6, 1.0]],
+            cluster_labels=[0, 0, 1, 1]
+        )
         
         response = client.post(
             ENDPOINT,
@@ -245,6 +245,229 @@ def test_generate_edges_3x3():
     assert edges[5]["similarity"] == 0.6
     
     
+def _ranked_ideas(count):
+    return [
+        RankedIdea(id=str(i + 1), idea=f"Idea {i + 1}", similarity_score=1.0 - i / 10, cluster_id=0)
+        for i in range(count)
+    ]
+
+def test_generate_edges_top_k():
+    from app.api.v1.routes.ideas import _generate_edges
+    matrix = [
+        [1.0, 0.9, 0.1, 0.2],
+        [0.9, 1.0, 0.3, 0.4],
+        [0.1, 0.3, 1.0, 0.8],
+        [0.2, 0.4, 0.8, 1.0],
+    ]
+    edges = _generate_edges(_ranked_ideas(4), matrix, top_k=1)
+    idea_edges = [(e["from_id"], e["to_id"], e["similarity"]) for e in edges if e["to_id"] != "Centroid"]
+    
+    # 1<->2 and 3<->4 are mutual nearest neighbours, so each shows up only once
+    assert idea_edges == [("1", "2", 0.9), ("3", "4", 0.8)]
+    assert len(edges) == 2 + 4  # plus one centroid edge per idea
+
+def test_generate_edges_min_similarity():
+    from app.api.v1.routes.ideas import _generate_edges
+    matrix = [
+        [1.0, 0.9, 0.1, 0.2],
+        [0.9, 1.0, 0.3, 0.4],
+        [0.1, 0.3, 1.0, 0.8],
+        [0.2, 0.4, 0.8, 1.0],
+    ]
+    edges = _generate_edges(_ranked_ideas(4), matrix, min_similarity=0.35)
+    idea_edges = [(e["from_id"], e["to_id"]) for e in edges if e["to_id"] != "Centroid"]
+    assert idea_edges == [("1", "2"), ("2", "4"), ("3", "4")]
+    
+    edges = _generate_edges(_ranked_ideas(4), matrix, top_k=2, min_similarity=0.35)
+    idea_edges = [(e["from_id"], e["to_id"]) for e in edges if e["to_id"] != "Centroid"]
+    assert idea_edges == [("1", "2"), ("2", "4"), ("3", "4")]
+
+def test_sparse_edges_tiling_matches_full_matrix():
+    from app.services.similarity import dense_tiles, sparse_edges
+    rng = np.random.default_rng(0)
+    vectors = rng.random((50, 8))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    matrix = vectors @ vectors.T
+    
+    full = sparse_edges(dense_tiles(matrix, 50, tile_rows=50), 50, top_k=3)
+    tiled = sparse_edges(dense_tiles(matrix, 50, tile_rows=7), 50, top_k=3)
+    for a, b in zip(full, tiled):
+        assert np.array_equal(a, b)
+    # Every idea keeps (at least) its 3 nearest neighbours
+    degrees = np.bincount(np.concatenate(full[:2]), minlength=50)
+    assert degrees.min() >= 3
+    
+
+def test_columnar_relationship_graph_matches_object_graph():
+    from app.api.v1.routes.ideas import build_columnar_relationship_graph, build_relationship_graph
+    from app.core.serialization import dumps
+    ranked_ideas = _ranked_ideas(3)
+    analysis = AnalysisResult(
+        ideas=[idea.idea for idea in ranked_ideas],
+        order=[0, 1, 2],
+        similarity=[1.0, 0.9, 0.8, 1.0],
+        distance=[0.0, 0.1, 0.2, 0.0],
+        coords=[[0.1, 0.2], [0.3, 0.4], [0.5, 0.6], [0.0, 0.0]],
+        pairwise_similarity=[[1.0, 0.6, 0.5, 1.0], [0.6, 1.0, 0.2, 0.9], [0.5, 0.2, 1.0, 0.8], [1.0, 0.9, 0.8, 1.0]],
+        cluster_labels=[0, 0, 1]
+    )
+    objects = json.loads(dumps(build_relationship_graph(ranked_ideas, analysis, top_k=1)))
+    columnar = json.loads(dumps(build_columnar_relationship_graph(ranked_ideas, analysis, top_k=1)))
+    
+    assert columnar["format"] == "columnar"
+    nodes = columnar["nodes"]
+    assert nodes["id"] == [node["id"] for node in objects["nodes"]] == ["1", "2", "3", "Centroid"]
+    assert nodes["x"] == [node["coordinates"]["x"] for node in objects["nodes"]]
+    assert nodes["y"] == [node["coordinates"]["y"] for node in objects["nodes"]]
+    
+    edges = columnar["edges"]
+    decoded = [
+        {"from_id": nodes["id"][source], "to_id": nodes["id"][target], "similarity": similarity}
+        for source, target, similarity in zip(edges["source"], edges["target"], edges["similarity"])
+    ]
+    assert decoded == objects["edges"]
+    
+
+def _decode_similarity_matrix(encoded: dict) -> np.ndarray:
+    """Decoding as documented in the README"""
+    import base64
+    n = encoded["shape"][0]
+    if encoded["encoding"] == "json":
+        values = np.array(encoded["data"], dtype=np.float64)
+    else:
+        values = np.frombuffer(base64.b64decode(encoded["data"]), dtype=encoded["dtype"]).astype(np.float64)
+        if encoded["encoding"] == "uint8":
+            values = encoded["offset"] + values * encoded["scale"]
+    if encoded["format"] == "dense":
+        return values.reshape(n, n)
+    matrix = np.zeros((n, n))
+    matrix[np.triu_indices(n)] = values
+    return matrix + np.triu(matrix, 1).T
+
+@pytest.mark.parametrize("format", ["dense", "upper_triangle"])
+@pytest.mark.parametrize("encoding,tolerance", [("json", 0), ("float32", 1e-6), ("float16", 1e-3), ("uint8", 1.5 / 255)])
+def test_encoded_similarity_matrix_round_trip(format, encoding, tolerance):
+    from app.api.v1.routes.ideas import build_pairwise_similarity_matrix
+    from app.core.serialization import dumps
+    rng = np.random.default_rng(1)
+    vectors = rng.normal(size=(9, 5))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    matrix = vectors @ vectors.T
+    analysis = AnalysisResult(
+        ideas=[str(i) for i in range(8)],
+        order=range(8),
+        similarity=matrix[-1],
+        distance=1 - matrix[-1],
+        coords=np.zeros((9, 2)),
+        pairwise_similarity=matrix,
+        cluster_labels=np.zeros(8)
+    )
+    features = AdvancedFeatures(
+        pairwise_similarity_matrix=True, 
+        pairwise_similarity_format=format, 
+        pairwise_similarity_encoding=encoding
+    )
+    encoded = json.loads(dumps(build_pairwise_similarity_matrix(analysis, features)))
+    
+    if format == "dense" and encoding == "json":
+        # The default stays the plain nested-list matrix
+        assert encoded == matrix.tolist()
+        return
+    assert encoded["shape"] == [9, 9]
+    assert np.allclose(_decode_similarity_matrix(encoded), matrix, rtol=0, atol=tolerance)
+    
+
+@pytest.mark.parametrize("encoding", ["json", "float16"])
+def test_top_k_similarity_matrix_without_dense_matrix(encoding):
+    import base64
+    from app.api.v1.routes.ideas import build_pairwise_similarity_matrix
+    from app.core.serialization import dumps
+    from app.services.similarity import normalize_rows
+    rng = np.random.default_rng(2)
+    vectors = normalize_rows(rng.normal(size=(31, 6)))
+    analysis = AnalysisResult(
+        ideas=[str(i) for i in range(30)],
+        order=range(30),
+        similarity=vectors @ vectors[-1],
+        distance=1 - vectors @ vectors[-1],
+        coords=np.zeros((31, 2)),
+        pairwise_similarity=None,
+        cluster_labels=np.zeros(30),
+        vectors=vectors
+    )
+    features = AdvancedFeatures(
+        pairwise_similarity_matrix=True, 
+        pairwise_similarity_format="topk", 
+        pairwise_similarity_top_k=4,
+        pairwise_similarity_encoding=encoding
+    )
+    encoded = json.loads(dumps(build_pairwise_similarity_matrix(analysis, features)))
+    
+    # Only the tiles were computed, never the full matrix
+    assert analysis._pairwise_similarity is None
+    assert encoded["format"] == "topk"
+    assert encoded["shape"] == [30, 30] and encoded["k"] == 4
+    assert encoded["indptr"] == list(range(0, 30 * 4 + 1, 4))
+    scores = (
+        np.array(encoded["data"]) if encoding == "json" 
+        else np.frombuffer(base64.b64decode(encoded["data"]), dtype=encoded["dtype"])
+    )
+    
+    dense = analysis.pairwise_similarity[:30, :30].copy()
+    np.fill_diagonal(dense, -np.inf)
+    for i in range(30):
+        expected = np.argsort(-dense[i], kind="stable")[:4]
+        row = slice(encoded["indptr"][i], encoded["indptr"][i + 1])
+        assert encoded["indices"][row] == expected.tolist()
+        assert np.allclose(scores[row], dense[i, expected], atol=1e-3)
+    
+
+@pytest.mark.asyncio
+async def test_build_base_response_uses_ranking_permutation():
+    from app.api.v1.routes.ideas import build_base_response
+    from app.api.v1.ingest import batch_from_data
+    batch = batch_from_data({"ideas": [
+        {"id": "a", "author_id": "x", "idea": "Same text"},
+        {"id": "b", "idea": "Other text"},
+        {"id": "c", "author_id": "y", "idea": "Same text"},
+        {"idea": "Last text"},
+    ]})
+    analysis = AnalysisResult(
+        ideas=batch.texts,
+        order=[2, 0, 3, 1],
+        similarity=[0.9, 0.8, 0.7, 0.6, 1.0],
+        distance=[0.1, 0.2, 0.3, 0.4, 0.0],
+        coords=[[0.0, 0.0]] * 5,
+        pairwise_similarity=np.eye(5),
+        cluster_labels=[1, 1, 0, 0]
+    )
+    response = await build_base_response(analysis, batch)
+    ranked = response["ranked_ideas"]
+    
+    # Ideas with identical text keep their own ids & authors
+    assert [idea.id for idea in ranked] == ["c", "a", "2", "b"]
+    assert [idea.author_id for idea in ranked] == ["y", "x", "", ""]
+    assert [idea.similarity_score for idea in ranked] == [0.9, 0.8, 0.7, 0.6]
+    assert [idea.cluster_id for idea in ranked] == [1, 1, 0, 0]
+    
+
+def test_fast_json_response_serializes_models_and_arrays():
+    from app.core.serialization import dumps
+    payload = {
+        "ranked_ideas": [RankedIdea.model_construct(id="1", author_id="", idea="First", similarity_score=0.5, cluster_id=0)],
+        "relationship_graph": None,
+        "pairwise_similarity_matrix": np.array([[1.0, 0.25], [0.25, 1.0]]),
+        "cluster_names": [ClusterName(id=0, name="Cluster")],
+    }
+    data = json.loads(dumps(payload))
+    
+    assert data["ranked_ideas"] == [{"id": "1", "author_id": "", "idea": "First", "similarity_score": 0.5, "cluster_id": 0}]
+    assert data["pairwise_similarity_matrix"] == [[1.0, 0.25], [0.25, 1.0]]
+    assert data["cluster_names"] == [{"id": 0, "name": "Cluster"}]
+    # The fast path must stay compatible with the documented response model
+    AnalysisResponse(**data)
+    
+
 @pytest.mark.asyncio
 async def test_rank_ideas_with_cluster_names(override_dependencies, auth_headers, mock_ideas):
     """Test that cluster names are generated correctly"""
@@ -413,9 +636,14 @@ async def test_advanced_features(override_dependencies, auth_headers):
          patch('app.services.credits.CreditService.has_sufficient_credits', return_value=True), \
          patch('app.services.credits.CreditService.get_credits', return_value=100), \
          patch('app.services.credits.CreditService.deduct_credits', return_value=None), \
-         patch('app.services.analyzer.centroid_analysis', return_value=(
-             {"distance": [0.1, 0.2], "ideas": ["Test idea 1", "Test idea 2"], "similarity": [0.9, 0.8]},
-             {"plot_data": "mock data"}
+         patch('app.services.analyzer.centroid_analysis', return_value=AnalysisResult(
+             ideas=["Test idea 1", "Test idea 2"],
+             order=[0, 1],
+             similarity=[0.9, 0.8, 1.0],
+             distance=[0.1, 0.2, 0.0],
+             coords=[[0.1, 0.2], [0.3, 0.4], [0.0, 0.0]],
+             pairwise_similarity=[[1.0, 0.7, 0.9], [0.7, 1.0, 0.8], [0.9, 0.8, 1.0]],
+             cluster_labels=[0, 1]
          )):
         
         # Use more substantial text for ideas to avoid the empty vocabulary error
@@ -487,18 +715,20 @@ async def test_centroid_analysis_mock(mock_centroid_analysis):
         "Develop customer service training program",
         "Set up customer complaint tracking system"
     ]
-    results, plot_data = centroid_analysis(test_ideas)
-    
-    # Check results structure with direct key access instead of isinstance
-    assert "distance" in results
-    assert "ideas" in results
-    assert "similarity" in results
-    assert isinstance(results["distance"], list)
-    assert isinstance(results["ideas"], list)
-    assert isinstance(results["similarity"], list)
-    
-    # Check plot_data
-    assert isinstance(plot_data, dict)
+    analysis = centroid_analysis(test_ideas)
+    
+    # Check the result structure: arrays until emitted, centroid as the last row
+    assert isinstance(analysis, AnalysisResult)
+    assert analysis.ideas == test_ideas
+    assert len(analysis) == len(test_ideas)
+    assert isinstance(analysis.similarity, np.ndarray)
+    assert analysis.similarity.shape == (len(test_ideas) + 1,)
+    assert analysis.coords.shape == (len(test_ideas) + 1, 2)
+    assert analysis.pairwise_similarity.shape == (len(test_ideas) + 1, len(test_ideas) + 1)
+    
+    # Conversion to JSON-ready structures happens on demand
+    assert isinstance(analysis.similarity_list(), list)
+    assert analysis.kmeans_data()["cluster"] == [0, 1, 1, 1]
 
 @pytest.mark.asyncio
 async def test_summarize_clusters_mock(mock_summarize_clusters):
@@ -998,4 +1228,235 @@ async def test_rank_ideas_with_app_auth(
 
     assert response.status_code == 200
     data = response.json()
-    assert "ranked_ideas" in data
\ No newline at end of file
+    assert "ranked_ideas" in data
+def _parse_events(body: str):
+    """(event, data) pairs of a Server-Sent Events body, skipping comments"""
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = [line for line in block.split("\n") if not line.startswith(":")]
+        if lines:
+            fields = dict(line.split(": ", 1) for line in lines)
+            events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+STREAM_IDEAS = [
+    {"id": "1", "idea": "Implement a customer feedback system to gather real-time insights"},
+    {"id": "2", "idea": "Create an automated email response system for customer inquiries"},
+    {"id": "3", "idea": "Develop a mobile app for customer support"},
+    {"id": "4", "idea": "Set up a customer satisfaction survey program"},
+    {"id": "5", "idea": "Launch employee training program for better customer service"},
+    {"id": "6", "idea": "Optimize the website loading speed for better user experience"},
+]
+
+@pytest.mark.asyncio
+async def test_rank_ideas_stream_events(override_dependencies, mock_credit_service, auth_headers):
+    """The stream sends each stage in order, with the same results as /rank_ideas"""
+    names = [{"id": 0, "name": "Customer support"}]
+    request = {
+        "ideas": STREAM_IDEAS,
+        "advanced_features": {"relationship_graph": True, "cluster_names": True},
+    }
+    with patch('app.api.v1.routes.ideas.summarize_clusters', AsyncMock(return_value=names)):
+        response = client.post(f"{ENDPOINT}/stream", json=request, headers=auth_headers)
+        expected = client.post(ENDPOINT, json=request, headers=auth_headers).json()
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = _parse_events(response.text)
+    assert [event for event, _ in events] == ["ranking", "clusters", "relationship_graph", "cluster_names", "done"]
+    data = dict(events)
+
+    ranked = expected["ranked_ideas"]
+    assert data["ranking"]["ranked_ideas"] == [
+        {key: idea[key] for key in ("id", "idea", "author_id", "similarity_score")} for idea in ranked
+    ]
+    assert data["clusters"]["cluster_ids"] == [idea["cluster_id"] for idea in ranked]
+    assert data["relationship_graph"] == expected["relationship_graph"]
+    assert data["cluster_names"] == names
+
+@pytest.mark.asyncio
+async def test_rank_ideas_stream_rejects_invalid_input_before_streaming(override_dependencies, auth_headers):
+    response = client.post(f"{ENDPOINT}/stream", json={"ideas": STREAM_IDEAS[:3]}, headers=auth_headers)
+    assert response.status_code == 400
+    assert response.text == 'Please provide at least 4 items to analyze'
+
+@pytest.mark.asyncio
+async def test_rank_ideas_stream_reports_failures_in_stream(override_dependencies, mock_credit_service, auth_headers):
+    """Once the ranking is sent, a failing stage ends the stream with an error event"""
+    with patch('app.services.analyzer.StagedAnalysis.cluster', side_effect=RuntimeError("boom")):
+        response = client.post(f"{ENDPOINT}/stream", json={"ideas": STREAM_IDEAS}, headers=auth_headers)
+    assert response.status_code == 200
+    events = _parse_events(response.text)
+    assert [event for event, _ in events] == ["ranking", "error"]
+    assert "boom" not in events[1][1]["detail"]
+
+@pytest.mark.asyncio
+async def test_rank_ideas_ndjson_matches_json(override_dependencies, mock_credit_service, auth_headers):
+    """The NDJSON records hold the same ranking and graph as the JSON response"""
+    request = {
+        "ideas": STREAM_IDEAS,
+        "advanced_features": {"relationship_graph": True, "pairwise_similarity_matrix": True},
+    }
+    response = client.post(ENDPOINT, json=request, headers={**auth_headers, "Accept": "application/x-ndjson"})
+    expected = client.post(ENDPOINT, json=request, headers=auth_headers).json()
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    records = [json.loads(line) for line in response.text.splitlines()]
+    by_type = {}
+    for record in records:
+        by_type.setdefault(record.pop("type"), []).append(record)
+
+    assert by_type["ranked_idea"] == expected["ranked_ideas"]
+    assert by_type["node"] == expected["relationship_graph"]["nodes"]
+    assert by_type["edge"] == expected["relationship_graph"]["edges"]
+    rows = [row["values"] for row in by_type["pairwise_similarity_row"]]
+    assert np.allclose(rows, expected["pairwise_similarity_matrix"])
+
+@pytest.fixture
+def batch_credits(monkeypatch):
+    """Credits for the batch endpoint: a balance, and the recorded deductions"""
+    from app.services.credits import CreditService
+    state = {"balance": 1000, "deducted": [], "refunded": [], "deducted_per_operation": []}
+
+    async def get_credits(user_id):
+        return state["balance"]
+
+    async def deduct_amount(user_id, operation, amount):
+        if amount > state["balance"]:
+            return False
+        state["balance"] -= amount
+        state["deducted"].append((operation, amount))
+        return True
+
+    async def refund_amount(user_id, operation, amount):
+        state["balance"] += amount
+        state["refunded"].append((operation, amount))
+
+    async def deduct_credits(user_id, operation, *args):
+        state["deducted_per_operation"].append(operation)
+        return True
+
+    monkeypatch.setattr(CreditService, "get_credits", get_credits)
+    monkeypatch.setattr(CreditService, "deduct_amount", deduct_amount)
+    monkeypatch.setattr(CreditService, "refund_amount", refund_amount)
+    monkeypatch.setattr(CreditService, "deduct_credits", deduct_credits)
+    return state
+
+@pytest.mark.asyncio
+async def test_rank_ideas_batch(override_dependencies, batch_credits, auth_headers):
+    """Each set gets its own result or error; credits are checked and deducted once for the batch"""
+    graph = {"relationship_graph": True}
+    requests = [
+        {"ideas": STREAM_IDEAS},
+        {"ideas": STREAM_IDEAS[:3]},
+        {"ideas": STREAM_IDEAS[1:], "advanced_features": graph},
+    ]
+    response = client.post(f"{ENDPOINT}/batch", json=requests, headers=auth_headers)
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [result["status"] for result in results] == [200, 400, 200]
+    assert results[1]["error"] == 'Please provide at least 4 items to analyze'
+    assert batch_credits["deducted_per_operation"] == []
+
+    single = client.post(ENDPOINT, json=requests[2], headers=auth_headers)
+    assert [idea["id"] for idea in results[2]["result"]["ranked_ideas"]] == [idea["id"] for idea in single.json()["ranked_ideas"]]
+    assert results[2]["result"]["relationship_graph"] == single.json()["relationship_graph"]
+
+    # One deduction per operation, summed over the successful sets
+    from app.services.credits import CreditService
+    sizes = [(len(ideas), sum(len(idea["idea"].encode()) for idea in ideas)) for ideas in (STREAM_IDEAS, STREAM_IDEAS[1:])]
+    basic = [await CreditService.get_operation_cost("basic_analysis", *size) for size in sizes]
+    assert batch_credits["deducted"] == [
+        ("basic_analysis", sum(basic)),
+        ("relationship_graph", await CreditService.get_operation_cost("relationship_graph", *sizes[1])),
+    ]
+    assert batch_credits["refunded"] == []
+
+@pytest.mark.asyncio
+async def test_rank_ideas_batch_refunds_failed_sets(override_dependencies, batch_credits, auth_headers, monkeypatch):
+    """Credits are deducted once, up front, for all valid sets; the failed ones get theirs back"""
+    from fastapi import HTTPException
+    from app.api.v1.routes import ideas
+    from app.services.credits import CreditService
+
+    analyze = ideas.run_analysis
+    async def failing_analysis(batch, *args, **kwargs):
+        if len(batch) == len(STREAM_IDEAS) - 1:
+            raise HTTPException(status_code=503, detail="Try again")
+        return await analyze(batch, *args, **kwargs)
+    monkeypatch.setattr(ideas, "run_analysis", failing_analysis)
+
+    requests = [{"ideas": STREAM_IDEAS}, {"ideas": STREAM_IDEAS[1:]}]
+    response = client.post(f"{ENDPOINT}/batch", json=requests, headers=auth_headers)
+    assert response.status_code == 200
+    assert [result["status"] for result in response.json()["results"]] == [200, 503]
+
+    sizes = [(len(ideas), sum(len(idea["idea"].encode()) for idea in ideas)) for ideas in (STREAM_IDEAS, STREAM_IDEAS[1:])]
+    basic = [await CreditService.get_operation_cost("basic_analysis", *size) for size in sizes]
+    assert batch_credits["deducted"] == [("basic_analysis", sum(basic))]
+    assert batch_credits["refunded"] == [("basic_analysis", basic[1])]
+    assert batch_credits["balance"] == 1000 - basic[0]
+    assert batch_credits["deducted_per_operation"] == []
+
+@pytest.mark.asyncio
+async def test_rank_ideas_batch_insufficient_credits(override_dependencies, batch_credits, auth_headers):
+    batch_credits["balance"] = 1
+    response = client.post(f"{ENDPOINT}/batch", json=[{"ideas": STREAM_IDEAS}] * 2, headers=auth_headers)
+    assert response.status_code == 402
+    assert batch_credits["deducted"] == []
+
+@pytest.mark.asyncio
+async def test_rank_ideas_batch_credits_spent_meanwhile(override_dependencies, batch_credits, auth_headers, monkeypatch):
+    """Credits spent by another request after the balance check are caught by the deduction"""
+    from app.services.credits import CreditService
+    async def stale_balance(user_id):
+        return 1000
+    monkeypatch.setattr(CreditService, "get_credits", stale_balance)
+    batch_credits["balance"] = 1
+    response = client.post(f"{ENDPOINT}/batch", json=[{"ideas": STREAM_IDEAS}] * 2, headers=auth_headers)
+    assert response.status_code == 402
+    assert batch_credits["deducted"] == []
+    assert batch_credits["balance"] == 1
+
+@pytest.mark.asyncio
+async def test_rank_ideas_batch_limits(override_dependencies, batch_credits, auth_headers, monkeypatch):
+    monkeypatch.setattr("app.api.v1.ingest.MAX_BATCH_REQUESTS", 2)
+    response = client.post(f"{ENDPOINT}/batch", json=[{"ideas": STREAM_IDEAS}] * 3, headers=auth_headers)
+    assert response.status_code == 400
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_requests_share_one_analysis(override_dependencies, batch_credits, auth_headers, monkeypatch):
+    """Identical requests in flight at the same time run one analysis, but each is charged"""
+    import asyncio
+    import threading
+    import time
+    import httpx
+    from app.api.v1.routes import ideas
+    from app.services.cache import AnalysisCache
+
+    monkeypatch.setattr(ideas, "analysis_cache", AnalysisCache([]))
+    calls = []
+    analyze = ideas.centroid_analysis
+    def slow_analysis(texts):
+        calls.append(threading.get_ident())
+        time.sleep(0.5)
+        return analyze(texts)
+    monkeypatch.setattr(ideas, "centroid_analysis", slow_analysis)
+
+    shouting = [{**idea, "idea": idea["idea"].upper()} for idea in STREAM_IDEAS]
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as async_client:
+        responses = await asyncio.gather(
+            async_client.post(ENDPOINT, json={"ideas": STREAM_IDEAS}, headers=auth_headers),
+            async_client.post(ENDPOINT, json={"ideas": STREAM_IDEAS}, headers=auth_headers),
+            async_client.post(ENDPOINT, json={"ideas": shouting}, headers=auth_headers),
+        )
+
+    assert [response.status_code for response in responses] == [200, 200, 200]
+    assert len(calls) == 1
+    assert batch_credits["deducted_per_operation"] == ["basic_analysis"] * 3
+    ranked = [response.json()["ranked_ideas"] for response in responses]
+    assert [idea["id"] for idea in ranked[0]] == [idea["id"] for idea in ranked[2]]
+    # Each caller gets their own texts back
+    assert all(idea["idea"].isupper() for idea in ranked[2])
+    assert ideas.analysis_flights.in_flight == 0
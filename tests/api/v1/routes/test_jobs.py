@@ -0,0 +1,226 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+from app.api.v1.dependencies.auth import verify_token
+from app.api.v1.routes import ideas, jobs
+from app.core.limiter import limiter
+from app.services.jobs import FAILED, QUEUED, RUNNING, SUCCEEDED, JobQueue
+
+IDEAS = [
+    {"id": "1", "idea": "Implement a customer feedback system to gather real-time insights"},
+    {"id": "2", "idea": "Create an automated email response system for customer inquiries"},
+    {"id": "3", "idea": "Develop a mobile app for customer support"},
+    {"id": "4", "idea": "Set up a customer satisfaction survey program"},
+    {"id": "5", "idea": "Launch employee training program for better customer service"},
+]
+
+@pytest.fixture(autouse=True)
+def disable_limiter():
+    limiter.enabled = False
+    yield
+    limiter.enabled = True
+
+@pytest.fixture
+def user():
+    return {"user_id": "user-1"}
+
+@pytest.fixture
+def client(tmp_path, monkeypatch, mock_credit_service, user):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), jobs.run_rank_ideas_job, charge=jobs.charge_rank_ideas_job, poll_interval=0.05)
+    monkeypatch.setattr(jobs, "job_queue", queue)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        await queue.start()
+        yield
+        await queue.drain(5)
+
+    app = FastAPI(lifespan=lifespan)
+    app.include_router(ideas.router)
+    app.include_router(jobs.router)
+
+    async def mock_verify_token():
+        return user
+    app.dependency_overrides[verify_token] = mock_verify_token
+    with TestClient(app) as client:
+        yield client
+
+def wait_for(client, url, statuses=(SUCCEEDED, FAILED), timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(url).json()
+        if job["status"] in statuses:
+            return job
+        time.sleep(0.1)
+    raise AssertionError(f"Job didn't finish: {job}")
+
+def test_job_returns_the_rank_ideas_result(client):
+    request = {"ideas": IDEAS, "advanced_features": {"relationship_graph": True}}
+    response = client.post("/jobs/rank_ideas", json=request)
+    assert response.status_code == 202
+    submitted = response.json()
+    assert submitted["status"] == QUEUED
+    assert response.headers["location"].endswith(f"/jobs/{submitted['id']}")
+    
+    job = wait_for(client, response.headers["location"])
+    assert job["status"] == SUCCEEDED
+    assert job["error"] is None
+    assert job["expires_at"] > job["finished_at"]
+    expected = client.post("/rank_ideas", json=request).json()
+    # (The number of clusters isn't deterministic)
+    without_clusters = lambda ranked: [{**idea, "cluster_id": None} for idea in ranked]
+    assert without_clusters(job["result"]["ranked_ideas"]) == without_clusters(expected["ranked_ideas"])
+    assert job["result"]["relationship_graph"] == expected["relationship_graph"]
+
+def test_job_polls_are_conditional(client):
+    location = client.post("/jobs/rank_ideas", json={"ideas": IDEAS}).headers["location"]
+    queued = client.get(location)
+    wait_for(client, location)
+    finished = client.get(location)
+    assert finished.headers["etag"] != queued.headers["etag"]
+
+    unchanged = client.get(location, headers={"If-None-Match": finished.headers["etag"]})
+    assert unchanged.status_code == 304
+    assert unchanged.content == b""
+    assert unchanged.headers["etag"] == finished.headers["etag"]
+
+    changed = client.get(location, headers={"If-None-Match": queued.headers["etag"]})
+    assert changed.status_code == 200
+    assert changed.json() == finished.json()
+
+def test_job_is_charged_once_it_succeeded(client, monkeypatch):
+    charged = []
+    async def deduct_credits(user_id, operation, *args):
+        charged.append(operation)
+        return True
+    monkeypatch.setattr("app.services.credits.CreditService.deduct_credits", deduct_credits)
+
+    request = {"ideas": IDEAS, "advanced_features": {"relationship_graph": True, "pairwise_similarity_matrix": True}}
+    wait_for(client, client.post("/jobs/rank_ideas", json=request).headers["location"])
+    assert charged == ["basic_analysis", "relationship_graph"]
+
+def test_job_input_is_checked_on_submission(client):
+    response = client.post("/jobs/rank_ideas", json={"ideas": IDEAS[:3]})
+    assert response.status_code == 400
+
+def test_jobs_are_private(client, user, monkeypatch):
+    monkeypatch.setattr("app.core.config.settings.is_in_trial_mode", False)
+    url = client.post("/jobs/rank_ideas", json={"ideas": IDEAS}).headers["location"]
+    user["user_id"] = "someone-else"
+    assert client.get(url).status_code == 404
+    assert client.get("/jobs/unknown").status_code == 404
+
+@pytest.mark.asyncio
+async def test_failed_jobs_keep_the_error(tmp_path):
+    async def handler(user_id, payload):
+        raise HTTPException(status_code=503, detail="Try again")
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), handler, poll_interval=0.01)
+    await queue.start()
+    submitted = await queue.submit("user", b"{}")
+    for _ in range(200):
+        job = await queue.get(submitted.id, "user")
+        if job.status == FAILED:
+            break
+        await asyncio.sleep(0.01)
+    await queue.drain(1)
+    assert (job.status, job.error) == (FAILED, "Try again")
+
+@pytest.mark.asyncio
+async def test_drain_requeues_running_jobs(tmp_path):
+    """Jobs still running after the drain timeout are picked up again by the next process"""
+    path = str(tmp_path / "jobs.sqlite3")
+    started = asyncio.Event()
+    
+    async def stuck(user_id, payload):
+        started.set()
+        await asyncio.sleep(60)
+    queue = JobQueue(path, stuck, poll_interval=0.01)
+    await queue.start()
+    submitted = await queue.submit("user", b"payload")
+    await asyncio.wait_for(started.wait(), 5)
+    assert (await queue.get(submitted.id, "user")).status == RUNNING
+    await queue.drain(0.05)
+    assert (await queue.get(submitted.id, "user")).status == QUEUED
+    
+    async def quick(user_id, payload):
+        return payload.upper()
+    queue = JobQueue(path, quick, poll_interval=0.01, ttl=0.5)
+    await queue.start()
+    for _ in range(200):
+        job = await queue.get(submitted.id, "user")
+        if job is not None and job.status == SUCCEEDED:
+            break
+        await asyncio.sleep(0.01)
+    assert job.result == b"PAYLOAD"
+    
+    # Gone once expired
+    await asyncio.sleep(0.6)
+    assert await queue.get(submitted.id, "user") is None
+    await queue.drain(1)
+
+@pytest.mark.asyncio
+async def test_requeued_jobs_are_charged_once(tmp_path):
+    """A job interrupted after it was charged isn't charged again when it runs again"""
+    path = str(tmp_path / "jobs.sqlite3")
+    charges = []
+    charging = asyncio.Event()
+
+    async def handler(user_id, payload):
+        return payload
+
+    async def slow_charge(user_id, payload):
+        charges.append(payload)
+        charging.set()
+        await asyncio.sleep(60)
+    queue = JobQueue(path, handler, charge=slow_charge, poll_interval=0.01)
+    await queue.start()
+    submitted = await queue.submit("user", b"payload")
+    await asyncio.wait_for(charging.wait(), 5)
+    await queue.drain(0.05)
+    assert (await queue.get(submitted.id, "user")).status == QUEUED
+
+    async def charge(user_id, payload):
+        charges.append(payload)
+    queue = JobQueue(path, handler, charge=charge, poll_interval=0.01)
+    await queue.start()
+    for _ in range(200):
+        job = await queue.get(submitted.id, "user")
+        if job.status == SUCCEEDED:
+            break
+        await asyncio.sleep(0.01)
+    await queue.drain(1)
+    assert job.status == SUCCEEDED
+    assert charges == [b"payload"]
+
+@pytest.mark.asyncio
+async def test_failed_charges_fail_the_job_but_not_the_runner(tmp_path):
+    async def handler(user_id, payload):
+        return payload
+
+    async def charge(user_id, payload):
+        if payload == b"first":
+            raise RuntimeError("The credits RPC failed")
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), handler, charge=charge, concurrency=1, poll_interval=0.01)
+    await queue.start()
+    first = await queue.submit("user", b"first")
+    second = await queue.submit("user", b"second")
+    for _ in range(200):
+        jobs = [await queue.get(submitted.id, "user") for submitted in (first, second)]
+        if all(job.status in (SUCCEEDED, FAILED) for job in jobs):
+            break
+        await asyncio.sleep(0.01)
+    await queue.drain(1)
+    assert (jobs[0].status, jobs[0].result, jobs[0].error) == (FAILED, None, "Charging credits for the job failed.")
+    assert (jobs[1].status, jobs[1].result) == (SUCCEEDED, b"second")
+
+def test_trial_mode_jobs_are_found_by_id(client, user, monkeypatch):
+    """Trial mode user ids change with every request"""
+    monkeypatch.setattr("app.core.config.settings.is_in_trial_mode", True)
+    url = client.post("/jobs/rank_ideas", json={"ideas": IDEAS}).headers["location"]
+    user["user_id"] = "trial_mode_later"
+    assert client.get(url).status_code == 200
@@ -0,0 +1,266 @@
+import asyncio
+
+import numpy as np
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from app.api.v1 import live
+from app.api.v1.dependencies.auth import verify_token, verify_websocket_token
+from app.api.v1.ingest import IdeaBatch
+from app.api.v1.routes import ideas, sessions
+from app.core.config import settings
+from app.services.credits import CreditService
+from app.services.sessions import SessionStore
+
+IDEAS = [
+    {"id": "1", "idea": "Implement a customer feedback system to gather real-time insights"},
+    {"id": "2", "idea": "Create an automated email response system for customer inquiries"},
+    {"id": "3", "idea": "Develop a mobile app for customer support"},
+    {"id": "4", "idea": "Set up a customer satisfaction survey program"},
+    {"id": "5", "idea": "Launch employee training program for better customer service"},
+    {"id": "6", "idea": "Optimize the website loading speed for better user experience"},
+]
+
+@pytest.fixture
+def user():
+    return {"user_id": "user-1"}
+
+@pytest.fixture
+def charged(monkeypatch):
+    operations = []
+
+    async def has_sufficient_credits(user_id, operations, *args):
+        return True
+
+    async def deduct_credits(user_id, operation, *args):
+        operations.append(operation)
+        return True
+
+    monkeypatch.setattr(CreditService, "has_sufficient_credits", has_sufficient_credits)
+    monkeypatch.setattr(CreditService, "deduct_credits", deduct_credits)
+    return operations
+
+@pytest.fixture
+def client(monkeypatch, charged, user):
+    monkeypatch.setattr(sessions, "session_store", SessionStore(max_bytes=50_000_000, ttl=3600))
+    monkeypatch.setattr(settings, "is_in_trial_mode", False)
+    app = FastAPI()
+    app.include_router(ideas.router)
+    app.include_router(sessions.router)
+
+    async def mock_verify_token():
+        return user
+    app.dependency_overrides[verify_token] = mock_verify_token
+    app.dependency_overrides[verify_websocket_token] = mock_verify_token
+    return TestClient(app)
+
+@pytest.fixture
+def session_url(client):
+    response = client.post("/sessions", json={"ideas": IDEAS})
+    assert response.status_code == 201
+    assert response.json()["num_ideas"] == len(IDEAS)
+    return response.headers["location"]
+
+def test_views_match_rank_ideas(client, session_url, charged):
+    features = {"relationship_graph": True, "pairwise_similarity_matrix": True}
+    expected = client.post("/rank_ideas", json={"ideas": IDEAS, "advanced_features": features}).json()
+    charged.clear()
+
+    ranking = client.get(f"{session_url}/ranking").json()
+    assert ranking["total"] == len(IDEAS)
+    assert ranking["ranked_ideas"] == expected["ranked_ideas"]
+    page = client.get(f"{session_url}/ranking", params={"offset": 2, "limit": 3}).json()
+    assert page["ranked_ideas"] == expected["ranked_ideas"][2:5]
+
+    clusters = client.get(f"{session_url}/clusters").json()
+    assert clusters["cluster_ids"] == [idea["cluster_id"] for idea in expected["ranked_ideas"]]
+
+    rows = client.get(f"{session_url}/matrix", params={"offset": 1, "limit": 3}).json()
+    assert np.allclose(rows["rows"], expected["pairwise_similarity_matrix"][1:4])
+    last = client.get(f"{session_url}/matrix", params={"offset": len(IDEAS)}).json()
+    assert np.allclose(last["rows"], expected["pairwise_similarity_matrix"][-1:])
+    # Those are free
+    assert charged == []
+
+    graph = client.get(f"{session_url}/graph").json()
+    assert graph == expected["relationship_graph"]
+    assert charged == ["relationship_graph"]
+
+def test_clusters_for_another_k(client, session_url):
+    response = client.get(f"{session_url}/clusters", params={"k": 3})
+    assert response.status_code == 200
+    clusters = response.json()
+    assert clusters["k"] == 3
+    assert set(clusters["cluster_ids"]) == {0, 1, 2}
+    assert len(clusters["kmeans_data"]["centers"]) == 3
+    assert client.get(f"{session_url}/clusters", params={"k": len(IDEAS)}).status_code == 400
+
+def test_clusterings_from_before_an_addition_are_dropped(client, session_url, monkeypatch):
+    session = sessions.session_store.get(session_url.rsplit("/", 1)[1], None)
+    run = sessions.analysis_pool.run
+
+    async def run_while_adding(function, *args):
+        result = await run(function, *args)
+        text = "Add a live chat to the customer support website"
+        await sessions.add_ideas(session, IdeaBatch([text], ["7"], [None], len(text)))
+        return result
+    monkeypatch.setattr(sessions.analysis_pool, "run", run_while_adding)
+
+    # Served for the version it was requested for, but not kept for the new one
+    response = client.get(f"{session_url}/clusters", params={"k": 3})
+    assert len(response.json()["cluster_ids"]) == len(IDEAS)
+    assert session.version == 1 and session.clusterings == {}
+
+    monkeypatch.setattr(sessions.analysis_pool, "run", run)
+    response = client.get(f"{session_url}/clusters", params={"k": 3})
+    assert len(response.json()["cluster_ids"]) == len(IDEAS) + 1
+
+def test_views_are_conditional(client, session_url, charged):
+    first = client.get(f"{session_url}/graph")
+    etag = first.headers["etag"]
+    again = client.get(f"{session_url}/graph", headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    # Not charged for the graph it already has
+    assert charged == ["basic_analysis", "relationship_graph"]
+
+    # Other parameters are another representation
+    other = client.get(f"{session_url}/graph", params={"top_k": 2}, headers={"If-None-Match": etag})
+    assert other.status_code == 200 and other.headers["etag"] != etag
+
+def test_sessions_are_private_and_deletable(client, session_url, user):
+    user["user_id"] = "user-2"
+    assert client.get(session_url).status_code == 404
+    assert client.delete(session_url).status_code == 404
+
+    user["user_id"] = "user-1"
+    assert client.get(session_url).status_code == 200
+    assert client.delete(session_url).status_code == 204
+    assert client.get(f"{session_url}/ranking").status_code == 404
+
+def test_adding_ideas(client, session_url, charged):
+    before = client.get(f"{session_url}/ranking")
+    charged.clear()
+
+    response = client.post(f"{session_url}/ideas", json={"ideas": [{"id": "7", "idea": "Add a live chat to the customer support website"}]})
+    assert response.status_code == 200
+    update = response.json()
+    assert update["version"] == 1 and not update["reanalyzed"]
+    assert update["total"] == len(IDEAS) + 1
+    assert sorted(idea["id"] for idea in update["ranked_ideas"]) == sorted([idea["id"] for idea in IDEAS] + ["7"])
+    assert charged == ["basic_analysis"]
+
+    # The views show the new ranking
+    after = client.get(f"{session_url}/ranking", headers={"If-None-Match": before.headers["etag"]})
+    assert after.status_code == 200
+    assert after.json()["ranked_ideas"] == update["ranked_ideas"]
+    assert len(client.get(f"{session_url}/matrix", params={"limit": 1}).json()["rows"][0]) == len(IDEAS) + 2
+
+    # Enough new ideas since the last full analysis: everything is analyzed again
+    response = client.post(f"{session_url}/ideas", json={"ideas": [{"id": "8", "idea": "Reward employees for great customer feedback"}]})
+    assert response.json()["reanalyzed"]
+    expected = client.post("/rank_ideas", json={"ideas": IDEAS + [
+        {"id": "7", "idea": "Add a live chat to the customer support website"},
+        {"id": "8", "idea": "Reward employees for great customer feedback"},
+    ]}).json()
+    assert response.json()["ranked_ideas"] == expected["ranked_ideas"]
+
+    assert client.post(f"{session_url}/ideas", json={"ideas": [{"idea": "  "}]}).status_code == 400
+
+def test_concurrent_additions_respect_the_limit(client, session_url, monkeypatch):
+    monkeypatch.setattr(sessions, "MAX_IDEAS", len(IDEAS) + 1)
+    session = sessions.session_store.get(session_url.rsplit("/", 1)[1], None)
+    batches = [IdeaBatch([text], [None], [None], len(text)) for text in ["Add a live chat", "Reward great feedback"]]
+
+    async def add_both():
+        return await asyncio.gather(*(sessions.add_ideas(session, batch) for batch in batches), return_exceptions=True)
+
+    results = asyncio.run(add_both())
+    assert [isinstance(result, HTTPException) and result.status_code == 400 for result in results] == [False, True]
+    assert len(session) == len(IDEAS) + 1
+
+def live_url(session_url):
+    return session_url.replace("http://", "ws://", 1) + "/live"
+
+def apply_update(ideas, update):
+    """A live client's ranking: input index -> idea"""
+    for entry in update["added"]:
+        ideas[entry["index"]] = entry
+    for entry in update["changed"]:
+        ideas[entry["index"]] = {**ideas[entry["index"]], **entry}
+    return sorted(ideas.values(), key=lambda idea: idea["rank"])
+
+def test_live_submissions_are_batched_and_broadcast(client, session_url, charged):
+    new_ideas = [
+        {"id": "7", "idea": "Add a live chat to the customer support website"},
+        {"id": "8", "idea": "Reward employees for great customer feedback"},
+    ]
+    # One client (and event loop) for the HTTP requests and the WebSockets
+    with client, client.websocket_connect(live_url(session_url)) as first, client.websocket_connect(live_url(session_url)) as second:
+        snapshot = first.receive_json()
+        assert snapshot["type"] == "snapshot" and snapshot["version"] == 0
+        assert second.receive_json() == snapshot
+        charged.clear()
+
+        # Submitted within the batch window: added together, in one update
+        first.send_json({"type": "add_ideas", "ideas": new_ideas[:1]})
+        second.send_json({"type": "add_ideas", "ideas": new_ideas[1:]})
+        assert first.receive_json() == {"type": "accepted", "count": 1}
+        assert second.receive_json() == {"type": "accepted", "count": 1}
+        update = first.receive_json()
+        assert second.receive_json() == update
+        assert update["type"] == "update" and update["version"] == 1 and update["total"] == len(IDEAS) + 2
+        assert [entry["id"] for entry in update["added"]] == ["7", "8"]
+        assert charged == ["basic_analysis", "basic_analysis"]
+
+        ranking = apply_update({idea["index"]: idea for idea in snapshot["ideas"]}, update)
+        expected = client.get(f"{session_url}/ranking").json()["ranked_ideas"]
+        assert [idea["id"] for idea in ranking] == [idea["id"] for idea in expected]
+        assert np.allclose([idea["similarity_score"] for idea in ranking], [idea["similarity_score"] for idea in expected], atol=live.SCORE_TOLERANCE)
+        assert [idea["cluster_id"] for idea in ranking] == [idea["cluster_id"] for idea in expected]
+
+        # Ideas added over HTTP are pushed too, with only what changed
+        client.post(f"{session_url}/ideas", json={"ideas": [{"id": "9", "idea": "Offer customer support by phone"}]})
+        update = first.receive_json()
+        assert update["version"] == 2 and [entry["id"] for entry in update["added"]] == ["9"]
+        assert all(entry["index"] < len(IDEAS) + 2 for entry in update["changed"])
+
+def test_live_errors(client, session_url, user):
+    with client, client.websocket_connect(live_url(session_url)) as websocket:
+        websocket.receive_json()
+        websocket.send_json({"type": "add_ideas"})
+        assert websocket.receive_json()["type"] == "error"
+        websocket.send_json({"type": "add_ideas", "ideas": [{"idea": " "}]})
+        assert websocket.receive_json() == {"type": "error", "detail": "Please provide ideas to add"}
+
+    user["user_id"] = "user-2"
+    with pytest.raises(WebSocketDisconnect) as error:
+        with client.websocket_connect(live_url(session_url)) as websocket:
+            websocket.receive_json()
+    assert error.value.code == 1008
+    # Nobody's subscribed anymore
+    assert live.live_channels == {}
+
+def test_session_input_is_checked(client, charged):
+    assert client.post("/sessions", json={"ideas": IDEAS[:3]}).status_code == 400
+    assert charged == []
+
+def test_store_expires_and_evicts():
+    from app.services.analyzer import centroid_analysis
+    analysis = centroid_analysis([idea["idea"] for idea in IDEAS])
+    ids = [idea["id"] for idea in IDEAS]
+    store = SessionStore(max_bytes=10_000_000, ttl=3600)
+    first = store.create("user-1", "key", analysis, ids, [None] * len(ids), 100)
+
+    store.max_bytes = first.size * 2
+    second = store.create("user-1", "key", analysis, ids, [None] * len(ids), 100)
+    third = store.create("user-1", "key", analysis, ids, [None] * len(ids), 100)
+    # The one that expires first made room
+    assert store.get(first.id, "user-1") is None
+    assert store.get(second.id, None) is second and store.get(third.id, "user-1") is third
+
+    third.expires_at = 0
+    assert store.get(third.id, "user-1") is None
+    with pytest.raises(ValueError):
+        SessionStore(max_bytes=10, ttl=3600).create("user-1", "key", analysis, ids, [None] * len(ids), 100)
@@ -0,0 +1,46 @@
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
+from fastapi.testclient import TestClient
+
+from app.api.v1.etags import conditional_response, etag_matches, make_etag
+from app.core.compression import CompressionMiddleware
+
+def request_with(if_none_match=None) -> Request:
+    headers = [] if if_none_match is None else [(b"if-none-match", if_none_match.encode())]
+    return Request({"type": "http", "method": "GET", "headers": headers})
+
+def test_etags_are_weak_and_stable():
+    etag = make_etag("job", 1, None)
+    assert etag.startswith('W/"') and etag.endswith('"')
+    assert etag == make_etag("job", 1, None)
+    assert etag != make_etag("job", 2, None)
+
+def test_if_none_match():
+    etag = make_etag("result")
+    assert not etag_matches(request_with(), etag)
+    assert etag_matches(request_with(etag), etag)
+    assert etag_matches(request_with(f'"other", {etag}'), etag)
+    assert etag_matches(request_with(f'"other", {etag.removeprefix("W/")}'), etag)
+    assert etag_matches(request_with("*"), etag)
+    assert not etag_matches(request_with('"other"'), etag)
+
+def test_etags_are_valid_for_every_content_coding():
+    """The same ETag for the compressed and uncompressed body: they're equivalent, not identical"""
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, encodings=("gzip",), minimum_size=10)
+
+    @app.get("/result")
+    def result(request: Request):
+        return conditional_response(request, make_etag("result"), lambda: PlainTextResponse("result " * 100))
+    client = TestClient(app)
+
+    compressed = client.get("/result", headers={"Accept-Encoding": "gzip"})
+    identity = client.get("/result", headers={"Accept-Encoding": "identity"})
+    assert compressed.headers["content-encoding"] == "gzip" and "content-encoding" not in identity.headers
+    assert compressed.headers["etag"] == identity.headers["etag"] == make_etag("result")
+    assert compressed.headers["etag"].startswith("W/")
+
+    etag = compressed.headers["etag"]
+    for accept_encoding in ("gzip", "identity"):
+        response = client.get("/result", headers={"If-None-Match": etag, "Accept-Encoding": accept_encoding})
+        assert response.status_code == 304 and response.headers["etag"] == etag
@@ -0,0 +1,202 @@
+import io
+import json
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from app.api.v1 import formats
+from app.api.v1.models.request import AdvancedFeatures
+from app.api.v1.models.response import EncodedSimilarityMatrix
+from app.services.types import AnalysisResult, ClusterName, RankedIdea
+
+
+def make_request(accept: str = None) -> Request:
+    headers = [(b"accept", accept.encode())] if accept is not None else []
+    return Request({"type": "http", "method": "POST", "path": "/rank_ideas", "headers": headers})
+
+@pytest.fixture
+def analysis():
+    return AnalysisResult(
+        ideas=["First idea", "Second idea", "Third idea"],
+        order=[1, 0, 2],
+        similarity=[0.9, 0.8, 0.7, 1.0],
+        distance=[0.1, 0.2, 0.3, 0.0],
+        coords=[[0.1, 0.2], [0.3, 0.4], [0.5, 0.6], [0.0, 0.0]],
+        pairwise_similarity=[
+            [1.0, 0.6, 0.5, 0.9],
+            [0.6, 1.0, 0.2, 0.8],
+            [0.5, 0.2, 1.0, 0.7],
+            [0.9, 0.8, 0.7, 1.0],
+        ],
+        cluster_labels=[0, 0, 1]
+    )
+
+@pytest.fixture
+def response():
+    return {
+        "ranked_ideas": [
+            RankedIdea.model_construct(id="b", author_id="", idea="Second idea", similarity_score=0.9, cluster_id=0),
+            RankedIdea.model_construct(id="a", author_id="x", idea="First idea", similarity_score=0.8, cluster_id=0),
+            RankedIdea.model_construct(id="c", author_id="", idea="Third idea", similarity_score=0.7, cluster_id=1),
+        ],
+        "relationship_graph": None,
+        "pairwise_similarity_matrix": np.zeros((4, 4)),
+        "cluster_names": [ClusterName(id=0, name="Zero"), ClusterName(id=1, name="One")],
+    }
+
+@pytest.mark.parametrize("accept,expected", [
+    (None, formats.JSON),
+    ("*/*", formats.JSON),
+    ("text/html", formats.JSON),
+    ("application/json", formats.JSON),
+    ("application/x-npy", formats.NPY),
+    ("application/x-npz;q=0.9, application/vnd.apache.parquet;q=0.2", formats.NPZ),
+    ("application/x-ndjson", formats.NDJSON),
+    ("application/jsonl", formats.NDJSON),
+])
+def test_negotiate_response_format(accept, expected):
+    assert formats.negotiate_response_format(make_request(accept)) == expected
+
+def test_negotiate_arrow():
+    pytest.importorskip("pyarrow")
+    request = make_request("application/json;q=0.5, application/vnd.apache.arrow.stream")
+    assert formats.negotiate_response_format(request) == formats.ARROW_STREAM
+
+def test_negotiate_arrow_without_pyarrow(monkeypatch):
+    monkeypatch.setattr(formats, "_is_available", lambda media_type: media_type not in formats.ARROW_MEDIA_TYPES)
+    with pytest.raises(HTTPException) as error:
+        formats.negotiate_response_format(make_request(formats.ARROW_STREAM))
+    assert error.value.status_code == 406
+
+def test_arrow_stream(response, analysis):
+    pa = pytest.importorskip("pyarrow")
+    rendered = formats.render_response(formats.ARROW_STREAM, response, analysis)
+    assert rendered.media_type == formats.ARROW_STREAM
+    
+    table = pa.ipc.open_stream(rendered.body).read_all()
+    assert table.column("id").to_pylist() == ["b", "a", "c"]
+    assert table.column("similarity_score").to_pylist() == [0.9, 0.8, 0.7]
+    assert table.column("cluster_id").to_pylist() == [0, 0, 1]
+    assert table.column("coordinates").to_pylist() == [[0.1, 0.2], [0.3, 0.4], [0.5, 0.6]]
+    assert table.column("pairwise_similarity").to_pylist()[1] == [0.6, 1.0, 0.2, 0.8]
+    assert json.loads(table.schema.metadata[b"centroid_coordinates"]) == [0.0, 0.0]
+    assert json.loads(table.schema.metadata[b"cluster_names"]) == [{"id": 0, "name": "Zero"}, {"id": 1, "name": "One"}]
+
+def test_parquet(response, analysis):
+    pq = pytest.importorskip("pyarrow.parquet")
+    response["pairwise_similarity_matrix"] = None
+    rendered = formats.render_response(formats.PARQUET, response, analysis)
+    
+    table = pq.read_table(io.BytesIO(rendered.body))
+    assert table.column("idea").to_pylist() == ["Second idea", "First idea", "Third idea"]
+    assert "pairwise_similarity" not in table.column_names
+
+def test_npy_and_npz(response, analysis):
+    matrix = np.load(io.BytesIO(formats.render_response(formats.NPY, response, analysis).body))
+    assert np.array_equal(matrix, analysis.pairwise_similarity)
+    
+    arrays = np.load(io.BytesIO(formats.render_response(formats.NPZ, response, analysis).body))
+    assert arrays["id"].tolist() == ["b", "a", "c"]
+    assert arrays["input_index"].tolist() == [1, 0, 2]
+    assert arrays["coordinates"].shape == (4, 2)
+    assert np.array_equal(arrays["pairwise_similarity"], analysis.pairwise_similarity)
+
+@pytest.mark.parametrize("media_type,module", [(formats.MSGPACK, "msgpack"), (formats.CBOR, "cbor2")])
+def test_binary_response_matches_json(media_type, module, response, analysis):
+    codec = pytest.importorskip(module)
+    rendered = formats.render_response(media_type, response, analysis)
+    assert rendered.media_type == media_type
+    
+    decoded = codec.unpackb(rendered.body) if module == "msgpack" else codec.loads(rendered.body)
+    expected = json.loads(formats.render_response(formats.JSON, response, analysis).body)
+    assert decoded == expected
+
+async def read_ndjson(rendered) -> list:
+    body = b"".join([chunk async for chunk in rendered.body_iterator])
+    return [json.loads(line) for line in body.decode().splitlines()]
+
+@pytest.mark.asyncio
+async def test_ndjson_records(monkeypatch, response, analysis):
+    """Everything the JSON response holds, one record per line, written in batches"""
+    monkeypatch.setattr(formats, "NDJSON_BATCH_LINES", 4)
+    features = AdvancedFeatures(relationship_graph=True, pairwise_similarity_matrix=True)
+    response["pairwise_similarity_matrix"] = None  # generated while streaming
+    rendered = formats.render_response(formats.NDJSON, response, analysis, features)
+    assert rendered.media_type == formats.NDJSON
+    
+    records = await read_ndjson(rendered)
+    assert [record["type"] for record in records] == (
+        ["ranked_idea"] * 3 + ["node"] * 4 + ["edge"] * 6 + ["cluster_name"] * 2 + ["pairwise_similarity_row"] * 4
+    )
+    assert records[0] == {"type": "ranked_idea", "id": "b", "author_id": "", "idea": "Second idea", "similarity_score": 0.9, "cluster_id": 0}
+    assert records[6] == {"type": "node", "id": "Centroid", "coordinates": {"x": 0.0, "y": 0.0}}
+    assert [(edge["from_id"], edge["to_id"], edge["similarity"]) for edge in records[7:13]] == [
+        ("b", "a", 0.6), ("b", "c", 0.5), ("a", "c", 0.2),
+        ("b", "Centroid", 0.9), ("a", "Centroid", 0.8), ("c", "Centroid", 0.7),
+    ]
+    assert records[13] == {"type": "cluster_name", "id": 0, "name": "Zero"}
+    assert [record["values"] for record in records[15:]] == analysis.pairwise_similarity.tolist()
+
+@pytest.mark.asyncio
+async def test_ndjson_sparse_graph_and_encoded_matrix(response, analysis):
+    features = AdvancedFeatures(relationship_graph=True, relationship_graph_min_similarity=0.4, pairwise_similarity_matrix=True)
+    response["pairwise_similarity_matrix"] = EncodedSimilarityMatrix.model_construct(
+        format="upper_triangle", shape=[4, 4], encoding="float32", dtype="<f4", offset=None, scale=None, data="AAAA"
+    )
+    records = await read_ndjson(formats.render_response(formats.NDJSON, response, analysis, features))
+    
+    edges = [(record["from_id"], record["to_id"]) for record in records if record["type"] == "edge" and record["to_id"] != "Centroid"]
+    assert edges == [("b", "a"), ("b", "c")]
+    assert records[-1]["type"] == "pairwise_similarity_matrix"
+    assert records[-1]["format"] == "upper_triangle"
+
+def make_body_request(body: bytes, content_type: str = None) -> Request:
+    headers = [(b"content-type", content_type.encode())] if content_type is not None else []
+    
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+    return Request({"type": "http", "method": "POST", "path": "/rank_ideas", "headers": headers}, receive)
+
+IDEA_REQUEST = {"ideas": [{"id": 1, "idea": "An idea"}, {"idea": 42}], "advanced_features": {"relationship_graph": True}}
+
+@pytest.mark.parametrize("content_type,module", [
+    (None, None),
+    ("application/json; charset=utf-8", None),
+    ("application/msgpack", "msgpack"),
+    ("application/x-msgpack", "msgpack"),
+    ("application/cbor", "cbor2"),
+])
+@pytest.mark.asyncio
+async def test_parse_request_body(content_type, module):
+    from app.api.v1.models.request import IdeaRequest
+    
+    if module is None:
+        body = json.dumps(IDEA_REQUEST).encode()
+    else:
+        codec = pytest.importorskip(module)
+        body = codec.packb(IDEA_REQUEST) if module == "msgpack" else codec.dumps(IDEA_REQUEST)
+    
+    parsed = await formats.parse_request_body(make_body_request(body, content_type), IdeaRequest)
+    assert isinstance(parsed, IdeaRequest)
+    assert [idea.idea for idea in parsed.ideas] == ["An idea", "42"]
+    assert parsed.advanced_features.relationship_graph
+
+@pytest.mark.asyncio
+async def test_parse_request_body_errors(monkeypatch):
+    from fastapi.exceptions import RequestValidationError
+    from app.api.v1.models.request import IdeaRequest
+    msgpack = pytest.importorskip("msgpack")
+    
+    with pytest.raises(RequestValidationError) as error:
+        await formats.parse_request_body(make_body_request(msgpack.packb({"ideas": [{}]}), formats.MSGPACK), IdeaRequest)
+    assert error.value.errors()[0]["loc"] == ("body", "ideas", 0, "idea")
+    
+    with pytest.raises(RequestValidationError):
+        await formats.parse_request_body(make_body_request(b"\xc1", formats.MSGPACK), IdeaRequest)
+    
+    monkeypatch.setattr(formats, "_is_available", lambda media_type: media_type == formats.JSON)
+    with pytest.raises(HTTPException) as error:
+        await formats.parse_request_body(make_body_request(b"", formats.CBOR), IdeaRequest)
+    assert error.value.status_code == 415
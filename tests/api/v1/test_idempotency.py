@@ -0,0 +1,122 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api.v1 import idempotency
+from app.api.v1.dependencies.auth import verify_token
+from app.api.v1.routes import ideas
+from app.core.config import settings
+from app.services.credits import CreditService
+from app.services.idempotency import IdempotencyStore
+
+IDEAS = [
+    {"id": "1", "idea": "Implement a customer feedback system to gather real-time insights"},
+    {"id": "2", "idea": "Create an automated email response system for customer inquiries"},
+    {"id": "3", "idea": "Develop a mobile app for customer support"},
+    {"id": "4", "idea": "Set up a customer satisfaction survey program"},
+]
+KEY = {"Idempotency-Key": "3f0c7a52-retry-me"}
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = IdempotencyStore(str(tmp_path / "idempotency.sqlite3"))
+    monkeypatch.setattr(idempotency, "idempotency_store", store)
+    return store
+
+@pytest.fixture
+def credits(monkeypatch):
+    calls = []
+
+    async def get_credits(user_id):
+        calls.append("get_credits")
+        return 1000
+
+    async def deduct_credits(user_id, operation, *args):
+        calls.append(operation)
+        return True
+
+    monkeypatch.setattr(CreditService, "get_credits", get_credits)
+    monkeypatch.setattr(CreditService, "deduct_credits", deduct_credits)
+    return calls
+
+@pytest.fixture
+def analyses(monkeypatch):
+    calls = []
+    analyze = ideas.centroid_analysis
+    monkeypatch.setattr(ideas, "centroid_analysis", lambda texts: calls.append(texts) or analyze(texts))
+    # Without the cache, so only the idempotency key can save the analysis
+    monkeypatch.setattr(ideas.analysis_cache, "backends", [])
+    return calls
+
+@pytest.fixture
+def client(store, monkeypatch):
+    monkeypatch.setattr(settings, "is_in_trial_mode", False)
+    app = FastAPI()
+    app.include_router(ideas.router)
+
+    async def mock_verify_token():
+        return {"user_id": "user-1"}
+    app.dependency_overrides[verify_token] = mock_verify_token
+    return TestClient(app)
+
+def test_retry_replays_response_without_analysis_or_credits(client, credits, analyses):
+    first = client.post("/rank_ideas", json={"ideas": IDEAS}, headers=KEY)
+    charged = list(credits)
+    retry = client.post("/rank_ideas", json={"ideas": IDEAS}, headers=KEY)
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.content == first.content
+    assert retry.headers["content-type"] == first.headers["content-type"]
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in first.headers
+    assert len(analyses) == 1
+    assert credits == charged
+
+    # Without a key, or with another one, it's a new request
+    client.post("/rank_ideas", json={"ideas": IDEAS})
+    client.post("/rank_ideas", json={"ideas": IDEAS}, headers={"Idempotency-Key": "another"})
+    assert len(analyses) == 3
+
+def test_key_reused_for_different_request(client, credits, analyses):
+    client.post("/rank_ideas", json={"ideas": IDEAS}, headers=KEY)
+    response = client.post("/rank_ideas", json={"ideas": IDEAS[::-1]}, headers=KEY)
+    assert response.status_code == 422
+    # Another response format is another request too
+    response = client.post("/rank_ideas", json={"ideas": IDEAS}, headers={**KEY, "Accept": "application/msgpack"})
+    assert response.status_code in (406, 422)
+
+@pytest.mark.asyncio
+async def test_in_progress_and_failed_requests(client, store, credits, analyses, monkeypatch):
+    monkeypatch.setattr(ideas, "request_fingerprint", lambda *parts: "fingerprint")
+    await store.begin("user-1", "busy", "fingerprint")
+    response = client.post("/rank_ideas", json={"ideas": IDEAS}, headers={"Idempotency-Key": "busy"})
+    assert response.status_code == 409
+
+    # Invalid requests aren't stored, so the key can be used again once they're fixed
+    response = client.post("/rank_ideas", json={"ideas": IDEAS[:2]}, headers=KEY)
+    assert response.status_code == 400
+    response = client.post("/rank_ideas", json={"ideas": IDEAS}, headers=KEY)
+    assert response.status_code == 200
+
+def test_keys_are_per_user(client, credits, analyses):
+    client.post("/rank_ideas", json={"ideas": IDEAS}, headers=KEY)
+
+    async def other_user():
+        return {"user_id": "user-2"}
+    client.app.dependency_overrides[verify_token] = other_user
+    response = client.post("/rank_ideas", json={"ideas": IDEAS}, headers=KEY)
+    assert "Idempotent-Replayed" not in response.headers
+    assert len(analyses) == 2
+
+def test_rejects_invalid_keys_and_ndjson(client, credits, analyses):
+    assert client.post("/rank_ideas", json={"ideas": IDEAS}, headers={"Idempotency-Key": "x" * 256}).status_code == 400
+    response = client.post("/rank_ideas", json={"ideas": IDEAS}, headers={**KEY, "Accept": "application/x-ndjson"})
+    assert response.status_code == 400
+    assert analyses == []
+
+@pytest.mark.asyncio
+async def test_unfinished_requests_expire(store):
+    store.lock_timeout = 0
+    assert await store.begin("user-1", "key", "a") is None
+    # The marker of a request that never finished doesn't block the key forever
+    assert await store.begin("user-1", "key", "b") is None
@@ -0,0 +1,135 @@
+import json
+from typing import List
+
+import pytest
+from fastapi.exceptions import RequestValidationError
+from starlette.requests import Request
+
+from app.api.v1 import ingest
+from app.api.v1.models.request import IdeaRequest
+
+
+def make_request(body: bytes, chunk_size: int, content_type: str = "application/json"):
+    """Request whose body arrives in chunks of chunk_size bytes; `received` counts the chunks read"""
+    chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)] or [b""]
+    received = []
+    
+    async def receive():
+        index = len(received)
+        received.append(index)
+        return {"type": "http.request", "body": chunks[index], "more_body": index < len(chunks) - 1}
+    
+    request = Request({
+        "type": "http",
+        "method": "POST",
+        "path": "/rank_ideas",
+        "headers": [(b"content-type", content_type.encode())],
+    }, receive)
+    return request, received, len(chunks)
+
+PAYLOAD = {
+    "advanced_features": {"relationship_graph": True, "pairwise_similarity_format": "topk"},
+    "ideas": [
+        {"id": 1, "author_id": "a", "idea": "Make onboarding faster"},
+        {"id": "two", "idea": "   "},
+        {"idea": 42},
+        {"idea": None},
+        {"id": 5, "idea": "Überall schnellere Antworten 🚀"},
+    ],
+    "unknown": [1, {"nested": "value"}],
+}
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 64, 10_000])
+@pytest.mark.parametrize("indent", [None, 2])
+async def test_matches_whole_body_validation(chunk_size, indent):
+    body = json.dumps(PAYLOAD, indent=indent, ensure_ascii=False).encode()
+    request, _, _ = make_request(body, chunk_size)
+    batch = await ingest.read_idea_batch(request)
+    
+    expected = IdeaRequest.model_validate_json(body)
+    expected_ideas = [idea for idea in expected.ideas if idea.idea.strip()]
+    assert batch.texts == [idea.idea for idea in expected_ideas] == ["Make onboarding faster", "42", "Überall schnellere Antworten 🚀"]
+    assert batch.ids == [idea.id for idea in expected_ideas] == [1, None, 5]
+    assert batch.author_ids == [idea.author_id for idea in expected_ideas] == ["a", None, None]
+    assert batch.total_bytes == sum(len(text.encode("utf-8")) for text in batch.texts)
+    assert batch.advanced_features == expected.advanced_features
+    assert batch.limit_error is None
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("limit,expected_error", [("MAX_IDEAS", ingest.TOO_MANY_IDEAS), ("MAX_IDEA_BYTES", ingest.TOO_MANY_BYTES)])
+async def test_stops_reading_at_limit(monkeypatch, limit, expected_error):
+    monkeypatch.setattr(ingest, limit, 10)
+    body = json.dumps({"ideas": [{"idea": f"Idea {i}"} for i in range(1000)]}).encode()
+    request, received, total_chunks = make_request(body, 100)
+    
+    batch = await ingest.read_idea_batch(request)
+    assert batch.limit_error == expected_error
+    assert len(received) < total_chunks / 10
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("body,loc", [
+    ({"ideas": [{"idea": "a"}, {"id": 2}]}, ("body", "ideas", 1, "idea")),
+    ({"ideas": [{"idea": "a"}, {"idea": "b", "id": []}]}, ("body", "ideas", 1, "id", "int")),
+    ({"advanced_features": {"relationship_graph_top_k": 0}, "ideas": []}, ("body", "advanced_features", "relationship_graph_top_k")),
+    ({"advanced_features": {}}, ("body", "ideas")),
+    ({}, ("body", "ideas")),
+    ({"ideas": "not a list"}, ("body", "ideas")),
+    ([], ("body",)),
+])
+async def test_validation_errors(body, loc):
+    request, _, _ = make_request(json.dumps(body).encode(), 5)
+    with pytest.raises(RequestValidationError) as error:
+        await ingest.read_idea_batch(request)
+    assert error.value.errors()[0]["loc"] == loc
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("body", [b"", b"{", b'{"ideas": [{"idea": "a"},]}', b'{"ideas": []} x', b'{"ideas": [}', b'{"ideas": [] "x": 1}', b'{"ideas": ["\xff"]}'])
+async def test_invalid_json(body):
+    request, _, _ = make_request(body, 4)
+    with pytest.raises(RequestValidationError) as error:
+        await ingest.read_idea_batch(request)
+    assert error.value.errors()[0]["type"] == "json_invalid"
+
+@pytest.mark.asyncio
+async def test_binary_body():
+    msgpack = pytest.importorskip("msgpack")
+    request, _, _ = make_request(msgpack.packb(PAYLOAD), 1000, content_type="application/msgpack")
+    batch = await ingest.read_idea_batch(request)
+    assert batch.texts == ["Make onboarding faster", "42", "Überall schnellere Antworten 🚀"]
+
+INVALID_IDEAS = [
+    [{"id": 1}],
+    ["not an object"],
+    [None],
+    [{"idea": "a", "id": []}],
+    [{"idea": "a", "id": 1.5}],
+    [{"idea": "a", "author_id": {"x": 1}}],
+]
+
+@pytest.mark.parametrize("ideas", INVALID_IDEAS)
+def test_fast_validation_errors_match_models(ideas):
+    from pydantic import TypeAdapter, ValidationError
+    from app.api.v1 import validation
+    from app.api.v1.models.request import IdeaInput
+    
+    with pytest.raises(ValidationError) as fast:
+        validation.IDEAS.validate_python(ideas)
+    with pytest.raises(ValidationError) as model:
+        TypeAdapter(List[IdeaInput]).validate_python(ideas)
+    assert fast.value.errors() == model.value.errors()
+    
+    body = json.dumps({"ideas": ideas, "advanced_features": {"relationship_graph_top_k": 0}})
+    with pytest.raises(ValidationError) as fast:
+        validation.IDEA_REQUEST.validate_json(body)
+    with pytest.raises(ValidationError) as model:
+        IdeaRequest.model_validate_json(body)
+    assert fast.value.errors() == model.value.errors()
+
+def test_fast_validation_values_match_models():
+    from app.api.v1 import validation
+    
+    data = validation.IDEA_REQUEST.validate_json(json.dumps(PAYLOAD))
+    expected = IdeaRequest.model_validate_json(json.dumps(PAYLOAD))
+    assert data["ideas"] == [idea.model_dump(exclude_unset=True) for idea in expected.ideas]
+    assert data["advanced_features"] == expected.advanced_features
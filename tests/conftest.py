@@ -14,7 +14,7 @@ sys.path.insert(0, project_root)
 
 # Now we can import from app
 from app.api.v1.models.request import IdeaInput
-from app.services.types import Results, PlotData, RankedIdea, ClusterName
+from app.services.types import AnalysisResult, RankedIdea, ClusterName
 
 # Configure pytest-asyncio
 def pytest_configure(config):
@@ -81,7 +81,7 @@ def realistic_ideas() -> List[IdeaInput]:
 @pytest.fixture
 def mock_centroid_analysis(monkeypatch):
     """Basic mock for centroid analysis with realistic but simplified data"""
-    def mock_analysis(ideas: List[str]) -> Tuple[Results, PlotData]:
+    def mock_analysis(ideas: List[str]) -> AnalysisResult:
         # Simplified but realistic similarity scores
         similarity_scores = [
             0.92,  # Automated support
@@ -90,44 +90,37 @@ def mock_centroid_analysis(monkeypatch):
             0.82,  # Complaint tracking
         ]
         
-        results = Results(
+        return AnalysisResult(
             ideas=ideas,
-            similarity=similarity_scores[:len(ideas)],
-            distance=[1 - score for score in similarity_scores[:len(ideas)]]
-        )
-        
-        plot_data = PlotData(
-            scatter_points=[
+            order=list(range(len(ideas))),
+            similarity=similarity_scores[:len(ideas)] + [1.0],
+            distance=[1 - score for score in similarity_scores[:len(ideas)]] + [0.0],
+            coords=[
                 [0.8, 0.3],   # Automated support
                 [-0.7, 0.6],  # Feedback surveys
                 [-0.2, -0.8], # Training program
                 [-0.5, 0.5],  # Complaint tracking
                 [0.0, 0.0]    # Centroid
             ][:len(ideas) + 1],
-            marker_sizes=similarity_scores[:len(ideas)],
-            ideas=ideas,
             pairwise_similarity=[
-                [1.0, 0.75, 0.62, 0.70],  # Automated support similarities
-                [0.75, 1.0, 0.58, 0.85],  # Feedback survey similarities
-                [0.62, 0.58, 1.0, 0.65],  # Training program similarities
-                [0.70, 0.85, 0.65, 1.0]   # Complaint tracking similarities
+                [1.0, 0.75, 0.62, 0.70, 0.92],  # Automated support similarities
+                [0.75, 1.0, 0.58, 0.85, 0.88],  # Feedback survey similarities
+                [0.62, 0.58, 1.0, 0.65, 0.85],  # Training program similarities
+                [0.70, 0.85, 0.65, 1.0, 0.82],  # Complaint tracking similarities
+                [0.92, 0.88, 0.85, 0.82, 1.0]   # Centroid similarities
+            ],
+            cluster_labels=[0, 1, 1, 1][:len(ideas)],  # Two logical clusters
+            cluster_points=[
+                [0.8, 0.3],   # Automated support
+                [-0.7, 0.6],  # Feedback surveys
+                [-0.2, -0.8], # Training program
+                [-0.5, 0.5]   # Complaint tracking
             ][:len(ideas)],
-            kmeans_data={
-                "data": [
-                    [0.8, 0.3],   # Automated support
-                    [-0.7, 0.6],  # Feedback surveys
-                    [-0.2, -0.8], # Training program
-                    [-0.5, 0.5]   # Complaint tracking
-                ][:len(ideas)],
-                "centers": [
-                    [0.8, 0.3],   # Digital Solutions center
-                    [-0.6, 0.5]   # Customer Feedback center
-                ],
-                "cluster": [0, 1, 1, 1][:len(ideas)]  # Two logical clusters
-            }
+            cluster_centers=[
+                [0.8, 0.3],   # Digital Solutions center
+                [-0.6, 0.5]   # Customer Feedback center
+            ]
         )
-        
-        return results, plot_data
     
     monkeypatch.setattr("app.services.analyzer.centroid_analysis", mock_analysis)
 
@@ -228,27 +221,21 @@ def mock_verify_token(monkeypatch):
 @pytest.fixture
 def mock_centroid_analysis_realistic(monkeypatch):
     """Mock for realistic centroid analysis"""
-    def mock_analysis(ideas: List[str]) -> Tuple[Results, PlotData]:
-        similarity_scores = [0.95, 0.92, 0.88, 0.85, 0.82, 0.78, 0.75, 0.72]
+    def mock_analysis(ideas: List[str]) -> AnalysisResult:
+        similarity_scores = [0.95, 0.92, 0.88, 0.85, 0.82, 0.78, 0.75, 0.72][:len(ideas)]
+        matrix = _generate_realistic_similarity_matrix(len(ideas))
         
-        results = Results(
+        return AnalysisResult(
             ideas=ideas,
-            similarity=similarity_scores[:len(ideas)],
-            distance=[1 - score for score in similarity_scores[:len(ideas)]]
+            order=list(range(len(ideas))),
+            similarity=similarity_scores + [1.0],
+            distance=[1 - score for score in similarity_scores] + [0.0],
+            coords=[[0.1 * i, 0.1 * i] for i in range(len(ideas) + 1)],
+            pairwise_similarity=[row + [score] for row, score in zip(matrix, similarity_scores)] + [similarity_scores + [1.0]],
+            cluster_labels=[i % 3 for i in range(len(ideas))],
+            cluster_points=[[0.1 * i, 0.1 * i] for i in range(len(ideas))],
+            cluster_centers=[[0.2, 0.2], [0.5, 0.5], [0.8, 0.8]]
         )
-        
-        plot_data = PlotData(
-            scatter_points=[[0.1 * i, 0.1 * i] for i in range(len(ideas) + 1)],
-            marker_sizes=similarity_scores[:len(ideas)],
-            ideas=ideas,
-            pairwise_similarity=_generate_realistic_similarity_matrix(len(ideas)),
-            kmeans_data={
-                "data": [[0.1 * i, 0.1 * i] for i in range(len(ideas))],
-                "centers": [[0.2, 0.2], [0.5, 0.5], [0.8, 0.8]],
-                "cluster": [i % 3 for i in range(len(ideas))]
-            }
-        )
-        return results, plot_data
     
     monkeypatch.setattr("app.services.analyzer.centroid_analysis", mock_analysis)
 
@@ -300,3 +287,11 @@ def reset_rate_limits():
     """Reset rate limits between test sessions"""
     yield
     time.sleep(1)  # Small delay between tests
+
+@pytest.fixture(autouse=True)
+def clear_analysis_cache():
+    """Start every test without cached analyses, so mocked analyses don't leak into other tests"""
+    from app.services.cache import analysis_cache
+    analysis_cache.clear()
+    yield
+    analysis_cache.clear()
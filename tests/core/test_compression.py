@@ -0,0 +1,149 @@
+import gzip
+import json
+import zlib
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from fastapi.testclient import TestClient
+
+from app.core.compression import CompressionMiddleware, RequestDecompressionMiddleware, select_encoding
+
+BODY = "similar ideas " * 1000
+
+
+def make_client(**options) -> TestClient:
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, **options)
+    
+    @app.get("/large")
+    def large():
+        return PlainTextResponse(BODY)
+    
+    @app.get("/small")
+    def small():
+        return PlainTextResponse("short")
+    
+    @app.get("/parquet")
+    def parquet():
+        return Response(BODY, media_type="application/vnd.apache.parquet")
+    
+    @app.get("/stream")
+    def stream():
+        return StreamingResponse((BODY for _ in range(3)), media_type="application/x-ndjson")
+    
+    return TestClient(app)
+
+@pytest.mark.parametrize("accept_encoding,expected", [
+    ("", None),
+    ("identity", None),
+    ("gzip", "gzip"),
+    ("gzip, deflate, br, zstd", "zstd"),
+    ("br;q=0.5, gzip", "br"),
+    ("zstd;q=0, gzip", "gzip"),
+    ("*", "zstd"),
+    ("*, zstd;q=0", "br"),
+])
+def test_select_encoding(accept_encoding, expected):
+    assert select_encoding(accept_encoding, ["zstd", "br", "gzip"]) == expected
+
+@pytest.mark.parametrize("thread_threshold", [1, 10 ** 9])
+def test_gzip(thread_threshold):
+    client = make_client(encodings=["gzip"], thread_threshold=thread_threshold)
+    response = client.get("/large", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert int(response.headers["content-length"]) < len(BODY)
+    assert response.text == BODY
+
+def test_zstd_and_brotli():
+    zstandard = pytest.importorskip("zstandard")
+    brotli = pytest.importorskip("brotli")
+    client = make_client()
+    
+    response = client.get("/large", headers={"Accept-Encoding": "zstd"})
+    assert response.headers["content-encoding"] == "zstd"
+    
+    # Decode manually, independent of the test client's decoders
+    with client.stream("GET", "/large", headers={"Accept-Encoding": "zstd"}) as raw:
+        assert zstandard.ZstdDecompressor().decompressobj().decompress(b"".join(raw.iter_raw())).decode() == BODY
+    with client.stream("GET", "/large", headers={"Accept-Encoding": "br"}) as raw:
+        assert raw.headers["content-encoding"] == "br"
+        assert brotli.decompress(b"".join(raw.iter_raw())).decode() == BODY
+
+def test_not_compressed():
+    client = make_client(encodings=["gzip"])
+    assert "content-encoding" not in client.get("/small", headers={"Accept-Encoding": "gzip"}).headers
+    assert "content-encoding" not in client.get("/large", headers={"Accept-Encoding": "identity"}).headers
+    assert "content-encoding" not in client.get("/parquet", headers={"Accept-Encoding": "gzip"}).headers
+
+def test_streaming():
+    client = make_client(encodings=["gzip"])
+    with client.stream("GET", "/stream", headers={"Accept-Encoding": "gzip"}) as response:
+        assert response.headers["content-encoding"] == "gzip"
+        assert "content-length" not in response.headers
+        assert gzip.decompress(b"".join(response.iter_raw())).decode() == BODY * 3
+
+def test_unknown_encoding():
+    with pytest.raises(ValueError):
+        make_client(encodings=["deflate"]).get("/small")
+
+def make_upload_client(max_size: int = 1_000_000) -> TestClient:
+    app = FastAPI()
+    app.add_middleware(RequestDecompressionMiddleware, max_size=max_size)
+    
+    @app.post("/echo")
+    async def echo(request: Request):
+        body = await request.body()
+        return {"size": len(body), "content_encoding": request.headers.get("content-encoding"), "json": json.loads(body)}
+    
+    return TestClient(app)
+
+PAYLOAD = {"ideas": [{"idea": f"Idea {i}"} for i in range(1000)]}
+
+def test_gzip_request():
+    body = json.dumps(PAYLOAD).encode()
+    response = make_upload_client().post("/echo", content=gzip.compress(body), headers={"Content-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.json() == {"size": len(body), "content_encoding": None, "json": PAYLOAD}
+
+def test_zstd_request():
+    zstandard = pytest.importorskip("zstandard")
+    body = json.dumps(PAYLOAD).encode()
+    response = make_upload_client().post("/echo", content=zstandard.ZstdCompressor().compress(body), headers={"Content-Encoding": "zstd"})
+    assert response.status_code == 200
+    assert response.json()["json"] == PAYLOAD
+
+    # Concatenated frames are one body
+    half = len(body) // 2
+    frames = zstandard.ZstdCompressor().compress(body[:half]) + zstandard.ZstdCompressor().compress(body[half:])
+    response = make_upload_client().post("/echo", content=frames, headers={"Content-Encoding": "zstd"})
+    assert response.json()["json"] == PAYLOAD
+
+@pytest.mark.parametrize("encoding", ["gzip", "zstd"])
+def test_decompression_bomb(encoding):
+    # 200MB of zeros compress to a few hundred KB
+    if encoding == "zstd":
+        zstandard = pytest.importorskip("zstandard")
+        compressor = zstandard.ZstdCompressor().compressobj()
+    else:
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    chunk = bytes(1_000_000)
+    bomb = b"".join(compressor.compress(chunk) for _ in range(200)) + compressor.flush()
+    
+    response = make_upload_client(max_size=1_000_000).post("/echo", content=bomb, headers={"Content-Encoding": encoding})
+    assert response.status_code == 413
+
+def test_invalid_request_encoding():
+    client = make_upload_client()
+    assert client.post("/echo", content=b"not gzip", headers={"Content-Encoding": "gzip"}).status_code == 400
+    truncated = gzip.compress(json.dumps(PAYLOAD).encode())[:-20]
+    assert client.post("/echo", content=truncated, headers={"Content-Encoding": "gzip"}).status_code == 400
+    response = client.post("/echo", content=b"{}", headers={"Content-Encoding": "deflate"})
+    assert response.status_code == 415
+    assert "gzip" in response.headers["accept-encoding"]
+
+def test_truncated_zstd_request():
+    zstandard = pytest.importorskip("zstandard")
+    truncated = zstandard.ZstdCompressor().compress(json.dumps(PAYLOAD).encode())[:-20]
+    assert make_upload_client().post("/echo", content=truncated, headers={"Content-Encoding": "zstd"}).status_code == 400
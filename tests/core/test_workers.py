@@ -0,0 +1,41 @@
+import os
+
+import pytest
+from fastapi import HTTPException
+
+from app.core.workers import AnalysisPool
+
+
+@pytest.fixture
+def pool():
+    pool = AnalysisPool(1, initializer=None)
+    pool.start()
+    yield pool
+    pool.shutdown()
+
+@pytest.mark.asyncio
+async def test_runs_in_worker_process(pool):
+    assert pool.running
+    assert await pool.run(os.getpid) != os.getpid()
+    assert await pool.run(sum, [1, 2, 3]) == 6
+
+@pytest.mark.asyncio
+async def test_runs_in_threadpool_without_workers():
+    pool = AnalysisPool(0)
+    pool.start()
+    assert not pool.running
+    assert await pool.run(os.getpid) == os.getpid()
+
+@pytest.mark.asyncio
+async def test_worker_exceptions_are_raised(pool):
+    with pytest.raises(ValueError):
+        await pool.run(int, "not a number")
+
+@pytest.mark.asyncio
+async def test_broken_pool_is_restarted(pool):
+    """A worker dying fails its request with 503; the next requests get a fresh pool"""
+    with pytest.raises(HTTPException) as error:
+        await pool.run(os._exit, 1)
+    assert error.value.status_code == 503
+    assert pool.running
+    assert await pool.run(sum, [1, 2]) == 3
@@ -0,0 +1,47 @@
+import numpy as np
+from sklearn.feature_extraction.text import CountVectorizer
+
+from app.services.analyzer import Analyzer, centroid_analysis
+from app.services.cache import analysis_key
+
+IDEAS = [
+    "Implement a customer feedback system to gather real-time insights",
+    "Create an automated email response system for customer inquiries",
+    "Develop a mobile app for customer support",
+    "Set up a customer satisfaction survey program",
+    "Launch employee training program for better customer service",
+    "Optimize the website loading speed for better user experience",
+    "Offer a loyalty program that rewards repeat customers",
+    "Hold monthly workshops where employees share customer stories",
+]
+
+def variant(ideas):
+    """The same ideas as far as the cache is concerned: other case and whitespace"""
+    return ["  " + idea.upper().replace(" ", "   ") + "\n" for idea in ideas]
+
+def choose_k(ideas):
+    analyzer = Analyzer(ideas, CountVectorizer())
+    analyzer.pairwise_distance = np.random.RandomState(0).rand(len(ideas) + 1, len(ideas) + 1)
+    n_clusters, labels = analyzer.perform_kmeans_analysis()
+    assert len(set(labels)) == n_clusters
+    return n_clusters
+
+def test_k_choice_is_deterministic_but_uses_both_estimates(monkeypatch):
+    monkeypatch.setattr(Analyzer, "find_optimal_clusters", lambda self: (2, 3))
+    idea_sets = [[f"Idea {i}.{j}" for j in range(8)] for i in range(20)]
+
+    chosen = [choose_k(ideas) for ideas in idea_sets]
+    assert chosen == [choose_k(ideas) for ideas in idea_sets]
+    assert set(chosen) == {2, 3}
+
+def test_k_choice_follows_the_cache_key(monkeypatch):
+    monkeypatch.setattr(Analyzer, "find_optimal_clusters", lambda self: (2, 3))
+    for i in range(20):
+        ideas = [f"Idea {i}.{j}" for j in range(8)]
+        assert choose_k(ideas) == choose_k(variant(ideas))
+
+def test_ideas_sharing_a_cache_key_get_the_same_clusters():
+    assert analysis_key(IDEAS) == analysis_key(variant(IDEAS))
+    original, varied = centroid_analysis(IDEAS), centroid_analysis(variant(IDEAS))
+    assert np.array_equal(original.cluster_labels, varied.cluster_labels)
+    assert np.array_equal(original.order, varied.order)
@@ -0,0 +1,131 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from app.services.analyzer import centroid_analysis
+from app.services.cache import AnalysisCache, DiskBackend, MemoryBackend, SingleFlight, analysis_key
+
+IDEAS = [
+    "Implement a customer feedback system to gather real-time insights",
+    "Create an automated email response system for customer inquiries",
+    "Develop a mobile app for customer support",
+    "Set up a customer satisfaction survey program",
+    "Launch employee training program for better customer service",
+]
+
+def entry(size: int):
+    return {"values": np.zeros(size // 8)}
+
+def test_key_ignores_case_and_whitespace():
+    assert analysis_key(IDEAS) == analysis_key([f"  {idea.upper()}\n" for idea in IDEAS])
+    assert analysis_key(IDEAS) != analysis_key(IDEAS[::-1])
+    assert analysis_key(IDEAS) != analysis_key(IDEAS[:-1])
+    # Idea boundaries count
+    assert analysis_key(["a b", "c"]) != analysis_key(["a", "b c"])
+
+def test_analysis_is_deterministic():
+    first, second = centroid_analysis(IDEAS), centroid_analysis(IDEAS)
+    for name, array in first.arrays().items():
+        assert np.array_equal(array, second.arrays()[name]), name
+
+def test_memory_evicts_least_recently_used():
+    backend = MemoryBackend(max_bytes=2400)
+    backend.set("a", entry(800))
+    backend.set("b", entry(800))
+    backend.set("c", entry(800))
+    assert backend.get("a") is not None  # b is now the least recently used
+    backend.set("d", entry(800))
+
+    assert backend.get("b") is None
+    assert all(backend.get(key) is not None for key in "acd")
+    stats = backend.stats()
+    assert stats["entries"] == 3 and stats["bytes"] == 2400 and stats["evictions"] == 1
+
+    # Too large to cache at all
+    backend.set("huge", entry(4000))
+    assert backend.get("huge") is None
+
+def test_disk_survives_restart_and_evicts(tmp_path):
+    backend = DiskBackend(str(tmp_path), max_bytes=10_000_000)
+    backend.set("a", {"values": np.arange(10.0)})
+    assert np.array_equal(backend.get("a")["values"], np.arange(10.0))
+
+    reopened = DiskBackend(str(tmp_path), max_bytes=10_000_000)
+    assert np.array_equal(reopened.get("a")["values"], np.arange(10.0))
+    assert not list(tmp_path.glob("*.tmp"))
+
+    reopened.max_bytes = reopened.stats()["bytes"]
+    reopened.set("b", {"values": np.arange(10.0)})
+    assert reopened.get("a") is None and reopened.get("b") is not None
+
+    reopened.clear()
+    assert not list(tmp_path.iterdir())
+
+@pytest.mark.asyncio
+async def test_results_are_rebuilt_around_the_callers_ideas(tmp_path):
+    memory = MemoryBackend(max_bytes=100_000_000)
+    cache = AnalysisCache([memory, DiskBackend(str(tmp_path), max_bytes=100_000_000)])
+    analysis = centroid_analysis(IDEAS)
+    key = analysis_key(IDEAS)
+
+    assert await cache.get(key, IDEAS) is None
+    await cache.set(key, analysis)
+    shouting = [idea.upper() for idea in IDEAS]
+    cached = await cache.get(analysis_key(shouting), shouting)
+
+    assert cached.ideas == shouting
+    assert np.array_equal(cached.order, analysis.order)
+    assert np.allclose(cached.pairwise_similarity, analysis.pairwise_similarity)
+
+    # Disk hits are promoted to memory
+    memory.clear()
+    assert await cache.get(key, IDEAS) is not None
+    assert memory.stats()["entries"] == 1
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 1
+
+@pytest.mark.asyncio
+async def test_disabled_cache_stores_nothing():
+    cache = AnalysisCache([])
+    await cache.set("key", centroid_analysis(IDEAS))
+    assert await cache.get("key", IDEAS) is None
+    assert cache.stats() == {"enabled": False, "hits": 0, "misses": 0, "tiers": []}
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_one_computation():
+    flights = SingleFlight()
+    started = []
+    release = asyncio.Event()
+
+    async def compute():
+        started.append(1)
+        await release.wait()
+        return "result"
+
+    waiting = [asyncio.ensure_future(flights.run("key", compute)) for _ in range(3)]
+    other = asyncio.ensure_future(flights.run("other", compute))
+    await asyncio.sleep(0.01)
+    assert len(started) == 2 and flights.in_flight == 2
+
+    # A caller that gives up doesn't cancel it for the others
+    waiting[0].cancel()
+    release.set()
+    assert await asyncio.gather(*waiting[1:], other) == ["result"] * 3
+    assert flights.in_flight == 0
+
+    # Finished flights aren't reused
+    await flights.run("key", compute)
+    assert len(started) == 3
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_failures():
+    flights = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("failed")
+
+    results = await asyncio.gather(flights.run("key", fail), flights.run("key", fail), return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
+    assert results[0] is results[1]
+    assert flights.in_flight == 0
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from app.services.analyzer import centroid_analysis
+from app.services.incremental import append_ideas, idea_features, needs_reanalysis
+from app.services.similarity import normalize_rows
+
+IDEAS = [
+    "Implement a customer feedback system to gather real-time insights",
+    "Create an automated email response system for customer inquiries",
+    "Develop a mobile app for customer support",
+    "Set up a customer satisfaction survey program",
+    "Launch employee training program for better customer service",
+    "Optimize the website loading speed for better user experience",
+    "Offer a loyalty program that rewards repeat customers",
+    "Hold monthly workshops where employees share customer stories",
+]
+NEW_IDEAS = [
+    "Add a live chat to the customer support website",
+    "Reward employees for great customer feedback",
+]
+
+@pytest.fixture(scope="module")
+def analysis():
+    return centroid_analysis(IDEAS)
+
+def test_append_matches_ranking_in_the_same_feature_space(analysis):
+    appended = append_ideas(analysis, NEW_IDEAS)
+    ideas = IDEAS + NEW_IDEAS
+    assert appended.ideas == ideas
+    assert len(appended) == len(ideas)
+    assert sorted(appended.order.tolist()) == list(range(len(ideas)))
+
+    # The same as ranking all ideas by their similarity to the centroid, with the analysis' vocabulary
+    features = idea_features(ideas, analysis.vocabulary)
+    centroid = features.mean(axis=0)
+    similarity = normalize_rows(features) @ normalize_rows(centroid[np.newaxis, :])[0]
+    assert np.allclose(appended.centroid, centroid)
+    assert np.allclose(appended.similarity[:-1], similarity[appended.order])
+    assert np.all(np.diff(appended.similarity[:-1]) <= 1e-12)
+    # Vectors stay in ranked order, with the centroid last
+    assert np.allclose(appended.vectors[:-1], normalize_rows(features)[appended.order])
+    assert np.allclose(appended.similarity_rows(0, len(ideas) + 1)[:, -1], appended.similarity)
+
+def test_new_ideas_join_existing_clusters(analysis):
+    appended = append_ideas(analysis, NEW_IDEAS)
+    assert set(appended.cluster_labels.tolist()) <= set(analysis.cluster_labels.tolist())
+    # Existing ideas keep their clusters and positions
+    old_clusters = dict(zip(analysis.order.tolist(), analysis.cluster_labels.tolist()))
+    new_clusters = dict(zip(appended.order.tolist(), appended.cluster_labels.tolist()))
+    assert all(new_clusters[i] == cluster for i, cluster in old_clusters.items())
+    assert np.isfinite(appended.coords).all() and appended.coords.shape == (len(IDEAS) + len(NEW_IDEAS) + 1, 2)
+    assert np.array_equal(appended.coords[-1], analysis.coords[-1])
+    assert appended.cluster_points.shape == (len(IDEAS) + len(NEW_IDEAS), 2)
+
+def test_reanalysis_threshold():
+    assert not needs_reanalysis(100, 24)
+    assert needs_reanalysis(100, 25)